@@ -0,0 +1,1450 @@
+import os
+import io
+import re
+import sys
+import json
+import numpy as np
+import pandas as pd
+from scipy import stats
+from pygam import LinearGAM, s
+from matplotlib.figure import Figure
+import logging as log
+from plate import Plate, well_positions, row_mask, row_label, column_label
+from ingest import read_plates
+from kernels import resample_plate, needs_resampling, stack_plates, control_factors, steepest_slope, doubling_time, first_crossing, nonnegative_start, robust_baseline, tangent_lag, derivative_curves, smooth_curves, phase_labels, phase_segments, PHASES, replicate_outliers, plate_trend, checkerboard_synergy, curve_clusters
+
+#https://stackoverflow.com/questions/31836104/pyinstaller-and-onefile-how-to-include-an-image-in-the-exe-file
+def resource_path(relative_path):
+    """ Get absolute path to resource (e.g files), works for dev and for PyInstaller """
+    log.info('Getting absolute path to resource')
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception as e:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        log.warning(f'Error: {e}')
+    log.debug(f'Resource Path: {os.path.join(base_path, relative_path)}')
+    return os.path.join(base_path, relative_path)
+
+#Parameters that are not part of the original layout format (set in the advanced settings window).
+#Layouts saved before a parameter was introduced use its default value
+ADVANCED_DEFAULTS={'time_step':'', 'rate_window':'5', 'rate_min_signal':'5', 'phase_threshold':'10', 'derivative_method':'Savitzky-Golay',
+                   'spline_penalty':'1', 'smoother':'GAM', 'smooth_window':'7', 'outlier_threshold':'3.5', 'exclude_outliers':0,
+                   'edge_correction':'None', 'row_conc':'', 'synergy_metric':'max_yield', 'synergy_cutoff':'10',
+                   'control_wells':'', 'control_reference':'', 'clusters':'', 'cluster_dims':'3'}
+
+#Precision of the plate values during the analysis - float64 keeps the metrics identical to the dataframe based pipeline
+PLATE_DTYPE=np.float64
+
+#Metrics that can be used for checkerboard synergy calculations
+SYNERGY_METRICS=('max_yield', 'AUC', 'slope', 'mu_max')
+
+#Metric of the LOEC calculations ('% PC lag', 'ANOVA AUC', ...) and the comparisons of the samples to the positive control
+#cutoff for the LOEC and NOEC calls of the '% PC' calculations
+LOWEC_METRICS={'lag':'lag_len', 'AUC':'AUC', 'yield':'max_yield', 'slope':'slope'}
+LOWEC_TESTS={'lag':(np.greater, np.less), 'AUC':(np.less_equal, np.greater_equal), 'yield':(np.less_equal, np.greater),
+             'slope':(np.less_equal, np.greater)}
+
+class AnalysisError(Exception):
+    """Error in an analysis stage. Raised instead of exiting, so that the GUI can show it and batch runs
+    can record the failure of a single plate and continue with the others."""
+
+
+#Parameters read by the preprocess and smooth stages (see compare.StageCache). The replicate variances calculated in the
+#preprocess stage also depend on the lag parameters (LAG_PARAMS).
+PREPROCESS_PARAMS=('time_step', 'reps', 'avg', 'exclude_outliers', 'outlier_threshold', 'bg', 'col_num', 'edge_correction', 'control_wells',
+                   'control_reference', 'rate_window', 'rate_min_signal', 'derivative_method', 'spline_penalty', 'phase_threshold')
+LAG_PARAMS=('lag_calc', 'lag_calc_input')
+SMOOTH_PARAMS=('smoothen', 'smoother', 'smooth_window')
+#Parameters of the LOEC/NOEC and MIC statistics, which are calculated from the metrics only
+LOWEC_PARAMS=('lowec_calc', 'lowec_calc_input')
+MIC_PARAMS=('mic_calc', 'mic_calc_input')
+
+#Names of the results returned by GrowthAnalysis.growth_metrics, in order
+RESULT_NAMES=['metrics', 'df', 'gams', 'shifted_gams', 'df_raw', 'lowecs', 'noecs', 'mics', 'conc_dict', 'std_dict', 'phases', 'derivative', 'log_derivative', 'outliers', 'edge_correction', 'synergy', 'normalization']
+
+def load_layouts():
+    """Load default plate layouts"""
+    log.info('Loading default layouts')
+    with open(resource_path('default_layouts.txt'), 'r') as f:
+        return json.load(f)
+
+def read_plate(filename, buffer=None, sheet=None):
+    """Read plate export (.xlsx or .csv) into dataframe ('Hour' column followed by one column per well), detecting the
+    header row and time column. Workbooks with several plates are read from the given sheet (default: the first plate).
+    If a buffer (file-like object) is given, it is read instead of the file, filename then only determines the format.
+    Raises AnalysisError for files that cannot be read or contain no plate."""
+    log.info(f'Reading {filename}')
+    try:
+        plates=read_plates(filename, buffer)
+        if len(plates)==0:
+            raise ValueError(f'No plate table (header with well names such as A01) found in {filename}')
+        if sheet is None:
+            return plates[0][1]
+        for name, df in plates:
+            if name==str(sheet):
+                return df
+        raise ValueError(f'Sheet {sheet} of {filename} does not contain a plate')
+    except Exception as e:
+        log.critical(f'Error: {e}')
+        raise AnalysisError(f'read_plate: {e}') from e
+
+
+class GrowthAnalysis:
+    """Growth curve analysis pipeline, independent of the GUI. Plate layout and calculation parameters
+    are provided as dictionary in the format of default_layouts.txt (see MainWindow.layout_params)"""
+    def __init__(self, params):
+        log.info('Initializing growth analysis')
+        self.params={**ADVANCED_DEFAULTS, **params}
+        self.reps_in_rows=False
+        self.reps_in_cols=False
+        self.std_calculated=False
+
+    def growth_metrics(self, filename):
+        """Wrapper function for processing xlsx omnilog input and calculating growth curve metrics"""
+        log.info('Calculating growth metrics wrapper function')
+        return self.analyse(read_plate(filename))
+
+    def analyse(self, df):
+        """Process plate dataframe ('Hour' column followed by one column per well) and calculate growth curve metrics"""
+        log.info('Analysing plate')
+        return self.evaluate(self.smoothen(self.preprocess(df)))
+
+    def preprocess(self, df):
+        """First analysis stage: resampling, replicate variance and outliers, averaging, background substraction,
+        edge correction, normalization and growth phases. Returns the intermediate results as dictionary."""
+        log.info('Preprocessing plate')
+        df_raw=df.copy(deep=True)
+        plate=self.resample(df)
+
+        #Calculate variance between replicates and flag outlier wells if replicates are provided
+        if self.params['reps']!='':
+            std_dict=self.get_replicate_variance(plate)
+            outliers=self.detect_outliers(plate)
+        else:
+            std_dict=None
+            outliers=None
+
+        if self.params['avg']==1 and self.params['reps']!='':
+            if self.params['exclude_outliers']==1:
+                #Excluded wells are set to NaN, which the replicate mean skips
+                excluded=plate.index(outliers.loc[outliers['outlier'], 'well'])
+                values=plate.values.copy()
+                values[excluded]=np.nan
+                plate=plate.with_values(values)
+            plate=self.average_replicates(plate, self.params['reps'])
+        if self.params['bg']!='':
+            plate=self.substract_background(plate, self.params['bg'], self.params['avg']==1)
+
+        #Remove plate position trends (e.g. evaporation at the plate edges) if requested
+        if self.params['edge_correction']!='None':
+            plate, edge_correction=self.correct_edge_effects(plate)
+        else:
+            edge_correction=None
+
+        #Scale curves onto a common reference with control wells shared between plates
+        if self.params['control_wells']!='':
+            plate, normalization=self.normalize_to_controls(plate)
+        else:
+            normalization=None
+
+        #Segment curves into growth phases - before smoothing, as the monotonic GAM hides declines
+        derivatives=self.calculate_derivatives(plate)
+        phases, phase_metrics=self.segment_phases(plate, derivatives)
+
+        return {'df_raw':df_raw, 'plate':plate, 'smoothed':None, 'derivatives':derivatives, 'std_dict':std_dict, 'outliers':outliers,
+                'edge_correction':edge_correction, 'normalization':normalization, 'phases':phases, 'phase_metrics':phase_metrics}
+
+    def resample(self, df):
+        """Create plate from dataframe, aligning the curves to a regular time grid if requested - plates with missing reads
+        or irregular read intervals are always resampled"""
+        if self.params['time_step']!='':
+            df=resample_plate(df, step=float(self.params['time_step']))
+        elif needs_resampling(df):
+            df=resample_plate(df)
+
+        #All stages work on the plate arrays, dataframes are only created for the results
+        return Plate.from_frame(df, dtype=PLATE_DTYPE)
+
+    def smoothen(self, state):
+        """Second analysis stage: smooth and shift curves and recalculate their derivatives, if smoothing is selected"""
+        log.info('Smoothening plate')
+        if self.params['smoothen']==1:
+            state['plate']=self.set_to_zero(state['plate'])
+            state['smoothed']=self.shift_curves(self.smooth(state['plate']))
+            state['derivatives']=self.calculate_derivatives(state['smoothed'])
+        return state
+
+    def evaluate(self, state):
+        """Last analysis stage: metrics, synergy, LOEC/NOEC, MIC and concentrations. Returns all results (see RESULT_NAMES)"""
+        log.info('Evaluating plate')
+        plate=state['plate']
+        derivatives=state['derivatives']
+        if state['smoothed'] is not None:
+            metrics=self.calculate_metrics(state['smoothed'], derivatives)
+            #The smoothened curves are reported after shifting
+            shifted_gams=state['smoothed'].to_frame()
+            gams=shifted_gams
+        else:
+            metrics=self.calculate_metrics(plate, derivatives)
+            gams=''
+            shifted_gams=''
+
+        metrics=metrics.merge(state['phase_metrics'], on='sample', how='left')
+        metrics['outlier_wells']=self.count_outliers(metrics['sample'], state['outliers'])
+
+        #Curve shape clusters and embedding of the curves the metrics were calculated from
+        if self.params['clusters']!='':
+            curves=state['smoothed'] if state['smoothed'] is not None else plate
+            metrics=metrics.merge(self.cluster_curves(curves), on='sample', how='left')
+
+        #Two drug checkerboards: concentrations of the second drug along the rows
+        if self.params['row_conc']!='':
+            synergy_wells, synergy=self.calculate_synergy([(metrics, plate)])
+            metrics=metrics.merge(synergy_wells.drop(columns='plate'), on='sample', how='left')
+        else:
+            synergy=None
+
+        lowecs, noecs=self.lowec_statistics(metrics, plate)
+        mics=self.mic_statistics(metrics, plate)
+
+        if self.params['conc']!='':
+            conc_dict=self.match_concentrations()
+        else:
+            conc_dict=None
+
+        return metrics, plate.to_frame(), gams, shifted_gams, state['df_raw'], lowecs, noecs, mics, conc_dict, state['std_dict'], state['phases'], \
+            derivatives['derivative'].to_frame(), derivatives['log_derivative'].to_frame(), state['outliers'], state['edge_correction'], synergy, state['normalization']
+
+    def lowec_statistics(self, metrics, plate):
+        """LOEC and NOEC calls from the metrics of plate, None if not selected"""
+        if self.params['lowec_calc']!='None':
+            return self.calculate_lowec(metrics, plate)
+        return None, None
+
+    def mic_statistics(self, metrics, plate):
+        """MIC calls from the metrics of plate, None if not selected"""
+        if self.params['mic_calc']!='None':
+            return self.calculate_mic(metrics, plate)
+        return None
+
+    def match_concentrations(self):
+        """Match user provided concentrations with plate column numbers"""
+        log.info('Matching user provided concentrations')
+        try:
+            if self.params['pos']!='':
+                #Assumes positive controls to be at end or beginning of row, same layout for all rows
+                pos=self.params['pos'].split(',')
+                #Get positive control positions
+                if len(pos)>1 and not '+' in pos[0]:
+                    pos_cols={x.split(':')[0][-2:] for x in pos}
+                elif len(pos)>1 and '+' in pos[0]:
+                    pos_cols={y.strip()[-2:] for x in pos for y in x.strip().split(',')[0].split(':')[0].split('+')}
+                elif len(pos)==1 and '+' in pos[0]:
+                    pos_cols={y.strip()[-2:] for x in pos for y in x.strip().split(':')[0].split('+')}
+                elif len(pos)==1 and not '+' in pos[0]:
+                    pos_cols={x.split(':')[0] for x in pos}
+
+                conc_cols=int(self.params['col_num'])-len(pos_cols)
+
+                #match concentration list to plate column number based on where positive controls are located
+                #Again, this assumes that all positive controls are located either at the beginning or the end of a row
+                if any(x in [float(x) for x in list(pos_cols)] for x in [*range(1,5)]):
+                    pos_end=max([int(x) for x in list(pos_cols)])
+                    cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(pos_end, conc_cols+1)]
+                else:
+                    pos_end=min(list([int(x) for x in list(pos_cols)]))
+                    cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, pos_end+1)]
+
+            else:
+                cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.params['col_num'])+1)]   
+                
+            if ',' in self.params['conc']:
+                conc_dict={x[0].strip():str(x[1].strip())+self.params['conc_unit'] for x in zip(cols, self.params['conc'].split(','))}
+
+            elif ':' in self.params['conc']:
+                high_conc=float(self.params['conc'].split(':')[0].strip())
+                dilution_factor=float(self.params['conc'].split(':')[1].strip())
+                    
+                conc_dict={}
+                current_conc=high_conc
+                for i, c in enumerate(cols):
+                    if i>0:
+                        current_conc/=dilution_factor
+                        conc_dict[c]=str(round(current_conc,6))+self.params['conc_unit']
+                    else:
+                        conc_dict[c]=str(round(current_conc,6))+self.params['conc_unit']
+
+            return conc_dict
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'match_concentrations: {e}') from e
+
+    def check_input_integrity(self, filename):
+        """Takes plate layout parameters and input filename and checks integrity.
+        If input is not correct, and error is returned."""
+        log.info('Checking input integrity')
+        reps=self.params['reps']
+        bg=self.params['bg']
+        pos=self.params['pos']
+
+        errors=[]
+        rownames=['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        nl='\n'
+
+        #Check file
+        if os.path.isfile(os.path.normpath(filename)):
+            pass
+        else:
+            errors.append(f'Invalid filename. Use the browsing option{nl}to select the input file.')
+            log.warning(f'Invalid filename. Use the browsing option{nl}to select the input file.')
+        
+        #Check replicate row format
+        if reps!='':
+            #Check if replicates are supplied by row or by column
+            reps_in_rows, reps_in_cols=self.determine_replicate_setup(reps)
+
+            if reps_in_rows==True and reps_in_cols==False:
+                #Check if row separator is correct
+                if ':' in reps:
+                    #Check if different replicate pairs are separated correctly
+                    if ',' in reps:
+                        #Check that none of the lists after , is empty
+                        lens=[True if len(x.strip())>0 else False for x in reps.split(',')]
+                        if lens==False:
+                            errors.append(f'Invalid replicate entry:{nl}Entry missing after ",".')
+                            
+                        #Check that only one row is defined per ':' separator
+                        x=[len(x.strip()) for y in reps.split(',') for x in y.split(':')]
+                        if np.mean(x)!=1:
+                            errors.append(f'Invalid replicate entry:{nl}Only one rowname before ":" allowed')
+                            
+                    else:
+                        x=[len(x.strip()) for x in reps.split(':')]
+                        if np.mean(x)!=1:
+                            errors.append(f'Invalid replicate entry:{nl}Only one rowname before ":" allowed')
+                            
+
+                else:
+                    errors.append(f'Invalid replicate row separator:{nl}Enter rows that are replicates separated{nl}by ":".')
+                    
+
+            elif reps_in_rows==False and reps_in_cols==True:
+                #TODO: Build in check for this format here
+                pass
+        else:
+            pass
+
+        #Check background row format
+        if bg!='':
+            bgs=[]
+            samps=[]
+            #Check if row separator is correct
+            if ':' in bg:
+                #Check if different replicate pairs are separated correctly
+                if ',' in bg:
+                    #Check that none of the lists after , is empty #TODO: THIS IS NOT WORKING; CORRECT
+                    lens=[True if len(x.strip())>0 else False for x in bg.split(',')]
+                    if lens==False:
+                        errors.append(f'Invalid background entry:{nl}Entry missing after ",".')
+                    
+                    for e in bg.split(','):
+                        #Check that all values are valid row names and backgrounds
+                        #Samples do not overlap
+                        bgs.extend([x for x in e.strip().split(':')[1]])
+                        samps.extend([x for x in e.strip().split(':')[0]])
+
+                    if any(x.strip() in samps for x in bgs):
+                        errors.append(f'Invalid background entry:{nl}Background and sample rows overlap!')
+                        
+                else:
+                    
+                    #Check that all values are valid row names and backgrounds
+                    #Samples do not overlap
+                    bgs.extend([x for x in bg.strip().split(':')[1]])
+                    samps.extend([x for x in bg.strip().split(':')[0]])
+
+                    if any(x.strip() in samps for x in bgs):
+                        errors.append(f'Invalid background entry:{nl}Background and sample rows overlap!')
+            else:
+                errors.append(f'Invalid background row separator:{nl}Enter rows that are replicates separated{nl}by ":".')
+        else:
+            pass
+
+        #Check positive control well format (format should be eg: A11+A12:A)
+        #Meaning that well A11 and A12 provide positive controls for row A
+        if pos!='':
+            #Check if row separator is correct
+            if ':' in pos:
+                #Check if different replicate pairs are separated correctly
+                if ',' in pos:
+                    #Check that none of the lists after , is empty
+                    lens=[True if len(x.strip())>0 else False for x in pos.split(',')]
+                    if lens==False:
+                        errors.append(f'Invalid positive control entry. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+
+                    if not '+' in pos:
+                        #Check that all elements are correctly entered
+                        well_corr=[]
+                        row_corr=[]
+                        for e in pos.split(','):
+                            e=e.strip()
+                            if not e.split(':')[0].strip()[0] in rownames:
+                                errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                            if int(e.split(':')[0].strip()[1:])>12:
+                                errors.append(f'Invalid positive control column number.Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                                
+                    else:
+                        #Check that all elements are correctly entered
+                        well_corr=[]
+                        row_corr=[]
+                        for e in pos.split(','):
+                            e2=e.split(':')[0].strip()
+                            for e3 in e2.split('+'):
+                                if not e3[0] in rownames:
+                                    errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                                if int(e3[1:])>12:
+                                    errors.append(f'Invalid positive control column number. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                        
+                else:
+                    
+                    if not bg.strip().split(':')[0][0] in rownames:
+                        errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                    if int(bg.strip().split(':')[0][1:])>12:
+                        errors.append(f'Invalid positive control column number. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+                
+            else:
+                errors.append(f'Invalid positive control separator. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
+        else:
+            pass
+
+        #Check input for lag calculation field
+        if self.params['lag_calc_input']!='':
+            #This field takes only a float as input - so check that input is convertible to float
+            try:
+                float(self.params['lag_calc_input'].strip())
+            except:
+                log.error('Lag calculation threshold value must be a number!')
+                errors.append('Lag calculation threshold value must be a number!')
+
+        #Check input for lowec calculation field
+                
+        if self.params['lowec_calc']!='None':
+            if pos=='':
+                errors.append('Positive controls are needed in order to determine LOEC/NOEC concentrations!')
+
+        if self.params['lowec_calc']=='% PC lag':
+            try:
+                float(self.params['lowec_calc_input'])
+            except:
+                errors.append('Loec calculation threshold value for lag must be a number!')
+            if float(self.params['lowec_calc_input'])<=100:
+                errors.append('Loec calculation threshold for lag should be greater than 100%')
+        
+        elif self.params['lowec_calc']=='% PC AUC' or self.params['lowec_calc']=='% PC yield' \
+        or self.params['lowec_calc']=='% PC slope':
+            try:
+                float(self.params['lowec_calc_input'])
+            except:
+                errors.append('Loec calculation threshold value for AUC must be a number!')
+            if float(self.params['lowec_calc_input'])>=100:
+                errors.append('Loec calculation threshold for AUC should be smaller than 100%')   
+
+        
+        elif self.params['lowec_calc']=='ANOVA lag' or self.params['lowec_calc']=='ANOVA AUC' \
+        or self.params['lowec_calc']=='ANOVA yield' or self.params['lowec_calc']=='ANOVA yield':
+            
+            #Check that there are at least 2 positive controls per strain
+            if not ':' in pos:
+                errors.append('Positive controls are required for statistical testing!')
+
+            if ',' in pos:
+                if '+' in pos:
+                    replis=pos.split('+')
+                    if len(replis)<2:
+                        errors.append('minimum of 2 replicates required for statistical testing.')
+                else:
+                    replis=pos.split(',')
+                    if '' in replis or ' ' in replis:
+                        errors.append('Incorrect positive control input!')
+
+            #Check that there are at least 2 replicates per strain
+            if not ':' in reps:
+                errors.append('Replicates are required for statistical testing!')
+
+            if ',' in reps:
+                replis=[len(x.split(':')) for x in reps.split(',')]
+                if any(r < 2 for r in replis):
+                    errors.append('minimum of 2 replicates required for statistical testing.')
+            else:
+                replis=reps.split(':')
+                if len(replis)<2:
+                    errors.append('minimum of 2 replicates required for statistical testing.')
+        
+        #Check input for MIC calculation field
+        if self.params['mic_calc']!='None':
+            try:
+                float(self.params['mic_calc_input'])
+            except:
+                errors.append('MIC calculation threshold value must be a number.')
+
+        #Check input for concentration field
+        if self.params['conc']!='':
+            if ',' in self.params['conc'] and ':' in self.params['conc']:
+                errors.append('Provide either a list of concentrations, e.g 1, 2, 3, 4 ... , or highest concentration followed by dilution, e.g 12:4')
+
+            elif ',' in self.params['conc']:
+                try:
+                    [float(x.strip()) for x in self.params['conc'].split(',')]
+                except:
+                    errors.append('List of concentrations must consist of numbers only!')
+
+                #Check that length of list equals number of columns provided minus number of positive controls
+                #This assumes that the number of positive controls is equal for all rows!
+                if pos!='':
+                    num_pos=len(pos.split(',')[0].split('+'))
+                    if (int(self.params['col_num'])-num_pos)!=len(self.params['conc'].split(',')):
+                        errors.append('List of concentrations must be as long as number of used plate columns - number of positive controls per row')
+
+            else:
+                if ':' in self.params['conc']:
+                    if len(self.params['conc'].split(':'))>2:
+                        errors.append('For dilution series, provide highest concentration followed by dilution factor, e.g 12:4')
+                    else:
+                        try:
+                            [float(x) for x in self.params['conc'].split(':')]
+                        except:
+                            errors.append('Highest concentration and dilution must be provided as numbers.')
+                else:
+                    errors.append('Input to concentration field must be either a list of concentrations or highest concentration followed by dilution.')
+
+        #Check input for resampling interval
+        if self.params['time_step']!='':
+            try:
+                if float(self.params['time_step'])<=0:
+                    errors.append('Resample interval must be greater than 0!')
+            except:
+                errors.append('Resample interval must be a number!')
+
+        #Check input for growth rate calculation
+        try:
+            if int(self.params['rate_window'])<2:
+                errors.append('Growth rate window must be at least 2 timepoints!')
+        except:
+            errors.append('Growth rate window must be an integer!')
+        try:
+            float(self.params['rate_min_signal'])
+        except:
+            errors.append('Minimum signal for growth rate calculation must be a number!')
+
+        try:
+            if not 0<float(self.params['phase_threshold'])<100:
+                errors.append('Phase threshold must be between 0 and 100%!')
+        except:
+            errors.append('Phase threshold must be a number!')
+
+        if self.params['row_conc']!='':
+            if self.params['conc']=='':
+                errors.append(f'Checkerboard synergy requires concentrations{nl}of both drugs (columns and rows)!')
+            try:
+                self.concentration_values(self.params['row_conc'], 1)
+            except:
+                errors.append(f'Invalid row concentrations:{nl}Enter a comma separated list or highest concentration:dilution factor.')
+            try:
+                if not 0<float(self.params['synergy_cutoff'])<100:
+                    errors.append('Synergy cutoff must be between 0 and 100%!')
+            except:
+                errors.append('Synergy cutoff must be a number!')
+
+        if self.params['control_reference']!='':
+            try:
+                if float(self.params['control_reference'])<=0:
+                    errors.append('Control reference must be greater than 0!')
+            except:
+                errors.append('Control reference must be a number!')
+
+        if self.params['clusters']!='':
+            try:
+                if int(self.params['clusters'])<1 or int(self.params['cluster_dims'])<1:
+                    errors.append('Number of curve clusters and embedding dimensions must be at least 1!')
+            except:
+                errors.append('Number of curve clusters and embedding dimensions must be integers!')
+
+        try:
+            if float(self.params['outlier_threshold'])<=0:
+                errors.append('Outlier threshold must be greater than 0!')
+        except:
+            errors.append('Outlier threshold must be a number!')
+
+        if self.params['smoother']=='Savitzky-Golay':
+            try:
+                if int(self.params['smooth_window'])<3 or int(self.params['smooth_window'])%2==0:
+                    errors.append('Smoothing window must be an odd number of at least 3 timepoints!')
+            except:
+                errors.append('Smoothing window must be an integer!')
+
+        if self.params['derivative_method']=='Spline' or self.params['smoother']=='Spline':
+            try:
+                if float(self.params['spline_penalty'])<=0:
+                    errors.append('Spline penalty must be greater than 0!')
+            except:
+                errors.append('Spline penalty must be a number!')
+
+        #Check that lowec calculation input is not empty
+        if self.params['lag_calc_input']=='':
+            errors.append('Please provide a threshold for calculating the end of the lag phase!')
+            log.warning('Please provide a threshold for calculating the end of the lag phase!')
+
+        return errors
+    
+    def determine_replicate_setup(self, replicate_rows):
+        """Determine whether replicates are defined column wise or row wise"""
+        log.info('Determining replicate setup')
+        #Check whether replicates are specified by rows (such as when investigating concentration dependent effects, supplied as A:B, C:D ...),
+        #or by columns (e.g when characterizing growth, supplied as A01:A02:A03, A04:A05:A06, ...)
+        
+        if ',' in replicate_rows:
+            all_reps=[len(str(x.strip())) for r in replicate_rows.split(',') for x in r.split(':')]
+            if all(x==1 for x in all_reps):
+                self.reps_in_rows=True
+            elif all(x==3 for x in all_reps):
+                self.reps_in_cols=True
+
+        elif ':' in replicate_rows and not ',' in replicate_rows:
+            all_reps=[len(str(x.strip())) for x in replicate_rows.split(':')]
+            if all(x==1 for x in all_reps):
+                self.reps_in_rows=True
+            elif all(x==3 for x in all_reps):
+                self.reps_in_cols=True
+
+        return self.reps_in_rows, self.reps_in_cols
+    
+    def replicate_groups(self, replicate_rows):
+        """Parse replicate definition into (replicate group name, wells) pairs. Group names are the sample names of the averaged curves."""
+        log.info('Parsing replicate groups')
+        #Check whether replicates are specified by rows (such as when investigating concentration dependent effects, supplied as A:B, C:D ...),
+        #or by columns (e.g when characterizing growth, supplied as A01:A02:A03, A04:A05:A06, ...)
+        self.reps_in_rows, self.reps_in_cols = self.determine_replicate_setup(replicate_rows)
+
+        #If replicates on plate are rows:
+        if self.reps_in_rows==True and self.reps_in_cols==False:
+
+            #parse replicate rows
+            replicate_rows=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(replicate_rows.split(','))]
+            replicate_pairs=[]
+
+            c_nums=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.params['col_num'])+1)]
+            for r in replicate_rows:
+                replicate_pairs.extend([tuple(x+num for x in r) for num in c_nums])
+
+            return [(''.join([x[0] for x in p])+str(p[0][1:3]), p) for p in replicate_pairs]
+
+        elif self.reps_in_cols==True and self.reps_in_rows==False:
+
+            replicate_pairs=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(replicate_rows.split(','))]
+            return [(''.join([x for x in p]), p) for p in replicate_pairs]
+
+        return []
+
+    def average_replicates(self, plate, replicate_rows):
+        """Average replicate sample rows"""
+        log.info('Averaging replicates')
+        groups=self.replicate_groups(replicate_rows)
+        return plate.average([plate.index(p) for name, p in groups], [name for name, p in groups])
+
+    def detect_outliers(self, plate):
+        """Flag outlier wells among replicates, based on the distance of each well to the median curve of its replicate group.
+        All groups of the plate are compared at once (see kernels.replicate_outliers)."""
+        log.info('Detecting outlier wells')
+        try:
+            groups=self.replicate_groups(self.params['reps'])
+            present=set(plate.names)
+            wells=[w for name, p in groups for w in p if w in present]
+            group_names=[name for name, p in groups for w in p if w in present]
+            group_index=pd.factorize(pd.Series(group_names, dtype=object))[0]
+
+            distance, score, outlier=replicate_outliers(plate.values[plate.index(wells)], group_index,
+                                                        float(self.params['outlier_threshold']))
+            return pd.DataFrame({'well':wells, 'group':group_names, 'distance':np.round(distance, 3),
+                                 'score':np.round(score, 2), 'outlier':outlier})
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'detect_outliers: {e}') from e
+
+    def count_outliers(self, samples, outliers):
+        """Get number of outlier wells per sample - replicate groups if replicates were averaged, single wells otherwise"""
+        log.info('Counting outlier wells')
+        if outliers is None:
+            return 0
+        flagged=outliers[outliers['outlier']]
+        if self.params['avg']==1:
+            counts=flagged['group'].value_counts()
+        else:
+            counts=pd.Series(1, index=flagged['well'])
+        return samples.map(counts).fillna(0).astype(int).to_numpy()
+
+    def cluster_curves(self, plate):
+        """Cluster the curves of the plate by shape (see kernels.curve_clusters), returns cluster and principal components per sample"""
+        log.info('Clustering curves')
+        try:
+            clusters=curve_clusters([('plate', plate.to_frame())], int(self.params['clusters']), int(self.params['cluster_dims']))
+            return clusters.drop(columns='plate')
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'cluster_curves: {e}') from e
+
+    def background_pairs(self, bg_rows, average):
+        """Parse background definition into (sample, background samples) pairs. If replicates have been averaged,
+        samples and backgrounds are averaged rows (e.g AB:CD gives AB01-CD01), otherwise each row of the sample part
+        is paired with the average of the background rows (e.g AB:CD gives A01-mean(C01, D01) and B01-mean(C01, D01))."""
+        log.info('Parsing background pairs')
+        #number of columns used in the analysis
+        c_nums=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.params['col_num'])+1)]
+
+        #Remove space characters from bg_rows
+        bg_pairs=[]
+        for r in bg_rows.replace(' ', '').split(','):
+            samples, backgrounds=r.split(':')[0], r.split(':')[1]
+            if average==True:
+                bg_pairs.extend((samples+num, [backgrounds+num]) for num in c_nums)
+            else:
+                for x in samples:
+                    bg_pairs.extend((x+num, [y+num for y in backgrounds]) for num in c_nums)
+        return bg_pairs
+
+    def substract_background(self, plate, bg_rows, average):
+        """Substract the background rows from sample rows. Always average the background before substraction if there are several replicates"""
+        log.info('Subtracting background')
+        bg_pairs=self.background_pairs(bg_rows, average)
+        samples=plate.take(plate.index([s for s, b in bg_pairs]))
+        backgrounds=plate.average([plate.index(b) for s, b in bg_pairs], [s for s, b in bg_pairs])
+        return samples.with_values(samples.values-backgrounds.values)
+
+    def set_to_zero(self, plate): #Todo - SHOULD THIS BE KEPT?
+        """Avoid negative read values - until a sequence of 5 positive values is encountered, set all values to 0"""
+        log.info('Setting negative read values')
+        #For each curve, find the first index at which this and the next 5 values are >= 0 - set everything up to it to 0.
+        #If this has not happened (or already at the first value), the whole curve is set to 0
+        values=plate.values
+        T=values.shape[1]
+        pos_index=nonnegative_start(values, 6)
+        last=np.where(pos_index>0, pos_index, T-1)
+        start=np.arange(T)
+        return plate.with_values(np.where(start[None, :]<=last[:, None], 0, values))
+
+    def shift_curves(self, plate):
+        """Shift curves such that the first value of each curve is 0"""
+        log.info('Shifting curves')
+        first=plate.values[:, :1]
+        return plate.with_values(np.where(np.isfinite(first), plate.values-first, plate.values))
+
+    def fit_gam_to_avg(self, plate):
+        """Fit linear GAM to curve - the model is used for smoothing, resulting in a theoretical curve 
+        used for further analysis"""
+        log.info('Fitting linear GAM to curve')
+        gam=LinearGAM(s(0), constraints='monotonic_inc')
+
+        values=np.empty(plate.values.shape, dtype=np.float64)
+        for i, y in enumerate(plate.values):
+            gam.fit(plate.time, y)
+            values[i]=gam.predict(plate.time)
+
+        return plate.with_values(values)
+
+    def correct_edge_effects(self, plate):
+        """Substract the plate position trend (median polish or quadratic surface, see kernels.plate_trend) from all curves,
+        fitted at all timepoints at once. Returns corrected curves and the substracted corrections."""
+        log.info('Correcting edge effects')
+        try:
+            row_pos, col_pos=plate.positions()
+            placed=np.flatnonzero(np.isfinite(row_pos) & np.isfinite(col_pos))
+
+            trend=plate_trend(plate.values[placed], row_pos[placed], col_pos[placed], self.params['edge_correction'])
+            correction=plate.take(placed).to_frame(np.round(trend, 3))
+
+            values=plate.values.copy()
+            values[placed]-=trend
+            return plate.with_values(values), correction
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'correct_edge_effects: {e}') from e
+
+    def control_samples(self):
+        """Get names of the shared control samples (after averaging and background substraction)"""
+        log.info('Getting control samples')
+        return [x.strip() for x in self.params['control_wells'].split(',') if x.strip()!='']
+
+    def normalize_to_controls(self, plate):
+        """Scale curves onto the control reference level (see kernels.control_factors). Without reference, the factor is 1,
+        but the control level is still recorded, so it can be used as reference for other plates.
+        Returns scaled curves and a table with control level, reference and factor."""
+        log.info('Normalizing to control wells')
+        try:
+            controls=self.control_samples()
+            missing=[x for x in controls if not x in set(plate.names)]
+            if len(missing)>0:
+                raise KeyError(f'Control wells {", ".join(missing)} not found among samples')
+
+            reference=float(self.params['control_reference']) if self.params['control_reference']!='' else None
+            #Without reference, a single plate is its own reference (factor 1)
+            levels, factors=control_factors(plate.values[None], plate.index(controls), reference)
+            level=float(np.nanmedian(levels[0]))
+            factor=float(factors[0]) if np.isfinite(factors[0]) else 1.0
+
+            normalization=pd.DataFrame({'control_wells':[', '.join(controls)], 'control_level':[round(level, 3)],
+                                        'reference':[reference], 'factor':[round(factor, 4)]})
+            return plate.with_values(plate.values*factor), normalization
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'normalize_to_controls: {e}') from e
+
+    def apply_normalization(self, state, factor, reference):
+        """Scale the curves of a preprocessed plate (see preprocess) by a normalization factor determined together with
+        other plates (see control_normalization), recalculating derivatives and growth phases. Returns the updated state."""
+        log.info('Applying normalization factor')
+        try:
+            plate=state['plate'].with_values(state['plate'].values*factor)
+            derivatives=self.calculate_derivatives(plate)
+            phases, phase_metrics=self.segment_phases(plate, derivatives)
+            normalization=state['normalization'].assign(reference=round(reference, 3), factor=round(float(state['normalization']['factor'].iloc[0])*factor, 4))
+            return {**state, 'plate':plate, 'derivatives':derivatives, 'phases':phases, 'phase_metrics':phase_metrics, 'normalization':normalization}
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'apply_normalization: {e}') from e
+
+    def calculate_derivatives(self, plate):
+        """Calculate smoothed curves and their first derivatives dOD/dt and d ln OD/dt for all curves at once,
+        using the selected smoother. Returns dictionary of plates ('smooth', 'derivative', 'log_derivative')"""
+        log.info('Calculating derivative curves')
+        try:
+            results=derivative_curves(plate.time, plate.values, self.params['derivative_method'], int(self.params['rate_window']),
+                                      float(self.params['spline_penalty']), float(self.params['rate_min_signal']))
+            return {k:plate.with_values(values) for k, values in zip(('smooth', 'derivative', 'log_derivative'), results)}
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'calculate_derivatives: {e}') from e
+
+    def segment_phases(self, plate, derivatives):
+        """Segment curves into lag, growth, stationary and decline phases based on their derivative. Returns per-phase metrics and per-curve
+        phase metrics (number of growth phases, time of diauxic shift, start of stationary and decline phase)"""
+        log.info('Segmenting growth phases')
+        try:
+            t=plate.time
+            curves=plate.values.astype(np.float64)
+            labels, rate=phase_labels(t, curves, int(self.params['rate_window']), float(self.params['phase_threshold'])/100,
+                                      float(self.params['rate_min_signal']), derivatives['derivative'].values)
+            segments=phase_segments(t, curves, labels, rate)
+
+            phases=pd.DataFrame({'sample':plate.names[segments['curve']], 'phase':np.asarray(PHASES)[segments['phase']],
+                                 'number':segments['number']})
+            for k in ('start', 'end', 'duration', 'start_value', 'end_value', 'max_rate'):
+                phases[k]=np.round(segments[k], 2)
+
+            #Start of the n-th occurrence of a phase for each curve, NaN if it does not occur
+            def phase_start(phase, number):
+                selected=(segments['phase']==PHASES.index(phase)) & (segments['number']==number)
+                starts=np.full(len(plate), np.nan)
+                starts[segments['curve'][selected]]=phases['start'].to_numpy()[selected]
+                return starts
+
+            growth=segments['phase']==PHASES.index('growth')
+            phase_metrics=pd.DataFrame({'sample':list(plate.names),
+                                        'growth_phases':np.bincount(segments['curve'][growth], minlength=len(plate)),
+                                        'diauxic_shift':phase_start('growth', 2),
+                                        'stationary_start':phase_start('stationary', 1),
+                                        'decline_start':phase_start('decline', 1)})
+            return phases, phase_metrics
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'segment_phases: {e}') from e
+
+    def smooth(self, plate):
+        """Smooth curves with the selected smoother - the GAM is fitted per curve, all other smoothers
+        process the whole plate at once"""
+        log.info(f'Smoothing curves ({self.params["smoother"]})')
+        if self.params['smoother']=='GAM':
+            return self.fit_gam_to_avg(plate)
+        try:
+            return plate.with_values(smooth_curves(plate.time, plate.values, self.params['smoother'],
+                                                   int(self.params['smooth_window']), float(self.params['spline_penalty'])))
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'smooth: {e}') from e
+
+    def control_pairs(self):
+        """Parse the positive control specification (e.g 'A11+A12:AB, C11+C12:CD') into target rows (bit mask, see
+        row_mask), control well rows and control well columns per entry"""
+        pairs=[]
+        for entry in self.params['pos'].split(','):
+            if ':' in entry:
+                wells, targets=entry.split(':')[:2]
+                rows, cols=well_positions([w.strip() for w in wells.split('+')])
+                pairs.append((row_mask(targets), rows[rows>=0], cols[rows>=0]))
+        return pairs
+
+    def positive_controls(self, plate):
+        """Get positive control samples (index arrays) for the '% max. OD' lag thresholds of all samples, empty for samples
+        without positive control (e.g background rows). Control specifications are parsed once per plate."""
+        log.info('Matching positive controls')
+        pairs=self.control_pairs()
+        sets=plate.row_sets()
+        controls=[]
+        #If replicates are averaged, the controls are the averaged samples of the same replicate rows in the control columns
+        if self.std_calculated==True and self.params['avg']==1:
+            control_cols=np.unique(np.concatenate([p[2] for p in pairs])) if len(pairs)>0 else np.zeros(0, dtype=np.int64)
+            in_control_cols=np.isin(plate.cols, control_cols)
+            for s in sets:
+                controls.append(np.flatnonzero((sets==s) & in_control_cols) if s!=0 else np.zeros(0, dtype=np.int64))
+        else:
+            position={}
+            for i, (r, c) in enumerate(zip(plate.rows, plate.cols)):
+                position.setdefault((r, c), i)
+            #Several positive controls are averaged
+            for s in sets:
+                pair=[p for p in pairs if s!=0 and (s & ~p[0])==0]
+                wells=list(zip(pair[0][1], pair[0][2])) if len(pair)>0 else []
+                controls.append(np.array([position[w] for w in wells if w in position], dtype=np.int64))
+        return controls
+
+    def calculate_metrics(self, plate, derivatives=None):
+        """Calculate growth curve metrics - AUC, length of lag phase (threshold and tangent method), maximum yield, slope, maximum specific growth rate, doubling time"""
+        log.info('Calculating metrics')
+        try:
+            metrics={'sample':list(plate.names)}
+            lag_type=self.params['lag_calc']
+            lag_crit=float(self.params['lag_calc_input'].strip())
+
+            t=plate.time
+            curves=plate.values.astype(np.float64)
+            metrics['AUC']=np.round(np.trapz(curves, t, axis=1), 2)
+            metrics['max_yield']=np.round(np.nanmax(curves, axis=1), 2)
+
+            #Threshold value for the end of the lag phase - either fixed, or % of the maximum of the (averaged) positive control
+            if '%' in lag_type:
+                controls=self.positive_controls(plate)
+                with_control=[i for i, c in enumerate(controls) if len(c)>0]
+                positive=plate.average([controls[i] for i in with_control], [plate.names[i] for i in with_control])
+                #In cases where no positive control is specified for the row (either background rows or wrong input), the threshold
+                #is never crossed and the lag time is set to the last timepoint
+                thresholds=np.full(len(plate), np.nan)
+                thresholds[with_control]=(lag_crit/100)*np.nanmax(positive.values, axis=1)
+            else:
+                thresholds=np.full(len(plate), lag_crit)
+
+            #Rate and lag metrics are calculated for all curves at once, from the derivative curves
+            if derivatives is None:
+                derivatives=self.calculate_derivatives(plate)
+            smooth, slope, log_slope=(derivatives[k].values for k in ('smooth', 'derivative', 'log_derivative'))
+
+            #We want the exact x at end of lag time. Therefore we get the value BEFORE threshold is reached
+            #and AFTER threshold is reached, then calculate x at y=threshold value based on y=mx+b
+            end_lag, after_end=first_crossing(t, curves, thresholds)
+            #If threshold was crossed at t0 set lag to 0.01, if it is never crossed set it to the last timepoint
+            end_lag=np.where(after_end==0, 0.01, np.where(after_end<0, t[-1], end_lag))
+            metrics['lag_len']=[round(float(x),2) for x in end_lag]
+
+            #Lag by tangent method - curves without growth are set to the last timepoint
+            lag_tangent=tangent_lag(t, smooth, slope, robust_baseline(curves, int(self.params['rate_window'])), float(self.params['rate_min_signal']))
+            lag_tangent=np.clip(np.nan_to_num(lag_tangent, nan=t[-1]), t[0], t[-1])
+            metrics['lag_tangent']=[round(float(x),2) for x in lag_tangent]
+
+            #Find steepest point on curve over 4 points and calculate steepest slope
+            metrics['slope']=[round(float(x),2) for x in steepest_slope(t, curves, 4)]
+
+            #Maximum specific growth rate - maximum of d ln OD/dt, NaN where it is not defined
+            mu_max=np.max(np.nan_to_num(log_slope, nan=-np.inf), axis=1)
+            mu_max=np.where(np.isfinite(mu_max), mu_max, np.nan)
+            metrics['mu_max']=[round(float(x),3) for x in mu_max]
+            metrics['doubling_time']=[round(float(x),2) for x in doubling_time(mu_max)]
+
+            #set std_calculated to false again to enable calculation cycle for std and averaged metrics without the user having to close
+            #the main window
+            if self.std_calculated==True:
+                self.std_calculated=False
+
+            columns=['sample', 'AUC', 'lag_len', 'lag_tangent', 'max_yield', 'slope', 'mu_max', 'doubling_time']
+            return pd.DataFrame({k:metrics[k] for k in columns})
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'calculate_metrics: {e}') from e
+
+    def get_replicate_variance(self, plate):
+        """Get standard deviation between replicate curve parameters"""
+        log.info('Getting standard deviation')
+        try:
+            #Calculate metrics for raw data (background substracted if applicable)
+            if self.params['bg']!='':
+                plate=self.substract_background(plate, self.params['bg'], False)
+
+            #Calculate metrics from previously calculated_df
+            std_metrics=self.calculate_metrics(plate)
+
+            #Calculate replicate standard deviation for each parameter and group/concentration combination
+            std_dict={'Replicate group':[], 'lag_std':[], 'auc_std':[], 'yield_std':[], 'slope_std':[], 'mu_max_std':[], 'lag_tangent_std':[]}
+
+            #Rows of the wells of each replicate group in the metrics - groups without wells on the plate are skipped
+            position={s:i for i, s in enumerate(std_metrics['sample'])}
+            members=[(rep_group, sorted({position[w] for w in r if w in position})) for rep_group, r in self.replicate_groups(self.params['reps'])]
+            members=[(rep_group, rows) for rep_group, rows in members if len(rows)>0]
+
+            if len(members)>0:
+                #Mean and standard deviation (skipping missing values) of all groups at once, from sums over consecutive rows
+                rows=np.concatenate([rows for rep_group, rows in members])
+                sizes=np.array([len(rows) for rep_group, rows in members])
+                starts=np.concatenate([[0], np.cumsum(sizes)[:-1]])
+                def group_stats(column):
+                    x=std_metrics[column].to_numpy(dtype=np.float64)[rows]
+                    valid=~np.isnan(x)
+                    count=np.add.reduceat(valid.astype(np.int64), starts)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        mean=np.add.reduceat(np.where(valid, x, 0), starts)/count
+                        deviation=np.where(valid, x-np.repeat(mean, sizes), 0)**2
+                        return np.sqrt(np.add.reduceat(deviation, starts)/count), mean
+
+                group_values={c:group_stats(c) for c in ['lag_len', 'AUC', 'max_yield', 'slope', 'mu_max', 'lag_tangent']}
+                std_dict['Replicate group']=[rep_group for rep_group, rows in members]
+                #Normalized standard deviation for all parameters
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    for k, c, m in [('lag_std', 'lag_len', 'lag_len'), ('auc_std', 'AUC', 'AUC'), ('yield_std', 'max_yield', 'max_yield'),
+                                    ('slope_std', 'slope', 'lag_len'), ('mu_max_std', 'mu_max', 'mu_max'), ('lag_tangent_std', 'lag_tangent', 'lag_tangent')]:
+                        std_dict[k]=list(np.round(group_values[c][0]/group_values[m][1], 2))
+
+            self.std_calculated=True
+            
+            return std_dict
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'get_replicate_variance: {e}') from e
+
+    def calculate_lowec(self, metrics, plate):
+        """Calculate loec based on user input. Samples are matched to positive controls and replicate rows with the row sets
+        and columns of the plate the metrics were calculated from."""
+        log.info('Calculating loec')
+        try:
+            #Parse input from lowec calculation form to get positive controls and respective rows
+            pairs=self.control_pairs()
+
+            #get background rows
+            bgs=self.params['bg'].replace(' ', '')
+            bg_rows=row_mask(''.join([x.split(':')[1] for x in bgs.split(',') if ':' in x]))
+
+            #Row sets, columns and values of the metrics samples
+            idx=plate.index(metrics['sample'])
+            names=metrics['sample'].to_numpy()
+            sets=plate.row_sets()[idx]
+            cols=plate.cols[idx]
+            calc, metric=self.params['lowec_calc'].split()[0], self.params['lowec_calc'].split()[-1]
+            values=metrics[LOWEC_METRICS[metric]].to_numpy(dtype=np.float64)
+
+            #Now go through the positive controls and metrics (which contains the calculated metrics)
+            #1. Get samples in the target rows and the positive controls, by row set and column
+
+            #LOEC and NOEC calls are kept as (row set, column, sample name)
+            lowec_list=[]
+            noec_list=[]
+
+            #make mask of processed rows as to avoid analyzing the same replicate pairs multiple times
+            processed_reps=0
+
+            for targets, control_rows, control_cols in pairs:
+                if (targets & ~processed_reps)==0:
+                    continue
+                control_cols=np.unique(control_cols)
+
+                #calculate cutoff value for all positive controls separately, then get all rows where lag>lag*crit_mean and auc<auc*crit_mean.
+                #Then sort
+
+                #IMPORTANT: LOEC calculations assume that concentrations on the plates are ordered from high (left side of plate) to low (right side of plate)
+                #Either adjust the plate layout accordingly or change the code
+
+                if calc=='%':
+                    #Get positive samples and samples of the target rows
+                    control_set=np.bitwise_or.reduce(np.left_shift(1, control_rows.astype(np.int64)))
+                    pos_sel=((sets & control_set)!=0) & np.isin(cols, control_cols)
+                    sample_sel=((sets & targets)==targets) & ~np.isin(cols, control_cols)
+                    crit_perc=float(self.params['lowec_calc_input'])/100
+                    crit_mean=np.mean(values[pos_sel]*crit_perc)
+                    lowec_test, noec_test=LOWEC_TESTS[metric]
+
+                    #Samples of the target rows in plate order (by row set and column)
+                    samples=np.flatnonzero(sample_sel)
+                    samples=samples[np.lexsort((cols[samples], sets[samples]))]
+                    lowecs=samples[lowec_test(values[samples], crit_mean)]
+                    if len(lowecs)>0:
+                        lowec_list.append((sets[lowecs[-1]], cols[lowecs[-1]], names[lowecs[-1]]))
+                        #Also extract the noec (the concentration before the cutoff value is reached)
+                        noecs=samples[noec_test(values[samples], crit_mean)]
+                        noec_list.append((sets[noecs[0]], cols[noecs[0]], names[noecs[0]]) if len(noecs)>0 else None)
+                    else:
+                        lowec_list.append(None)
+                        noec_list.append(None)
+
+                #Perform ANOVA and post hoc test
+                elif calc=='ANOVA':
+                    #Get metric values for all replicates
+                    rep_list=[[y for y in x.split(':') if y!=''] for x in self.params['reps'].replace(' ', '').split(',')]
+                    rep_list=[x for x in rep_list if len(x)>0 and (row_mask(x) & bg_rows)==0]
+
+                    #Go through lists of replicates
+                    for x in rep_list:
+                        rep_rows=row_mask(x)
+                        rep_sets=[row_mask(y) for y in x]
+
+                        #Create dictionary containing all metric values for all replicates with the same concentration
+                        rep_dict={}
+                        for c in range(int(self.params['col_num'])):
+                            rep_dict[column_label(c)]=values[np.isin(sets, rep_sets) & (cols==c)]
+
+                        #Save metrics per replicate and concentration to dataframe
+                        conc_df_all=pd.DataFrame(rep_dict, index=None)
+
+                        #Now assign the control group for dunnets test - if there are several, average them
+                        #Get column numbers for positive controls
+                        contr_cols=[column_label(c) for c in control_cols]
+
+                        #Remove positive controls from conc_df_all
+                        conc_df=conc_df_all[[c for c in conc_df_all.columns if not c in contr_cols]]
+
+                        if len(contr_cols)>1:
+                            conc_df['pc']=conc_df_all[contr_cols].mean(axis=1)
+                        else:
+                            conc_df['pc']=conc_df_all[contr_cols]
+
+                        #Now perform ANOVA
+                        kwa=stats.f_oneway(*[conc_df[c] for c in conc_df.columns])
+                        p_val=kwa[1]
+
+                        #If p-value is <= 0.05, perform dunnets post-hoc test to identify between which groups vs control the difference is significant
+                        if p_val<0.05:
+
+                            tuk=stats.dunnett(*[conc_df[c] for c in conc_df.columns if not c=='pc'], control=np.array(conc_df['pc']))
+                            tuk_pvals=tuk.pvalue
+
+                            #IMPORTANT: following code assumes that concentrations on the plate are going from highest (left on plate) to lowest (right on plate)
+                            #Either the plates have to be designed accordingly, or the code has to be adjusted
+
+                            #get indexes of columns tested against the control, then extract the column with the highest index where p<0.05
+                            #(as that will correspond to the lowest concentration where and effect is observed)
+                            sig_cols=[(i, col) for i, (col, p) in enumerate(zip(conc_df.columns, tuk_pvals)) if p<0.05]
+
+                            if len(sig_cols)>0:
+                                lowec_col=sig_cols[-1][1]
+                                lowec_list.append((rep_rows, int(lowec_col)-1, row_label(rep_rows)+lowec_col))
+                                #No noec if the lowest concentration on the plate still has an effect
+                                noec_col=conc_df.columns[sig_cols[-1][0]+1]
+                                noec_list.append((rep_rows, int(noec_col)-1, row_label(rep_rows)+noec_col) if noec_col!='pc' else None)
+                            else:
+                                lowec_list.append(None)
+                                noec_list.append(None)
+
+                        else:
+                            noec_list.append(None)
+                            lowec_list.append(None)
+
+                        processed_reps|=rep_rows
+
+            #Filter noec and lowec lists such that only one value per replicate group is present
+            filt_lowec_list=self.filter_lowecs(lowec_list)
+            filt_noec_list=self.filter_lowecs(noec_list)
+
+            return [*set(filt_lowec_list)], [*set(filt_noec_list)]
+
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'calculate_lowec: {e}') from e
+
+    def filter_lowecs(self, lowec_list):
+        """Filter loec/noec calls ((row set, column, sample name) or None) such that only one sample name per replicate
+        group (row set) is present. NOTE: This assumes that concentrations go from highest (right side of plate) to
+        lowest (left side of plate)"""
+        log.info('Filtering lowecs')
+        try:
+            #get call with largest column per replicate group and append to filtered list
+            groups={}
+            for call in lowec_list:
+                if call is not None and (not call[0] in groups or call[1]>groups[call[0]][1]):
+                    groups[call[0]]=call
+            filtered_list=[call[2] for call in groups.values()]
+
+            if None in lowec_list:
+                filtered_list.append('None')
+
+            return filtered_list
+
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'filter_lowecs: {e}') from e
+
+
+    def concentration_values(self, conc, n):
+        """Get n numeric concentrations from a comma separated list or highest concentration:dilution factor"""
+        log.info('Getting concentration values')
+        if ',' in conc:
+            return [float(x.strip()) for x in conc.split(',')][:n]
+        elif ':' in conc:
+            high_conc=float(conc.split(':')[0].strip())
+            dilution_factor=float(conc.split(':')[1].strip())
+            return [high_conc/dilution_factor**i for i in range(n)]
+        return [float(conc.strip())]
+
+    def checkerboard_grid(self, metrics, plate):
+        """Arrange the synergy metric of a checkerboard plate as grid of sample rows (drug B) and concentration columns (drug A),
+        by the row sets and columns of the plate the metrics were calculated from. Returns grid, concentrations of drug A and B
+        and the sample names of the grid cells (row by row)."""
+        log.info('Arranging checkerboard grid')
+        idx=plate.index(metrics['sample'])
+        sets=plate.row_sets()[idx]
+        cols=plate.cols[idx]
+
+        #Drug A concentrations per plate column, as for single drug layouts
+        conc_dict=self.match_concentrations()
+        columns=sorted(c for c in set(cols.tolist()) if column_label(c) in conc_dict)
+        conc_a=[float(re.match(r'\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)', conc_dict[column_label(c)]).group(1)) for c in columns]
+
+        #Drug B concentrations per sample row, in plate order
+        rows=list(dict.fromkeys(r for r in sets.tolist() if r!=0))
+        conc_b=self.concentration_values(self.params['row_conc'], len(rows))
+        rows=rows[:len(conc_b)]
+
+        grid=np.full((len(rows), len(columns)), np.nan)
+        samples=np.array([[row_label(r)+column_label(c) for c in columns] for r in rows], dtype=object).reshape(len(rows), len(columns))
+        row_index={r:i for i, r in enumerate(rows)}
+        col_index={c:j for j, c in enumerate(columns)}
+        values=metrics[self.params['synergy_metric']].to_numpy(dtype=np.float64)
+        for k, (r, c) in enumerate(zip(sets.tolist(), cols.tolist())):
+            if r in row_index and c in col_index:
+                grid[row_index[r], col_index[c]]=values[k]
+                samples[row_index[r], col_index[c]]=metrics['sample'].iloc[k]
+        return grid, np.array(conc_a), np.array(conc_b), list(samples.ravel())
+
+    def calculate_synergy(self, plates):
+        """Calculate FIC, Bliss and Loewe excess of two drug checkerboards for a list of plates (metrics dataframe and the
+        plate they were calculated from) with this layout, all at once. Returns per well results and per plate summary
+        (MICs, FIC index, mean excess)."""
+        log.info('Calculating checkerboard synergy')
+        try:
+            grids=[self.checkerboard_grid(m, p) for m, p in plates]
+            grid, conc_a, conc_b, samples=grids[0]
+            results=checkerboard_synergy(np.stack([g[0] for g in grids]), conc_a, conc_b, float(self.params['synergy_cutoff'])/100)
+
+            wells=pd.DataFrame({'plate':np.repeat(np.arange(len(plates)), len(samples)), 'sample':samples*len(plates),
+                                'fic':np.round(results['fic'].ravel(), 3), 'bliss_excess':np.round(results['bliss'].ravel(), 3),
+                                'loewe_excess':np.round(results['loewe'].ravel(), 3)})
+
+            #Mean excess over the wells containing both drugs
+            combination=(conc_b[:, None]>conc_b.min()) & (conc_a[None, :]>conc_a.min())
+            fici=results['fici']
+            summary=pd.DataFrame({'plate':np.arange(len(plates)), 'mic_a':results['mic_a'], 'mic_b':results['mic_b'], 'fici':np.round(fici, 3),
+                                  'interaction':np.select([fici<=0.5, fici>4, np.isfinite(fici)], ['synergy', 'antagonism', 'no interaction'], 'None'),
+                                  'bliss_excess':np.round(results['bliss'][:, combination].mean(axis=1), 3),
+                                  'loewe_excess':np.round(results['loewe'][:, combination].mean(axis=1), 3)})
+            return wells, summary
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'calculate_synergy: {e}') from e
+
+    def calculate_mic(self, metrics, plate):
+        """Calculate MIC based on input threshold value, per replicate group (row set of the plate the metrics were calculated from)"""
+        log.info('Calculating MICs')
+        try:
+            mics={'rows':[], 'MICs':[]}
+
+            if self.params['mic_calc']=='max. OD':
+                cutoff=float(self.params['mic_calc_input'])
+
+            #Get unique rows for which mics should be calculated, in plate order
+            idx=plate.index(metrics['sample'])
+            sets=plate.row_sets()[idx]
+            cols=plate.cols[idx]
+            uniques=list(dict.fromkeys(sets.tolist()))
+
+            #Get all samples for which the max_yield <= cutoff
+            below=metrics['max_yield'].to_numpy()<=cutoff
+            for u in uniques:
+                mic_cols=cols[below & (sets==u)]
+                if len(mic_cols)>0:
+                    #Get lowest concentration with max OD below cutoff value. #TO DATE, THIS ASSUMES THAT CONCENTRATIONS ARE ORDERED
+                    #FROM HIGHEST TO LOWEST ON PLATE!
+                    mics['MICs'].append(column_label(mic_cols.max()))
+                else:
+                    mics['MICs'].append('None')
+                mics['rows'].append(row_label(u))
+
+            return mics
+
+        except Exception as e:
+            log.critical(f'Error: {e}')
+            raise AnalysisError(f'calculate_mic: {e}') from e
+
+
+def control_references(dfs, control_wells, step=None):
+    """Reference levels of the shared control wells of several plates (dataframes with 'Hour' column and one column per
+    sample): the median level of every control well across the plates, as used by control_normalization without reference"""
+    log.info('Calculating control reference levels of plates')
+    controls=[x.strip() for x in control_wells.split(',') if x.strip()!=''] if isinstance(control_wells, str) else list(control_wells)
+    stacked, grid, wells=stack_plates(dfs, step=step, wells=controls)
+    levels, factors=control_factors(stacked, list(range(len(controls))))
+    return np.nanmedian(levels, axis=0)
+
+def control_normalization(dfs, control_wells, reference=None, step=None):
+    """Control levels and normalization factors of several plates (dataframes with 'Hour' column and one column per sample)
+    with shared control wells, in one batched operation: the control curves of all plates are stacked onto a common time
+    grid and the factors are calculated with kernels.control_factors, each control well referenced to its median level
+    across the plates if no reference (scalar, or one per control well, see control_references) is given.
+    Returns a table with control level, reference and factor per plate."""
+    log.info('Calculating normalization factors of plates')
+    controls=[x.strip() for x in control_wells.split(',') if x.strip()!=''] if isinstance(control_wells, str) else list(control_wells)
+    stacked, grid, wells=stack_plates(dfs, step=step, wells=controls)
+    levels, factors=control_factors(stacked, list(range(len(controls))), reference)
+    #Plates without usable controls are left unscaled
+    factors=np.where(np.isfinite(factors), factors, 1.0)
+    #Without reference, the plates are scaled onto the median level of the batch
+    level=float(np.nanmedian(np.nanmedian(levels, axis=0) if reference is None else reference))
+    return pd.DataFrame({'plate':np.arange(len(dfs)), 'control_wells':', '.join(controls), 'control_level':np.nanmedian(levels, axis=1),
+                         'reference':level, 'factor':factors})
+
+def normalize_plates(dfs, control_wells, reference=None, step=None):
+    """Normalize several plates (dataframes with 'Hour' column and one column per sample) with shared control wells in one
+    batched operation (see control_normalization). Returns the normalized plates and a table with the control levels and
+    factor per plate."""
+    log.info('Normalizing plates to shared control wells')
+    normalization=control_normalization(dfs, control_wells, reference, step)
+    plates=[]
+    for df, factor in zip(dfs, normalization['factor']):
+        plate=df.copy()
+        plate.iloc[:, 1:]=plate.iloc[:, 1:].to_numpy(dtype=np.float64)*factor
+        plates.append(plate)
+    return plates, normalization.round({'control_level':3, 'reference':3, 'factor':4})
+
+def result_filename(file_path, params):
+    """Define output filename ending based on selected parameters"""
+    log.info('Creating result filename')
+    endings = []
+    if '%' in params['lag_calc']:
+        endings.append(f'lag%OD{params["lag_calc_input"]}')
+    else:
+        endings.append(f'lagOD{params["lag_calc_input"]}')
+
+    lowin = params['lowec_calc']
+    if lowin != 'None':
+        if 'ANOVA' in lowin:
+            endings.append(f'loec{lowin.replace(" ", "_")}')
+        else:
+            endings.append(f'loec{lowin.replace(" ", "_")+params["lowec_calc_input"]}')
+
+    if params['mic_calc'] != 'None':
+        endings.append(f'micOD{params["mic_calc_input"]}')
+
+    endname = '_'.join(endings) + '_curve_parameters.xlsx'
+
+    # Concatenate file_path and endname to get the full file path
+    if file_path.endswith('.xlsx'):
+        return file_path.replace(".xlsx", "_" + endname)
+    return file_path + "_" + endname
+
+def analysed_curves(results):
+    """Curves the metrics were calculated from: the smoothened curves if available, the processed curves otherwise"""
+    return results['shifted_gams'] if isinstance(results['shifted_gams'], pd.DataFrame) else results['df']
+
+def export_results(outfile, results, params):
+    """Write results of GrowthAnalysis.analyse (dictionary with RESULT_NAMES as keys) to excel file"""
+    if params['smoothen']==1:
+        df=results['shifted_gams']
+    else:
+        df=results['df']
+    write_results(outfile, results['df_raw'], df, results['metrics'], results['std_dict'], results['lowecs'],
+                  results['noecs'], results['mics'], results['conc_dict'], params, results['phases'],
+                  results['derivative'], results['log_derivative'], results['outliers'],
+                  results['edge_correction'], results['synergy'], results['normalization'])
+
+def write_results(outfile, raw_data, df, metrics, std_dict, lowecs, noecs, mics, conc_dict, params, phases=None,
+                  derivative=None, log_derivative=None, outliers=None, edge_correction=None, synergy=None, normalization=None):
+    """ write original data and calculated curve parameters to excel file"""
+    log.info('Writing results')
+    # Write dataframes to outfile, with several sheets - raw data, calculated data, metrics
+    writer = pd.ExcelWriter(outfile, engine='xlsxwriter')
+    raw_data.to_excel(writer, sheet_name='raw_data', index=False)
+    df.to_excel(writer, sheet_name='calc_data', index=False)
+    metrics.to_excel(writer, sheet_name='metrics', index=False)
+
+    # Further tables are placed to the right of the metrics, leaving one empty column in between
+    startcol = len(metrics.columns) + 1
+
+    # If replicates are provided, write their standard deviation to the output file
+    if std_dict is not None:
+        std_df = pd.DataFrame(std_dict)
+        std_df.to_excel(writer, sheet_name='metrics', index=False, startcol=startcol, startrow=0)
+        startcol += len(std_df.columns) + 1
+
+    if params['lowec_calc'] != 'None':
+        # If concentrations are provided, add a column with the respective concentration to dataframe
+        if params['conc'] != '':
+            low_concs = [conc_dict[x[-2:]] if x[-2:] in conc_dict else 'None' for x in sorted(lowecs)]
+            no_concs = [conc_dict[x[-2:]] if x[-2:] in conc_dict else 'None' for x in sorted(noecs)]
+            low_df = pd.DataFrame({'Loecs': sorted(lowecs), 'Concentrations': low_concs})
+            no_df = pd.DataFrame({'Noecs': sorted(noecs), 'Concentrations': no_concs})
+
+        else:
+            low_df = pd.DataFrame({'Loecs': sorted(lowecs)})
+            no_df = pd.DataFrame({'Noecs': sorted(noecs)})
+
+        low_df.to_excel(writer, sheet_name='metrics', index=False, startcol=startcol, startrow=0)
+        no_df.to_excel(writer, sheet_name='metrics', index=False, startcol=startcol + 3, startrow=0)
+        startcol += 6
+
+    if params['mic_calc'] != 'None':
+        mic_dict = dict(mics)
+        if params['conc'] != '':
+            mic_dict['Concentrations'] = [conc_dict[x[-2:]] if x in conc_dict else 'None' for x in mics['MICs']]
+
+        mic_df = pd.DataFrame(mic_dict).sort_values(by=['rows'])
+        mic_df.to_excel(writer, sheet_name='metrics', index=False, startcol=startcol, startrow=0)
+        startcol += len(mic_df.columns) + 1
+
+    # Control well normalization factor
+    if normalization is not None:
+        normalization.to_excel(writer, sheet_name='normalization', index=False)
+
+    # Checkerboard synergy summary (per well FIC, Bliss and Loewe excess are part of the metrics)
+    if synergy is not None:
+        synergy.to_excel(writer, sheet_name='synergy', index=False)
+
+    # Per-phase metrics (lag, growth, stationary and decline phases of each curve)
+    if phases is not None:
+        phases.to_excel(writer, sheet_name='phases', index=False)
+
+    # Replicate outlier flags of all wells in replicate groups
+    if outliers is not None:
+        outliers.to_excel(writer, sheet_name='outliers', index=False)
+
+    # Plate position trend substracted by the edge effect correction
+    if edge_correction is not None:
+        edge_correction.to_excel(writer, sheet_name='edge_correction', index=False)
+
+    # Derivative curves
+    if derivative is not None:
+        derivative.to_excel(writer, sheet_name='dOD_dt', index=False)
+    if log_derivative is not None:
+        log_derivative.to_excel(writer, sheet_name='dlnOD_dt', index=False)
+
+    # Write plot to file
+    # Create plot of all columns to save - figures are created without pyplot, so this also works outside the GUI thread
+    fig = Figure(figsize=(10, 8))
+    fig.subplots_adjust(right=0.8)
+    ax = fig.add_subplot(111)
+
+    for c in sorted([c for c in raw_data.columns if not c == 'Hour']):
+        ax.plot(raw_data['Hour'], raw_data[c])
+
+    ax.set_xlabel('Hour')
+    ax.set_ylabel('Omnilog Units')
+    ax.legend(sorted(raw_data.columns), loc='center right', bbox_to_anchor=(1.3, 0.5))
+
+    workbook = writer.book
+    sheet = workbook.add_worksheet('plot')
+
+    imgdata = io.BytesIO()
+    fig.savefig(imgdata, dpi=300, format='png')
+    sheet.insert_image(1, 1, '', {'image_data': imgdata})
+
+    workbook.close()
@@ -0,0 +1,114 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import logging as log
+from analysis import GrowthAnalysis, PLATE_DTYPE, load_layouts, read_plate
+from plate import Plate
+from kernels import SMOOTHERS, JIT_AVAILABLE, steepest_slope, first_crossing, nonnegative_start
+
+#Benchmarks of the analysis stages, run from the command line, e.g
+#python benchmark.py example.xlsx --layout Biocides --plates 10
+#python benchmark.py --kernels --wells 1536 --timepoints 2000
+
+def prepare_plate(filename, params, plates=1):
+    """Read plate and process it up to the smoothing stage (averaging, background substraction, negative values).
+    With plates>1, the wells are repeated to simulate a batch of several plates."""
+    analysis=GrowthAnalysis(params)
+    plate=Plate.from_frame(read_plate(filename), dtype=PLATE_DTYPE)
+    if params['avg']==1 and params['reps']!='':
+        plate=analysis.average_replicates(plate, params['reps'])
+    if params['bg']!='':
+        plate=analysis.substract_background(plate, params['bg'], params['avg']==1)
+    plate=analysis.set_to_zero(plate)
+    if plates>1:
+        plate=Plate(np.tile(plate.values, (plates, 1)), plate.time, [f'{n}_{i}' for i in range(plates) for n in plate.names], dtype=plate.dtype)
+    return analysis, plate
+
+def time_stage(function, repeat):
+    """Run function repeat times, returns result of the last run and best time in seconds"""
+    times=[]
+    for i in range(repeat):
+        start=time.perf_counter()
+        result=function()
+        times.append(time.perf_counter()-start)
+    return result, min(times)
+
+def benchmark_smoothers(filename, params, plates=1, repeat=3):
+    """Time all smoothers on the same plate and compare them to the GAM. Returns a dataframe with time, speedup,
+    RMS difference to the GAM and the fraction of decreasing steps (0 for monotonic smoothers)."""
+    log.info('Benchmarking smoothers')
+    analysis, plate=prepare_plate(filename, params, plates)
+    results={}
+    for smoother in SMOOTHERS:
+        analysis.params['smoother']=smoother
+        #The GAM is timed once, it is orders of magnitude slower than the batch smoothers
+        results[smoother]=time_stage(lambda: analysis.smooth(plate).values.T, 1 if smoother=='GAM' else repeat)
+
+    gam, gam_time=results['GAM']
+    #Decreases smaller than this are numerical noise (the GAM's monotonic constraint is only enforced approximately)
+    tolerance=1e-6*np.nanmax(np.abs(gam))
+    rows=[]
+    for smoother, (curves, seconds) in results.items():
+        rows.append({'smoother':smoother, 'curves':curves.shape[1], 'seconds':round(seconds, 4),
+                     'speedup':round(gam_time/seconds, 1), 'rms_vs_gam':round(float(np.sqrt(np.nanmean((curves-gam)**2))), 3),
+                     'decreasing_steps':round(float((np.diff(curves, axis=0)<-tolerance).mean()), 3)})
+    return pd.DataFrame(rows)
+
+def synthetic_plate(wells, timepoints, seed=0):
+    """Noisy logistic growth curves with random lag, rate and yield, starting with negative background reads"""
+    rng=np.random.default_rng(seed)
+    t=np.linspace(0, 48, timepoints)
+    lag=rng.uniform(2, 30, (wells, 1))
+    rate=rng.uniform(0.2, 2, (wells, 1))
+    yield_=rng.uniform(0, 400, (wells, 1))
+    y=yield_/(1+np.exp(-rate*(t-lag-4/rate)))+rng.normal(0, 5, (wells, timepoints))-10
+    return t, y
+
+def benchmark_kernels(wells=1536, timepoints=2000, repeat=3):
+    """Time the NumPy and compiled (numba) implementations of the loop kernels on a synthetic plate and check
+    that they give identical results. Compiled times are NaN if numba is not installed."""
+    log.info('Benchmarking loop kernels')
+    t, y=synthetic_plate(wells, timepoints)
+    kernels={'first_crossing':lambda compiled: first_crossing(t, y, 50.0, compiled=compiled),
+             'steepest_slope':lambda compiled: steepest_slope(t, y, 4, compiled=compiled),
+             'nonnegative_start':lambda compiled: nonnegative_start(y, 6, compiled=compiled)}
+    rows=[]
+    for name, kernel in kernels.items():
+        result, numpy_time=time_stage(lambda: kernel(False), repeat)
+        row={'kernel':name, 'wells':wells, 'timepoints':timepoints, 'numpy_seconds':round(numpy_time, 4),
+             'compiled_seconds':np.nan, 'speedup':np.nan, 'identical':np.nan}
+        if JIT_AVAILABLE:
+            #The first call compiles the kernel (or loads it from the cache)
+            kernel(True)
+            compiled_result, compiled_time=time_stage(lambda: kernel(True), repeat)
+            results=zip(*(r if isinstance(r, tuple) else (r,) for r in (result, compiled_result)))
+            row.update(compiled_seconds=round(compiled_time, 4), speedup=round(numpy_time/compiled_time, 1),
+                       identical=all(np.array_equal(a, b, equal_nan=True) for a, b in results))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def parse_args():
+    """Parse command line arguments"""
+    parser=argparse.ArgumentParser(description='Benchmark BGCA analysis stages')
+    parser.add_argument('file', nargs='?', default='example.xlsx', help='Plate export (.xlsx/.csv) to benchmark on (default: example.xlsx).')
+    parser.add_argument('--layout', default='Biocides', help='Plate layout from default_layouts.txt (default: Biocides).')
+    parser.add_argument('--plates', type=int, default=1, help='Number of copies of the plate processed as one batch (default: 1).')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per stage, the best time is reported (default: 3).')
+    parser.add_argument('--kernels', action='store_true', help='Benchmark NumPy against compiled (numba) loop kernels on a synthetic plate instead of the smoothers.')
+    parser.add_argument('--wells', type=int, default=1536, help='Number of wells of the synthetic plate (default: 1536).')
+    parser.add_argument('--timepoints', type=int, default=2000, help='Number of timepoints of the synthetic plate (default: 2000).')
+    return parser.parse_args()
+
+def main():
+    args=parse_args()
+    if args.kernels:
+        if not JIT_AVAILABLE:
+            print('numba is not installed, only the NumPy kernels are timed')
+        print(benchmark_kernels(args.wells, args.timepoints, args.repeat).to_string(index=False))
+        return
+    params=load_layouts()[args.layout]
+    print(benchmark_smoothers(args.file, params, args.plates, args.repeat).to_string(index=False))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+import logging as log
+from analysis import GrowthAnalysis, ADVANCED_DEFAULTS, PREPROCESS_PARAMS, LAG_PARAMS, SMOOTH_PARAMS, LOWEC_PARAMS, MIC_PARAMS, RESULT_NAMES, \
+    load_layouts
+
+#Comparison of several parameter configurations on one plate. The analysis stages are cached by the parameters they depend on,
+#so configurations that only differ in later stages (e.g lag, LOEC or MIC thresholds) share the preprocessed and smoothened
+#plate, and only the stages that diverge are calculated for each configuration.
+
+#Parameters of the lag metric and the statistics, which reanalyse() recalculates without the earlier stages
+THRESHOLD_PARAMS=LAG_PARAMS+LOWEC_PARAMS+MIC_PARAMS
+
+def stage_key(params, names):
+    """Cache key of an analysis stage: the values of the parameters it depends on"""
+    return tuple(str(params[n]) for n in names)
+
+def parse_configurations(text, params, layouts=None):
+    """Parse configurations, one per line as 'name: parameter=value, parameter=value' (e.g 'unsmoothed: smoothen=0'),
+    into dictionary name: parameters. Parameters that are not given are taken from params."""
+    log.info('Parsing configurations')
+    layouts=load_layouts() if layouts is None else layouts
+    defaults={**ADVANCED_DEFAULTS, **layouts['Custom']}
+    configs={}
+    for line in text.splitlines():
+        if line.strip()=='':
+            continue
+        #Values can contain colons (e.g replicate rows), the name is the text before the first colon if it is no parameter
+        name, sep, overrides=line.partition(':')
+        if sep=='' or '=' in name:
+            name, overrides='', line
+        name=name.strip() or f'config {len(configs)+1}'
+        config=dict(params)
+        #Values containing commas (e.g replicate rows) are continued until the next parameter
+        parts=[]
+        for part in overrides.split(','):
+            if '=' in part or len(parts)==0:
+                parts.append(part)
+            else:
+                parts[-1]+=','+part
+        for part in parts:
+            if part.strip()=='':
+                continue
+            key, _, value=part.partition('=')
+            key=key.strip()
+            if not key in defaults:
+                raise ValueError(f'Unknown parameter {key} in configuration {name}')
+            #Flags (e.g 'avg', 'smoothen') are integers in the layouts
+            config[key]=int(float(value)) if isinstance(defaults[key], int) else value.strip()
+        if name in configs:
+            raise ValueError(f'Configuration {name} is given more than once')
+        configs[name]=config
+    return configs
+
+
+class StageCache:
+    """Analysis stages of one plate, cached by the parameters each stage depends on (see PREPROCESS_PARAMS and SMOOTH_PARAMS).
+    The metrics and statistics (evaluate stage) are calculated for every analysis, or with reanalyse() only those that
+    depend on the parameters changed since the last analysis."""
+    def __init__(self, df):
+        log.info('Initializing stage cache')
+        self.df=df
+        self.preprocessed={}
+        self.std_dicts={}
+        self.smoothed={}
+        #Parameters, results and replicate setup (std_calculated, reps_in_rows, reps_in_cols) of the last analysis
+        self.last=None
+        self.setup=None
+        #Number of times each stage was calculated
+        self.computed={'preprocess':0, 'replicate variance':0, 'smooth':0, 'evaluate':0, 'lag':0, 'statistics':0}
+
+    def stages(self, analysis):
+        """Smoothened state and replicate variances for the parameters of analysis, calculating the stages that are not
+        cached yet. Sets the replicate setup of analysis for the evaluate stage."""
+        p=analysis.params
+        pre=stage_key(p, PREPROCESS_PARAMS)
+        if not pre in self.preprocessed:
+            state=analysis.preprocess(self.df)
+            #The replicate setup is determined in the preprocess stage and used by the later stages
+            self.preprocessed[pre]=(state, (analysis.std_calculated, analysis.reps_in_rows, analysis.reps_in_cols))
+            self.std_dicts[pre+stage_key(p, LAG_PARAMS)]=state['std_dict']
+            self.computed['preprocess']+=1
+        state, setup=self.preprocessed[pre]
+
+        #Replicate variances are calculated from the metrics of the replicate wells, so they depend on the lag parameters
+        var=pre+stage_key(p, LAG_PARAMS)
+        if not var in self.std_dicts:
+            self.std_dicts[var]=analysis.get_replicate_variance(analysis.resample(self.df)) if p['reps']!='' else None
+            self.computed['replicate variance']+=1
+        analysis.std_calculated, analysis.reps_in_rows, analysis.reps_in_cols=setup
+        self.setup=setup
+
+        smooth=pre+stage_key(p, SMOOTH_PARAMS if p['smoothen']==1 else ('smoothen',))
+        if not smooth in self.smoothed:
+            #smoothen replaces entries of the state, the cached preprocess state is left unchanged
+            self.smoothed[smooth]=analysis.smoothen(dict(state))
+            if p['smoothen']==1:
+                self.computed['smooth']+=1
+        return self.smoothed[smooth], self.std_dicts[var]
+
+    def analyse(self, params):
+        """Analyse the plate with the given parameters, reusing cached stages. Returns results (see RESULT_NAMES)."""
+        log.info('Analysing plate with stage cache')
+        analysis=GrowthAnalysis(params)
+        state, std_dict=self.stages(analysis)
+        self.computed['evaluate']+=1
+        results=analysis.evaluate({**state, 'std_dict':std_dict})
+        self.last=(analysis.params, results)
+        return results
+
+    def changed(self, params):
+        """Names of the parameters that differ from the last analysis"""
+        if self.last is None:
+            return set(params)
+        last_params=self.last[0]
+        return {k for k in set(params) | set(last_params) if str(params.get(k))!=str(last_params.get(k))}
+
+    def reanalyse(self, params):
+        """Analyse the plate again after a parameter change. If only lag, LOEC or MIC parameters changed since the last
+        analysis, the lag metric and the statistics depending on them are recalculated and the other results are kept,
+        otherwise the plate is analysed with analyse(). Returns results (see RESULT_NAMES)."""
+        log.info('Reanalysing plate with stage cache')
+        if self.last is None:
+            return self.analyse(params)
+        analysis=GrowthAnalysis(params)
+        p=analysis.params
+        changed=self.changed(p)
+        if len(changed)==0:
+            return self.last[1]
+        if not changed<=set(THRESHOLD_PARAMS):
+            return self.analyse(params)
+
+        results=dict(zip(RESULT_NAMES, self.last[1]))
+        #The stages are cached for the unchanged preprocess and smooth parameters, the statistics need the plate layout
+        state, std_dict=self.stages(analysis)
+        lag=len(changed & set(LAG_PARAMS))>0
+        if lag:
+            #The lag threshold changes the lag length only, the other metrics are independent of it
+            results['std_dict']=std_dict
+            curves=state['smoothed'] if state['smoothed'] is not None else state['plate']
+            lag_len=analysis.calculate_metrics(curves, state['derivatives']).set_index('sample')['lag_len']
+            results['metrics']=results['metrics'].assign(lag_len=results['metrics']['sample'].map(lag_len))
+            self.computed['lag']+=1
+
+        #MICs are called from the maximum yield, LOECs can be called from the lag length
+        if lag or len(changed & set(LOWEC_PARAMS))>0:
+            results['lowecs'], results['noecs']=analysis.lowec_statistics(results['metrics'], state['plate'])
+            self.computed['statistics']+=1
+        if len(changed & set(MIC_PARAMS))>0:
+            results['mics']=analysis.mic_statistics(results['metrics'], state['plate'])
+            self.computed['statistics']+=1
+
+        results=tuple(results[n] for n in RESULT_NAMES)
+        self.last=(p, results)
+        return results
+
+
+def compare_configurations(df, configs, cache=None):
+    """Analyse one plate with several configurations (dictionary name: parameters), sharing the stages that configurations
+    have in common, also with previous comparisons if their stage cache is given. Returns dictionary name: results
+    (dictionary with RESULT_NAMES as keys) and the stage cache."""
+    log.info(f'Comparing {len(configs)} configurations')
+    cache=StageCache(df) if cache is None else cache
+    results={name:dict(zip(RESULT_NAMES, cache.analyse(params))) for name, params in configs.items()}
+    return results, cache
+
+def metric_differences(results):
+    """Side by side table of the metrics of several configurations: one line per sample and metric, one column per
+    configuration, the difference between the highest and lowest value and whether the configurations differ"""
+    log.info('Comparing metrics')
+    frames=[]
+    for name, r in results.items():
+        metrics=r['metrics'].select_dtypes(include='number').assign(sample=r['metrics']['sample'])
+        frames.append(metrics.melt(id_vars='sample', var_name='metric', value_name=name).set_index(['sample', 'metric']))
+    table=pd.concat(frames, axis=1, sort=False).astype(np.float64)
+    names=list(results)
+    table['difference']=table[names].max(axis=1)-table[names].min(axis=1)
+    #Values that are missing in some configurations only also count as differences
+    missing=table[names].isna()
+    table['differs']=(table['difference']>0) | (missing.any(axis=1) & ~missing.all(axis=1))
+    return table.reset_index()
+
+def call_differences(results):
+    """Side by side table of the LOEC, NOEC and MIC calls of several configurations: one line per call and sample row,
+    one column per configuration (called sample, with its concentration if known) and whether the configurations differ"""
+    log.info('Comparing LOEC, NOEC and MIC calls')
+    calls={}
+    for name, r in results.items():
+        conc=r['conc_dict'] or {}
+        label=lambda x: f'{x} ({conc[x[-2:]]})' if x[-2:] in conc else x
+        for call, samples in (('LOEC', r['lowecs']), ('NOEC', r['noecs'])):
+            for x in samples or []:
+                if x!='None':
+                    calls.setdefault((call, x[:-2]), {})[name]=label(x)
+        if r['mics'] is not None:
+            for row, m in zip(r['mics']['rows'], r['mics']['MICs']):
+                calls.setdefault(('MIC', row), {})[name]=label(row+m) if m!='None' else 'None'
+    columns=['call', 'row', *results]
+    if len(calls)==0:
+        return pd.DataFrame(columns=columns+['differs'])
+    table=pd.DataFrame([{'call':call, 'row':row, **{name:values.get(name, 'None') for name in results}}
+                        for (call, row), values in sorted(calls.items())], columns=columns)
+    table['differs']=table[list(results)].nunique(axis=1)>1
+    return table
@@ -0,0 +1,205 @@
+import io
+import os
+import re
+import csv
+import datetime
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import logging as log
+from plate import WELL
+from kernels import stack_plates
+
+#Ingestion of plate reader exports: workbooks with one plate per sheet, series of .csv files or folders of them.
+#Header row and time column are detected, so exports with metadata rows of any length (e.g Omnilog: 10 rows) can be read.
+INPUT_EXTENSIONS=('.xlsx', '.csv')
+
+#Header names recognized as time column, the unit is taken from the header (hours if none is given)
+TIME_HEADER=re.compile(r'\s*(hours?|hrs?|h|time|t|elapsed(\s*time)?)\s*(\((?P<unit>[a-z]+)\)|\[(?P<unit2>[a-z]+)\])?\s*', re.IGNORECASE)
+TIME_UNITS={'h':1, 'hr':1, 'hrs':1, 'hour':1, 'hours':1, 'min':1/60, 'mins':1/60, 'minutes':1/60, 's':1/3600, 'sec':1/3600, 'seconds':1/3600}
+
+#Only the first rows of a sheet are searched for the header
+HEADER_SEARCH_ROWS=100
+
+def raw_sheets(filename, buffer=None):
+    """Read all sheets of an .xlsx file (or the single table of a .csv file) without header, as dictionary
+    sheet name: dataframe of cell values. The .csv delimiter (comma, semicolon or tab) is detected."""
+    log.info(f'Reading sheets of {filename}')
+    source=buffer if buffer is not None else filename
+    if filename.lower().endswith('.xlsx'):
+        return pd.read_excel(source, sheet_name=None, header=None)
+    elif filename.lower().endswith('.csv'):
+        if buffer is not None:
+            text=buffer.read()
+            text=text.decode('utf-8-sig') if isinstance(text, bytes) else text
+        else:
+            with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+                text=f.read()
+        #Delimiter splitting the lines into the most fields (the plate table has one field per well)
+        lines=text.splitlines()[:HEADER_SEARCH_ROWS]
+        delimiter=max(',;\t', key=lambda d: max((len(next(csv.reader([l], delimiter=d))) for l in lines if l), default=0))
+        rows=list(csv.reader(io.StringIO(text), delimiter=delimiter))
+        #Metadata rows can have fewer fields than the table, empty fields are missing values like in excel
+        raw=pd.DataFrame(rows).replace('', np.nan)
+        return {os.path.splitext(os.path.basename(filename))[0]:raw}
+    raise ValueError(f'{filename} is not an .xlsx or .csv file')
+
+def is_well(value):
+    """Check whether a cell contains a well name (e.g A01)"""
+    return isinstance(value, str) and WELL.fullmatch(value.strip()) is not None
+
+def detect_header(raw):
+    """Find the header row of a plate table - the first row with the highest number of well names. Returns the
+    row index and the index of the time column, or None if the sheet does not contain a plate."""
+    log.info('Detecting header row')
+    search=raw.iloc[:HEADER_SEARCH_ROWS]
+    counts=search.map(is_well).sum(axis=1).to_numpy()
+    if len(counts)==0 or counts.max()==0:
+        return None
+    header=int(np.argmax(counts))
+    names=raw.iloc[header]
+
+    #Time column: named like a time column, otherwise the nearest column left of the wells with time values
+    candidates=[i for i, name in enumerate(names) if not is_well(name)]
+    for i in candidates:
+        if isinstance(names.iloc[i], str) and TIME_HEADER.fullmatch(names.iloc[i]) is not None:
+            return header, i
+    first_well=min(i for i, name in enumerate(names) if is_well(name))
+    for i in reversed([i for i in candidates if i<first_well]):
+        if time_values(raw.iloc[header+1:, i]).notna().any():
+            return header, i
+    return None
+
+def time_values(values, name=None):
+    """Convert time column to hours. Numeric values are scaled by the unit given in the header (e.g 'Time (min)'),
+    time of day (hh:mm:ss) and duration values are converted from their components."""
+    unit=1
+    if isinstance(name, str):
+        match=TIME_HEADER.fullmatch(name)
+        if match is not None:
+            unit=TIME_UNITS.get((match.group('unit') or match.group('unit2') or 'h').lower(), 1)
+
+    def to_hours(value):
+        if isinstance(value, datetime.time):
+            return value.hour+value.minute/60+value.second/3600+value.microsecond/3.6e9
+        if isinstance(value, (datetime.timedelta, pd.Timedelta)):
+            return value.total_seconds()/3600
+        if isinstance(value, str) and ':' in value:
+            try:
+                return pd.to_timedelta(value.strip()).total_seconds()/3600
+            except ValueError:
+                return np.nan
+        return np.nan
+
+    numeric=pd.to_numeric(values, errors='coerce')
+    hours=numeric*unit if unit!=1 else numeric
+    durations=values[numeric.isna() & values.notna()]
+    if len(durations)>0:
+        hours=hours.astype(np.float64)
+        hours[durations.index]=durations.map(to_hours)
+    return hours
+
+def parse_table(raw):
+    """Create plate dataframe ('Hour' column followed by one column per well) from a sheet read without header.
+    Rows after the last read (e.g summary rows) are removed, missing or non-numeric reads are NaN."""
+    log.info('Parsing plate table')
+    detected=detect_header(raw)
+    if detected is None:
+        return None
+    header, time_col=detected
+    names=raw.iloc[header]
+    body=raw.iloc[header+1:].reset_index(drop=True)
+
+    hour=time_values(body.iloc[:, time_col], names.iloc[time_col])
+    #The table ends at the first row without time
+    end=int(np.argmax(hour.isna().to_numpy())) if hour.isna().any() else len(hour)
+    df=pd.DataFrame({'Hour':hour.iloc[:end].to_numpy()})
+    for i, name in enumerate(names):
+        if is_well(name) and not name.strip() in df.columns:
+            df[name.strip()]=pd.to_numeric(body.iloc[:end, i], errors='coerce').to_numpy()
+    return df
+
+def read_plates(filename, buffer=None):
+    """Read all plates of an .xlsx (one plate per sheet) or .csv file. Returns list of (sheet name, dataframe),
+    sheets that do not contain a plate table are skipped."""
+    log.info(f'Reading plates from {filename}')
+    plates=[]
+    for sheet, raw in raw_sheets(filename, buffer).items():
+        df=parse_table(raw)
+        if df is not None:
+            plates.append((str(sheet), df))
+    return plates
+
+def plate_files(paths):
+    """Expand input paths (files and folders) into the list of .xlsx and .csv files, folders in alphabetical order"""
+    files=[]
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path)
+                                if f.lower().endswith(INPUT_EXTENSIONS) and not f.startswith(('~$', '.'))))
+        else:
+            files.append(path)
+    return files
+
+def file_names(files):
+    """Unique names of input files for their plate IDs (see plate_ids): the file name, prefixed with the folder relative
+    to the common folder for files with the same name in different folders, and numbered (name-2, ...) for files that
+    are listed several times"""
+    names=[os.path.splitext(os.path.basename(f))[0] for f in files]
+    for name in set(names):
+        same=[i for i, n in enumerate(names) if n==name]
+        folders=[os.path.dirname(os.path.abspath(files[i])) for i in same]
+        if len(set(folders))>1:
+            common=os.path.commonpath(folders)
+            for i, folder in zip(same, folders):
+                if folder!=common:
+                    names[i]=os.path.relpath(folder, common).replace(os.sep, '/')+'/'+name
+
+    taken=set(names)
+    seen=set()
+    for i, name in enumerate(names):
+        if name in seen:
+            n=2
+            while f'{name}-{n}' in taken:
+                n+=1
+            names[i]=f'{name}-{n}'
+            taken.add(names[i])
+        seen.add(name)
+    return names
+
+def plate_ids(filename, sheets, name=None):
+    """Plate IDs of the plates of a file: the file name (or the name given, see file_names), followed by the sheet name
+    for workbooks with several plates"""
+    if name is None:
+        name=os.path.splitext(os.path.basename(filename))[0]
+    if len(sheets)==1:
+        return [name]
+    return [f'{name}/{sheet}' for sheet in sheets]
+
+def ingest(paths, workers=None, processes=True):
+    """Read all plates of several files or folders, parsing the files concurrently in a pool of worker processes
+    (or threads with processes=False). Returns list of (plate ID, dataframe) in input order."""
+    files=plate_files([paths] if isinstance(paths, str) else paths)
+    log.info(f'Ingesting {len(files)} files')
+    if len(files)==0:
+        return []
+    pool=concurrent.futures.ProcessPoolExecutor if processes and len(files)>1 else concurrent.futures.ThreadPoolExecutor
+    with pool(max_workers=min(workers or os.cpu_count() or 1, len(files))) as executor:
+        results=list(executor.map(read_plates, files))
+
+    plates=[]
+    for filename, name, sheets in zip(files, file_names(files), results):
+        if len(sheets)==0:
+            log.warning(f'No plate found in {filename}')
+        plates.extend(zip(plate_ids(filename, [s for s, df in sheets], name), [df for s, df in sheets]))
+    return plates
+
+def load_batch(paths, step=None, wells=None, workers=None, processes=True):
+    """Read all plates of several files or folders and align them onto a common time grid (see kernels.stack_plates).
+    Returns the stacked array (plates, wells, timepoints), the time grid, the well names and the plate IDs."""
+    log.info('Loading plate batch')
+    plates=ingest(paths, workers, processes)
+    if len(plates)==0:
+        raise ValueError('No plates found')
+    stacked, grid, wells=stack_plates([df for plate_id, df in plates], step=step, wells=wells)
+    return stacked, grid, wells, [plate_id for plate_id, df in plates]
@@ -0,0 +1,888 @@
+import warnings
+import numpy as np
+import pandas as pd
+from scipy.interpolate import BSpline
+from scipy.signal import savgol_filter
+from sklearn.isotonic import isotonic_regression
+import logging as log
+try:
+    import numba
+except ImportError:
+    #numba is optional - without it, the NumPy implementations of the loop kernels are used
+    numba=None
+
+#Vectorized kernels operating on whole plates at once. Curves are stored as arrays with time on the last axis,
+#e.g (wells, timepoints) for one plate or (plates, wells, timepoints) for several plates.
+
+#Kernels with early exits (first threshold crossing, steepest window, first non-negative run) and the isotonic regression
+#also have a loop implementation, which is compiled and used instead of the NumPy (or scikit-learn) implementation if numba
+#is installed. Both give identical results.
+JIT_AVAILABLE=numba is not None
+
+#Maximum number of elements of temporary (curves x timepoints x grid points) arrays, larger inputs are processed in chunks
+CHUNK_ELEMENTS=1<<24
+
+def common_grid(times, step=None):
+    """Create a regular time grid covering the time range shared by all time vectors. If no step is given,
+    the median sampling interval of all time vectors is used."""
+    log.info('Creating common time grid')
+    times=[np.asarray(t, dtype=np.float64) for t in times]
+    times=[t[np.isfinite(t)] for t in times]
+    start=max(t.min() for t in times)
+    end=min(t.max() for t in times)
+    if step is None:
+        step=float(np.median(np.concatenate([np.diff(np.sort(t)) for t in times])))
+    if not step>0 or end<start:
+        raise ValueError('Time vectors do not overlap or have no valid sampling interval')
+    #Small tolerance, so the end point is included despite floating point errors
+    return np.arange(start, end+step*1e-6, step)
+
+def interpolate_curves(t, y, grid, fill='nan'):
+    """Linearly interpolate curves onto a time grid. t is either one time vector shared by all curves (timepoints,)
+    or one time vector per curve (same shape as y). Missing reads (NaN in y or t) and irregular intervals are
+    handled per curve. Grid points outside the observed range of a curve are NaN, or, with fill='nearest',
+    the first/last observed value."""
+    y=np.asarray(y, dtype=np.float64)
+    grid=np.asarray(grid, dtype=np.float64)
+    lead=y.shape[:-1]
+    y=y.reshape(-1, y.shape[-1])
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), lead+(y.shape[-1],)).reshape(y.shape)
+
+    #Move missing reads to the end of each curve and sort the remaining ones by time
+    valid=np.isfinite(y) & np.isfinite(t)
+    t_sort=np.where(valid, t, np.inf)
+    order=np.argsort(t_sort, axis=1, kind='stable')
+    t_sort=np.take_along_axis(t_sort, order, axis=1)
+    y_sort=np.take_along_axis(np.where(valid, y, np.nan), order, axis=1)
+    n_valid=valid.sum(axis=1)
+
+    out=np.full((y.shape[0], grid.size), np.nan)
+    rows_per_chunk=max(1, CHUNK_ELEMENTS//max(1, y.shape[1]*grid.size))
+    for a in range(0, y.shape[0], rows_per_chunk):
+        ts=t_sort[a:a+rows_per_chunk]
+        ys=y_sort[a:a+rows_per_chunk]
+        k=n_valid[a:a+rows_per_chunk, None]
+
+        #Number of observed timepoints <= grid point, i.e. index of the right interpolation point
+        idx=(ts[:, :, None]<=grid[None, None, :]).sum(axis=1)
+        lo=np.clip(idx-1, 0, np.maximum(k-2, 0))
+        hi=np.minimum(lo+1, np.maximum(k-1, 0))
+        t0=np.take_along_axis(ts, lo, axis=1)
+        t1=np.take_along_axis(ts, hi, axis=1)
+        y0=np.take_along_axis(ys, lo, axis=1)
+        y1=np.take_along_axis(ys, hi, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w=np.where(t1>t0, (grid[None, :]-t0)/(t1-t0), 0.0)
+        res=y0+w*(y1-y0)
+
+        first=ts[:, :1]
+        last=np.take_along_axis(ts, np.maximum(k-1, 0), axis=1)
+        outside_lo=grid[None, :]<first
+        outside_hi=grid[None, :]>last
+        if fill=='nearest':
+            res=np.where(outside_lo, ys[:, :1], res)
+            res=np.where(outside_hi, np.take_along_axis(ys, np.maximum(k-1, 0), axis=1), res)
+        else:
+            res=np.where(outside_lo | outside_hi, np.nan, res)
+        #A curve with a single valid read can only be placed exactly at (or, with fill='nearest', around) that read
+        res=np.where(k==1, np.where((grid[None, :]==first) | (fill=='nearest'), ys[:, :1], np.nan), res)
+        res=np.where(k==0, np.nan, res)
+        out[a:a+rows_per_chunk]=res
+
+    return out.reshape(lead+(grid.size,))
+
+def resample_plate(df, step=None, grid=None, fill='nearest'):
+    """Resample plate dataframe ('Hour' column followed by one column per well) onto a regular time grid,
+    interpolating missing reads. Either a grid or a step (in hours) can be given, otherwise the median
+    sampling interval of the plate is used."""
+    log.info('Resampling plate')
+    t=df.iloc[:, 0].to_numpy(dtype=np.float64)
+    if grid is None:
+        valid=t[np.isfinite(t)]
+        if step is None:
+            step=float(np.median(np.diff(np.sort(valid))))
+        grid=np.arange(valid.min(), valid.max()+step*1e-6, step)
+    values=interpolate_curves(t, df.iloc[:, 1:].to_numpy(dtype=np.float64).T, grid, fill=fill)
+    res=pd.DataFrame(values.T, columns=df.columns[1:])
+    res.insert(0, df.columns[0], grid)
+    return res
+
+def needs_resampling(df, rtol=0.01):
+    """Check whether a plate contains missing reads or irregular sampling intervals"""
+    t=df.iloc[:, 0].to_numpy(dtype=np.float64)
+    if not np.isfinite(t).all() or df.iloc[:, 1:].isna().to_numpy().any():
+        return True
+    d=np.diff(t)
+    return len(d)>0 and (d.min()<=0 or (d.max()-d.min())>rtol*np.median(d))
+
+def stack_plates(dfs, step=None, wells=None):
+    """Align several plates, possibly read at different intervals, onto one common time grid. Returns a dense
+    array (plates, wells, timepoints), the time grid and the well names. By default all wells found on any plate
+    are included; wells missing on a plate are NaN."""
+    log.info(f'Stacking {len(dfs)} plates')
+    if wells is None:
+        wells=list(dict.fromkeys(c for df in dfs for c in df.columns[1:]))
+    grid=common_grid([df.iloc[:, 0] for df in dfs], step=step)
+    stacked=np.full((len(dfs), len(wells), grid.size), np.nan)
+    for i, df in enumerate(dfs):
+        present=[w for w in wells if w in df.columns]
+        idx=[wells.index(w) for w in present]
+        stacked[i, idx]=interpolate_curves(df.iloc[:, 0].to_numpy(dtype=np.float64), df[present].to_numpy(dtype=np.float64).T, grid)
+    return stacked, grid, wells
+
+def window_sums(a, valid, window):
+    """Sums of a over all windows of consecutive timepoints (last axis), computed from cumulative sums.
+    Entries where valid is False do not contribute."""
+    c=np.cumsum(np.where(valid, a, 0.0), axis=-1)
+    c=np.concatenate([np.zeros(c.shape[:-1]+(1,)), c], axis=-1)
+    return c[..., window:]-c[..., :-window]
+
+def sliding_regression(t, y, window):
+    """Least-squares lines of y against t over all windows of `window` consecutive timepoints, for all curves at once.
+    t is either shared by all curves or has the same shape as y. Each window sum is the difference of two cumulative
+    sums, so the cost is O(timepoints) per curve independent of the window size. Returns slopes and the mean time and
+    value of each window (the fitted line passes through them). Windows containing missing values are NaN."""
+    y=np.asarray(y, dtype=np.float64)
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), y.shape)
+    if window<2 or y.shape[-1]<window:
+        empty=np.full(y.shape[:-1]+(max(0, y.shape[-1]-window+1),), np.nan)
+        return empty, empty, empty
+    valid=np.isfinite(y) & np.isfinite(t)
+
+    #Center time per curve, limiting cancellation in the sums of squares
+    center=np.where(valid, t, 0.0).sum(axis=-1, keepdims=True)/np.maximum(valid.sum(axis=-1, keepdims=True), 1)
+    tc=t-center
+    n=window_sums(np.ones(y.shape), valid, window)
+    st=window_sums(tc, valid, window)
+    sy=window_sums(y, valid, window)
+    stt=window_sums(tc*tc, valid, window)
+    sty=window_sums(tc*y, valid, window)
+
+    denom=n*stt-st*st
+    full=(n==window) & (denom>0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes=np.where(full, (n*sty-st*sy)/denom, np.nan)
+        t_mean=np.where(full, st/n+center, np.nan)
+        y_mean=np.where(full, sy/n, np.nan)
+    return slopes, t_mean, y_mean
+
+def steepest_window(slopes):
+    """Index of the steepest window of each curve and a mask of curves without any valid window"""
+    empty=np.isnan(slopes).all(axis=-1)
+    idx=np.argmax(np.where(np.isnan(slopes), -np.inf, slopes), axis=-1)[..., None]
+    return idx, empty
+
+def doubling_time(mu_max):
+    """Doubling time (h) for specific growth rates (1/h), NaN where there is no growth"""
+    mu_max=np.asarray(mu_max, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(mu_max>0, np.log(2)/mu_max, np.nan)
+
+def jit(function):
+    """Compile loop kernel with numba if it is installed. Without numba, the loop kernel is returned unchanged
+    (it is then only used to check the NumPy implementation, as it is slow in pure Python)."""
+    if numba is None:
+        return function
+    #NumPy error model: divisions by zero give inf/NaN like the NumPy implementations, instead of raising
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(function)
+
+def use_compiled(compiled):
+    """Whether to use the compiled loop kernels - by default if numba is installed"""
+    if compiled is None:
+        return JIT_AVAILABLE
+    return compiled
+
+def curve_times(t, y):
+    """Time as (1, timepoints) array if it is shared by all curves, otherwise as (curves, timepoints) array"""
+    t=np.asarray(t, dtype=np.float64)
+    if t.ndim==1:
+        return t[None]
+    return np.ascontiguousarray(np.broadcast_to(t, y.shape).reshape(-1, y.shape[-1]))
+
+@jit
+def steepest_slope_loop(t, y, span):
+    """Loop kernel of steepest_slope for (curves, timepoints) arrays"""
+    n, T=y.shape
+    slopes=np.full(n, np.nan)
+    for i in range(n):
+        ti=t[i] if t.shape[0]>1 else t[0]
+        best=0.0
+        idx=-1
+        for j in range(T-span+1):
+            d=y[i, j+span-1]-y[i, j]
+            #NaN differences are never selected
+            if d>=0 and (idx<0 or d>best):
+                best=d
+                idx=j
+        if idx>=0:
+            slopes[i]=best/(ti[idx+span-1]-ti[idx])
+    return slopes
+
+def steepest_slope(t, y, span=4, compiled=None):
+    """Slope between the first and last of `span` consecutive points with the greatest (non-negative) increase,
+    for all curves at once. NaN for curves that never increase over `span` points."""
+    y=np.asarray(y, dtype=np.float64)
+    if use_compiled(compiled):
+        return steepest_slope_loop(curve_times(t, y), y.reshape(-1, y.shape[-1]), span).reshape(y.shape[:-1])
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), y.shape)
+    if y.shape[-1]<span:
+        return np.full(y.shape[:-1], np.nan)
+    d=y[..., span-1:]-y[..., :-(span-1)]
+    d=np.where(d<0, np.nan, d)
+    empty=np.isnan(d).all(axis=-1)
+    #First window with the greatest increase
+    idx=np.argmax(np.where(np.isnan(d), -np.inf, d), axis=-1)[..., None]
+    dx=np.take_along_axis(t, idx+span-1, axis=-1)-np.take_along_axis(t, idx, axis=-1)
+    slopes=np.take_along_axis(d, idx, axis=-1)/dx
+    return np.where(empty, np.nan, slopes[..., 0])
+
+@jit
+def first_crossing_loop(t, y, thresholds):
+    """Loop kernel of first_crossing for (curves, timepoints) arrays"""
+    n, T=y.shape
+    x=np.full(n, np.nan)
+    after=np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        ti=t[i] if t.shape[0]>1 else t[0]
+        for j in range(T):
+            if y[i, j]>thresholds[i]:
+                after[i]=j
+                if j==0:
+                    x[i]=ti[0]
+                else:
+                    m=(y[i, j]-y[i, j-1])/(ti[j]-ti[j-1])
+                    b=y[i, j-1]-m*ti[j-1]
+                    x[i]=(thresholds[i]-b)/m
+                break
+    return x, after
+
+def first_crossing(t, y, thresholds, compiled=None):
+    """Time at which each curve first exceeds its threshold, linearly interpolated between the reads before and after
+    the crossing, for all curves at once. thresholds is a scalar or one value per curve. Returns crossing times
+    and the index of the first read above the threshold (-1 and NaN if the threshold is never exceeded)."""
+    y=np.asarray(y, dtype=np.float64)
+    thresholds=np.broadcast_to(np.asarray(thresholds, dtype=np.float64), y.shape[:-1])
+    if use_compiled(compiled):
+        x, after=first_crossing_loop(curve_times(t, y), y.reshape(-1, y.shape[-1]), np.ascontiguousarray(thresholds).reshape(-1))
+        return x.reshape(y.shape[:-1]), after.reshape(y.shape[:-1])
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), y.shape)
+    above=y>thresholds[..., None]
+    crossed=above.any(axis=-1)
+    after=np.argmax(above, axis=-1)[..., None]
+    before=np.maximum(after-1, 0)
+
+    x1=np.take_along_axis(t, before, axis=-1)[..., 0]
+    x2=np.take_along_axis(t, after, axis=-1)[..., 0]
+    y1=np.take_along_axis(y, before, axis=-1)[..., 0]
+    y2=np.take_along_axis(y, after, axis=-1)[..., 0]
+    #Solve y=mx+b for x at the threshold
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m=(y2-y1)/(x2-x1)
+        b=y1-m*x1
+        x=(thresholds-b)/m
+    x=np.where(after[..., 0]==0, x2, x)
+    return np.where(crossed, x, np.nan), np.where(crossed, after[..., 0], -1)
+
+@jit
+def nonnegative_start_loop(y, points):
+    """Loop kernel of nonnegative_start for (curves, timepoints) arrays"""
+    n, T=y.shape
+    starts=np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        run=0
+        for j in range(T):
+            #NaN reads interrupt a run like negative reads
+            if y[i, j]>=0:
+                run+=1
+                if run==points:
+                    break
+            else:
+                run=0
+        #A run reaching the last read is accepted even if it is shorter
+        if run>0:
+            starts[i]=j-run+1
+    return starts
+
+def nonnegative_start(y, points=6, compiled=None):
+    """Index of the first read of each curve that starts `points` consecutive non-negative reads (or non-negative
+    reads up to the last read), -1 for curves without such a read"""
+    y=np.asarray(y)
+    if use_compiled(compiled):
+        return nonnegative_start_loop(y.reshape(-1, y.shape[-1]), points).reshape(y.shape[:-1])
+    T=y.shape[-1]
+    #Number of negative (or missing) reads within the window starting at each read, from cumulative sums
+    negative=np.cumsum(~(y>=0), axis=-1)
+    negative=np.concatenate([np.zeros(y.shape[:-1]+(1,), dtype=negative.dtype), negative], axis=-1)
+    start=np.arange(T)
+    window=negative[..., np.minimum(start+points, T)]-negative[..., start]
+    return np.where((window==0).any(axis=-1), np.argmax(window==0, axis=-1), -1)
+
+def robust_baseline(y, points=5):
+    """Baseline of each curve as the median of its first reads, insensitive to single outlying reads"""
+    y=np.asarray(y, dtype=np.float64)
+    with warnings.catch_warnings():
+        #Curves without any valid read in the first points get a NaN baseline
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(y[..., :points], axis=-1)
+
+def tangent_lag(t, smooth, slope, baseline, min_signal=0.0):
+    """Lag time by the tangent method for all curves at once: the time at which the tangent at the point of
+    maximum slope intersects the baseline. smooth and slope are smoothed curves and their derivative
+    (see derivative_curves). NaN for curves without growth: curves without positive slope or whose smoothed curve
+    does not rise more than min_signal above the baseline (as in phase_labels), so that noise on flat curves gives no lag."""
+    smooth=np.asarray(smooth, dtype=np.float64)
+    slope=np.asarray(slope, dtype=np.float64)
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), slope.shape)
+    idx, empty=steepest_window(slope)
+    s=np.take_along_axis(slope, idx, axis=-1)[..., 0]
+    with warnings.catch_warnings():
+        #Curves without any valid read
+        warnings.simplefilter('ignore', RuntimeWarning)
+        grows=(s>0) & (np.nanmax(smooth, axis=-1)-baseline>min_signal)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lag=np.take_along_axis(t, idx, axis=-1)[..., 0]+(baseline-np.take_along_axis(smooth, idx, axis=-1)[..., 0])/s
+    return np.where(empty | ~grows, np.nan, lag)
+
+#Growth phases, in the order of their labels
+PHASES=('lag', 'growth', 'stationary', 'decline')
+
+def local_linear(t, y, window=5):
+    """Local least-squares line at every timepoint, fitted over a window of consecutive timepoints centered on it
+    (a first order Savitzky-Golay filter, which also works for irregular read intervals). At both ends of the curves,
+    the line of the first/last full window is used. Returns smoothed values and slopes (the first derivative)."""
+    y=np.asarray(y, dtype=np.float64)
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), y.shape)
+    slopes, t_mean, y_mean=sliding_regression(t, y, window)
+    if slopes.shape[-1]==0:
+        return np.full(y.shape, np.nan), np.full(y.shape, np.nan)
+    #Window used for each timepoint
+    idx=np.broadcast_to(np.clip(np.arange(y.shape[-1])-(window-1)//2, 0, slopes.shape[-1]-1), y.shape)
+    slope=np.take_along_axis(slopes, idx, axis=-1)
+    smooth=np.take_along_axis(y_mean, idx, axis=-1)+slope*(t-np.take_along_axis(t_mean, idx, axis=-1))
+    return smooth, slope
+
+def pspline_basis(t, segments=20, degree=3):
+    """Cubic B-spline basis with equally spaced knots over the range of t, and its first derivative"""
+    t=np.asarray(t, dtype=np.float64)
+    step=(t.max()-t.min())/segments
+    knots=t.min()+step*np.arange(-degree, segments+degree+1)
+    spline=BSpline(knots, np.eye(segments+degree), degree, extrapolate=False)
+    return np.nan_to_num(spline(t)), np.nan_to_num(spline.derivative()(t))
+
+def pspline(t, y, penalty=1.0, segments=None, degree=3):
+    """Penalized B-spline (P-spline) fit of all curves at once. All curves share the time vector t, so the
+    penalized normal equations are solved once with one right-hand side per curve. Returns smoothed values and
+    their first derivative. Curves with missing reads are NaN."""
+    y=np.asarray(y, dtype=np.float64)
+    t=np.asarray(t, dtype=np.float64)
+    lead=y.shape[:-1]
+    y=y.reshape(-1, y.shape[-1])
+    if segments is None:
+        segments=max(4, min(40, y.shape[-1]//4))
+    B, dB=pspline_basis(t, segments, degree)
+    #Second order difference penalty on neighbouring coefficients
+    D=np.diff(np.eye(B.shape[1]), n=2, axis=0)
+    valid=np.isfinite(y).all(axis=-1)
+    coefs=np.linalg.solve(B.T@B+penalty*(D.T@D), B.T@np.where(valid[:, None], y, 0.0).T)
+    smooth=np.where(valid[:, None], (B@coefs).T, np.nan)
+    slope=np.where(valid[:, None], (dB@coefs).T, np.nan)
+    return smooth.reshape(lead+(t.size,)), slope.reshape(lead+(t.size,))
+
+#Smoothers available for derivative curves
+DERIVATIVE_METHODS=('Savitzky-Golay', 'Spline')
+
+def derivative_curves(t, y, method='Savitzky-Golay', window=5, penalty=1.0, min_signal=5.0):
+    """Smoothed curves and their first derivatives dy/dt and d ln(y)/dt for all curves at once.
+    With 'Savitzky-Golay', local least-squares lines over `window` timepoints are fitted to the curves and to
+    the log-transformed curves (reads <= min_signal are excluded, so windows containing them are NaN). With 'Spline',
+    a P-spline is fitted and d ln(y)/dt=(dy/dt)/y where the fitted curve exceeds min_signal."""
+    y=np.asarray(y, dtype=np.float64)
+    if method=='Spline':
+        smooth, slope=pspline(t, y, penalty)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_slope=np.where(smooth>min_signal, slope/smooth, np.nan)
+    elif method=='Savitzky-Golay':
+        smooth, slope=local_linear(t, y, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_y=np.log(np.where(y>min_signal, y, np.nan))
+        log_slope=local_linear(t, log_y, window)[1]
+    else:
+        raise ValueError(f'Unknown derivative method {method}')
+    return smooth, slope, log_slope
+
+def runs(labels):
+    """Runs of equal consecutive values in each row of a 2D array. Returns row index, start index,
+    length and value of every run, ordered by row and start."""
+    labels=np.asarray(labels)
+    n, T=labels.shape
+    change=np.ones((n, T), dtype=bool)
+    change[:, 1:]=labels[:, 1:]!=labels[:, :-1]
+    starts=np.flatnonzero(change.ravel())
+    lengths=np.diff(np.append(starts, n*T))
+    return starts//T, starts%T, lengths, labels.ravel()[starts]
+
+def remove_short_runs(mask, min_points):
+    """Set runs of True shorter than min_points to False, in each row of a 2D boolean array"""
+    row, start, length, value=runs(mask)
+    short=value & (length<min_points)
+    #Mark start and end of each short run and fill in between with a cumulative sum
+    marks=np.zeros(mask.size+1, dtype=np.int64)
+    flat_start=row[short]*mask.shape[1]+start[short]
+    np.add.at(marks, flat_start, 1)
+    np.add.at(marks, flat_start+length[short], -1)
+    return mask & ~(np.cumsum(marks[:-1])>0).reshape(mask.shape)
+
+def phase_labels(t, y, window=5, threshold=0.1, min_signal=5.0, rate=None):
+    """Assign every timepoint of all curves to a growth phase (index into PHASES). Timepoints are growth where the local
+    slope exceeds threshold*maximum slope of the curve, decline where it is below -threshold*maximum slope. Growth and
+    decline runs shorter than the window are ignored, so several growth phases (diauxic shifts) are only detected if
+    they are separated by a sustained drop of the growth rate. Everything before the first growth phase is lag,
+    non-growing timepoints after it are stationary. Curves increasing by less than min_signal are lag throughout.
+    Returns labels and the local slopes (which can be given as rate, if already calculated)."""
+    y=np.asarray(y, dtype=np.float64)
+    lead=y.shape[:-1]
+    y=y.reshape(-1, y.shape[-1])
+    if rate is None:
+        rate=local_linear(t, y, window)[1]
+    rate=np.asarray(rate, dtype=np.float64).reshape(y.shape)
+
+    with warnings.catch_warnings():
+        #Curves without any valid read
+        warnings.simplefilter('ignore', RuntimeWarning)
+        max_rate=np.nanmax(rate, axis=-1, keepdims=True)
+        amplitude=np.nanmax(y, axis=-1, keepdims=True)-robust_baseline(y, window)[:, None]
+    grows=(max_rate>0) & (amplitude>min_signal)
+    with np.errstate(invalid='ignore'):
+        growth=remove_short_runs(grows & (rate>threshold*max_rate), window)
+        decline=remove_short_runs(grows & (rate<-threshold*max_rate), window)
+
+    after_growth=np.cumsum(growth, axis=-1)>0
+    labels=np.zeros(y.shape, dtype=np.int8)
+    labels[after_growth]=PHASES.index('stationary')
+    labels[decline & after_growth]=PHASES.index('decline')
+    labels[growth]=PHASES.index('growth')
+    return labels.reshape(lead+(y.shape[-1],)), rate.reshape(lead+(y.shape[-1],))
+
+def phase_segments(t, y, labels, rate):
+    """Per-phase metrics of all curves from phase labels: one entry per run of timepoints with the same phase,
+    with curve index, phase label, number of the phase within the curve (e.g. 2 for the second growth phase),
+    start and end time, duration, value at start and end, and maximum local slope"""
+    y=np.asarray(y, dtype=np.float64).reshape(-1, np.shape(y)[-1])
+    labels=np.asarray(labels).reshape(y.shape)
+    rate=np.asarray(rate, dtype=np.float64).reshape(y.shape)
+    t=np.broadcast_to(np.asarray(t, dtype=np.float64), y.shape)
+    row, start, length, phase=runs(labels)
+    end=start+length-1
+
+    #Occurrence of each phase within its curve, counting runs with the same row and phase
+    key=row*len(PHASES)+phase
+    order=np.argsort(key, kind='stable')
+    sorted_key=key[order]
+    first=np.searchsorted(sorted_key, sorted_key, side='left')
+    number=np.empty_like(key)
+    number[order]=np.arange(key.size)-first+1
+
+    flat_start=row*y.shape[1]+start
+    with np.errstate(invalid='ignore'):
+        max_rate=np.fmax.reduceat(rate.ravel(), flat_start) if flat_start.size>0 else np.zeros(0)
+    return {'curve':row, 'phase':phase, 'number':number, 'start':t[row, start], 'end':t[row, end],
+            'duration':t[row, end]-t[row, start], 'start_value':y[row, start], 'end_value':y[row, end], 'max_rate':max_rate}
+
+@jit
+def isotonic_loop(y):
+    """Loop kernel of isotonic for (curves, timepoints) arrays without missing reads: pool adjacent violators,
+    merging each read into the blocks before it while their means decrease"""
+    n, T=y.shape
+    out=np.empty((n, T))
+    means=np.empty(T)
+    weights=np.empty(T)
+    ends=np.empty(T, dtype=np.int64)
+    for i in range(n):
+        blocks=0
+        for j in range(T):
+            means[blocks]=y[i, j]
+            weights[blocks]=1.0
+            ends[blocks]=j
+            blocks+=1
+            while blocks>1 and means[blocks-2]>means[blocks-1]:
+                w=weights[blocks-2]+weights[blocks-1]
+                means[blocks-2]=(means[blocks-2]*weights[blocks-2]+means[blocks-1]*weights[blocks-1])/w
+                weights[blocks-2]=w
+                ends[blocks-2]=ends[blocks-1]
+                blocks-=1
+        start=0
+        for b in range(blocks):
+            out[i, start:ends[b]+1]=means[b]
+            start=ends[b]+1
+    return out
+
+def isotonic(y, compiled=None):
+    """Monotonically increasing least-squares fit (isotonic regression) of all curves at once, with the pool adjacent
+    violators algorithm (O(timepoints) per curve): the compiled loop kernel if numba is installed, otherwise
+    scikit-learn's implementation per curve. Curves with missing reads are NaN."""
+    y=np.asarray(y, dtype=np.float64)
+    lead=y.shape[:-1]
+    y=y.reshape(-1, y.shape[-1])
+    out=np.full(y.shape, np.nan)
+    rows=np.flatnonzero(np.isfinite(y).all(axis=-1))
+    if use_compiled(compiled):
+        out[rows]=isotonic_loop(np.ascontiguousarray(y[rows]))
+    else:
+        for r in rows:
+            out[r]=isotonic_regression(y[r])
+    return out.reshape(lead+(y.shape[-1],))
+
+#Smoothers available for the smoothing stage, besides the GAM fitted per curve
+SMOOTHERS=('GAM', 'Savitzky-Golay', 'Isotonic', 'Spline')
+
+def smooth_curves(t, y, method='Savitzky-Golay', window=7, penalty=1.0):
+    """Smooth all curves at once. 'Savitzky-Golay' fits second order polynomials over windows of `window` reads
+    (assuming regular read intervals), 'Isotonic' fits monotonically increasing curves (like the constrained GAM),
+    'Spline' fits penalized splines without shape constraint, so declines are preserved."""
+    y=np.asarray(y, dtype=np.float64)
+    if method=='Savitzky-Golay':
+        window=min(window, y.shape[-1]-(1-y.shape[-1]%2))
+        return savgol_filter(y, window, min(2, window-1), axis=-1, mode='interp')
+    elif method=='Isotonic':
+        return isotonic(y)
+    elif method=='Spline':
+        return pspline(t, y, penalty)[0]
+    raise ValueError(f'Unknown smoother {method}')
+
+def group_medians(curves, groups):
+    """Median curve of each group of curves, for all groups at once. groups holds the group index of each curve
+    (-1 for curves without group). Groups are padded to the size of the largest group, sorted along the replicate axis
+    (padding last), and the median is taken from the middle element(s) according to the group size."""
+    curves=np.asarray(curves, dtype=np.float64)
+    groups=np.asarray(groups)
+    member=groups>=0
+    n_groups=groups.max()+1 if member.any() else 0
+    sizes=np.bincount(groups[member], minlength=n_groups)
+
+    #Position of each curve within its group
+    order=np.argsort(np.where(member, groups, n_groups), kind='stable')[:member.sum()]
+    starts=np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    slot=np.arange(order.size)-starts[groups[order]]
+
+    padded=np.full((n_groups, max(1, sizes.max(initial=0)), curves.shape[-1]), np.nan)
+    padded[groups[order], slot]=curves[order]
+    padded=np.sort(padded, axis=1)
+    lo=np.maximum((sizes-1)//2, 0)[:, None, None]
+    hi=np.maximum(sizes//2, 0)[:, None, None]
+    shape=(n_groups, 1, curves.shape[-1])
+    median=(np.take_along_axis(padded, np.broadcast_to(lo, shape), axis=1)+np.take_along_axis(padded, np.broadcast_to(hi, shape), axis=1))/2
+    return median[:, 0], sizes
+
+def replicate_outliers(curves, groups, threshold=3.5):
+    """Flag outlier curves among replicates, for a whole plate at once. The distance of each curve to the median curve
+    of its replicate group (root mean square difference over time) is compared to the distances of all grouped curves
+    of the plate by a robust z-score (median and median absolute deviation). Curves with a score above threshold are
+    outliers - only in groups of at least 3 replicates, as with 2 replicates the deviating one cannot be identified, and
+    only if they are not among the closest half of their group, so the majority of each group is always kept.
+    Returns distances, scores and outlier flags (NaN/False for curves without group)."""
+    curves=np.asarray(curves, dtype=np.float64)
+    groups=np.asarray(groups)
+    member=groups>=0
+    distance=np.full(groups.shape, np.nan)
+    score=np.full(groups.shape, np.nan)
+    if not member.any():
+        return distance, score, np.zeros(groups.shape, dtype=bool)
+
+    median, sizes=group_medians(curves, groups)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        distance[member]=np.sqrt(np.nanmean((curves[member]-median[groups[member]])**2, axis=-1))
+        center=np.nanmedian(distance[member])
+        mad=1.4826*np.nanmedian(np.abs(distance[member]-center))
+    #Identical replicates have no spread, avoid division by zero
+    mad=mad if mad>0 else max(np.nanmean(np.abs(distance[member]-center)), np.finfo(np.float64).eps)
+    score[member]=(distance[member]-center)/mad
+
+    #Rank of each curve's distance within its group (0 for the closest curve)
+    order=np.lexsort((distance, np.where(member, groups, -1)))[-member.sum():]
+    starts=np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank=np.zeros(groups.shape, dtype=np.int64)
+    rank[order]=np.arange(order.size)-starts[groups[order]]
+
+    size=sizes[np.where(member, groups, 0)]
+    outlier=member & (score>threshold) & (size>=3) & (rank>=(size+1)//2)
+    return distance, score, outlier
+
+#Models of the plate position trend removed by the edge effect correction
+EDGE_CORRECTIONS=('None', 'Median polish', 'Surface')
+
+def median_polish(y, rows, cols, sweeps=10):
+    """Tukey's median polish of the plate at all timepoints at once. y holds one curve per well, rows and cols the
+    row and column index of each well. Returns overall level (per timepoint), row effects and column effects."""
+    y=np.asarray(y, dtype=np.float64)
+    table=np.full((rows.max()+1, cols.max()+1, y.shape[-1]), np.nan)
+    table[rows, cols]=y
+    overall=np.zeros(y.shape[-1])
+    row_effects=np.zeros((table.shape[0], y.shape[-1]))
+    col_effects=np.zeros((table.shape[1], y.shape[-1]))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i in range(sweeps):
+            medians=np.nanmedian(table, axis=1)
+            table-=medians[:, None]
+            row_effects+=medians
+            shift=np.nanmedian(col_effects, axis=0)
+            col_effects-=shift
+            overall+=shift
+
+            medians=np.nanmedian(table, axis=0)
+            table-=medians[None]
+            col_effects+=medians
+            shift=np.nanmedian(row_effects, axis=0)
+            row_effects-=shift
+            overall+=shift
+    return overall, row_effects, col_effects
+
+def surface_basis(row_pos, col_pos):
+    """Quadratic surface over plate positions (scaled to -1..1): 1, r, c, r^2, c^2, r*c"""
+    r, c=[(p-p.min())/max(p.max()-p.min(), 1)*2-1 for p in (np.asarray(row_pos, dtype=np.float64), np.asarray(col_pos, dtype=np.float64))]
+    return np.stack([np.ones_like(r), r, c, r**2, c**2, r*c], axis=-1)
+
+def plate_trend(y, row_pos, col_pos, method='Median polish'):
+    """Plate position trend of all wells at all timepoints, relative to the plate level, to be substracted from the curves.
+    row_pos and col_pos are the (possibly fractional, for averaged wells) row and column positions of the wells.
+    'Median polish' gives row plus column effects, 'Surface' a quadratic surface fitted by least squares to all
+    timepoints in one solve. Wells with missing reads do not contribute to the surface."""
+    y=np.asarray(y, dtype=np.float64)
+    if method=='Median polish':
+        rows=np.unique(row_pos, return_inverse=True)[1]
+        cols=np.unique(col_pos, return_inverse=True)[1]
+        overall, row_effects, col_effects=median_polish(y, rows, cols)
+        return row_effects[rows]+col_effects[cols]
+    elif method=='Surface':
+        basis=surface_basis(row_pos, col_pos)
+        valid=np.isfinite(y).all(axis=-1)
+        coef=np.linalg.lstsq(basis[valid], y[valid], rcond=None)[0]
+        trend=basis@coef
+        return trend-trend[valid].mean(axis=0)
+    raise ValueError(f'Unknown edge correction {method}')
+
+def effect_concentrations(conc, effect, levels):
+    """Concentrations at which monotonic single drug effect curves (plates, concentrations; concentrations ascending)
+    reach the effect levels, by linear interpolation. Inf where a level is never reached."""
+    idx=(effect[:, :, None]<levels[None, None, :]).sum(axis=1)
+    reached=idx<effect.shape[1]
+    hi=np.minimum(idx, effect.shape[1]-1)
+    lo=np.maximum(hi-1, 0)
+    e_lo=np.take_along_axis(effect, lo, axis=1)
+    e_hi=np.take_along_axis(effect, hi, axis=1)
+    step=np.where(e_hi>e_lo, e_hi-e_lo, 1)
+    ec=conc[lo]+np.clip((levels[None]-e_lo)/step, 0, 1)*(conc[hi]-conc[lo])
+    return np.where(reached, ec, np.inf)
+
+def checkerboard_synergy(growth, conc_a, conc_b, cutoff=0.1, levels=101):
+    """Synergy of two drug checkerboards for many plates at once. growth holds a growth metric (plates, rows, columns),
+    drug A varies along the columns (conc_a), drug B along the rows (conc_b). The lowest concentration of each drug
+    is taken as drug free, the well without either drug as reference growth. Wells with at most cutoff (fraction) of
+    the reference growth are inhibited. Returns per well FIC (inhibited wells), Bliss and Loewe excess (observed minus
+    expected fraction inhibited, positive for synergy), and per plate MICs of both drugs and the FIC index."""
+    growth=np.asarray(growth, dtype=np.float64)
+    conc_a=np.asarray(conc_a, dtype=np.float64)
+    conc_b=np.asarray(conc_b, dtype=np.float64)
+    #Sort both axes by ascending concentration
+    ia=np.argsort(conc_a, kind='stable')
+    ib=np.argsort(conc_b, kind='stable')
+    growth=growth[:, ib][:, :, ia]
+    ca=conc_a[ia]
+    cb=conc_b[ib]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction=growth/growth[:, :1, :1]
+    inhibited=fraction<=cutoff
+    effect=np.clip(1-fraction, 0, 1)
+
+    #MICs of the single drugs (NaN if not reached)
+    mic_a=np.where(inhibited[:, 0, :].any(axis=1), ca[np.argmax(inhibited[:, 0, :], axis=1)], np.nan)
+    mic_b=np.where(inhibited[:, :, 0].any(axis=1), cb[np.argmax(inhibited[:, :, 0], axis=1)], np.nan)
+    fic=ca[None, None, :]/mic_a[:, None, None]+cb[None, :, None]/mic_b[:, None, None]
+    fic=np.where(inhibited, fic, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        fici=np.nanmin(fic.reshape(fic.shape[0], -1), axis=1)
+
+    #Bliss independence: E_AB=E_A+E_B-E_A*E_B
+    effect_a=effect[:, :1, :]
+    effect_b=effect[:, :, :1]
+    bliss=effect-(effect_a+effect_b-effect_a*effect_b)
+
+    #Loewe additivity: expected effect E solves c_A/EC_A(E)+c_B/EC_B(E)=1, searched over a grid of effect levels
+    e=np.linspace(0, 1, levels)[1:-1]
+    ec_a=effect_concentrations(ca, np.maximum.accumulate(effect[:, 0, :], axis=1), e)
+    ec_b=effect_concentrations(cb, np.maximum.accumulate(effect[:, :, 0], axis=1), e)
+    index=ca[None, None, :, None]/ec_a[:, None, None, :]+cb[None, :, None, None]/ec_b[:, None, None, :]
+    #Levels that neither drug reaches on its own cannot be expected
+    index=np.where((np.isinf(ec_a) & np.isinf(ec_b))[:, None, None, :], np.inf, index)
+    #The index decreases with the effect level, the expected effect is the lowest level at which it is at most 1
+    below=index<=1
+    first=np.argmax(below, axis=-1)
+    expected=np.where(below.any(axis=-1), np.where(first>0, e[first], 0), 1)
+    loewe=effect-expected
+
+    #Restore plate order of rows and columns
+    order=np.ix_(np.arange(growth.shape[0]), np.argsort(ib), np.argsort(ia))
+    return {'fraction':fraction[order], 'fic':fic[order], 'bliss':bliss[order], 'loewe':loewe[order],
+            'mic_a':mic_a, 'mic_b':mic_b, 'fici':fici}
+
+def control_factors(stacked, controls, reference=None):
+    """Normalization factors of several plates (plates, wells, timepoints) from shared control wells (indices).
+    The level of a control well is its mean signal over time. Without reference, each control well is referenced to
+    its median level across the plates and the factor of a plate is the median ratio of its controls to their
+    references. With a reference level (scalar, or one per control well), plates are scaled onto it instead.
+    Returns control levels (plates, controls) and factors (plates), NaN where controls are missing or not positive."""
+    stacked=np.asarray(stacked, dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        levels=np.nanmean(stacked[:, controls], axis=-1)
+        levels=np.where(levels>0, levels, np.nan)
+        if reference is None:
+            reference=np.nanmedian(levels, axis=0)
+        factors=np.nanmedian(np.broadcast_to(np.asarray(reference, dtype=np.float64), levels.shape[1:])/levels, axis=1)
+    return levels, factors
+
+def curve_matrix(frames, points=64):
+    """Resample the curves of several plates (list of (plate ID, dataframe with 'Hour' column followed by one column per
+    sample)) onto a common grid of evenly spaced points over the time range shared by all plates. Returns the
+    (curves, points) matrix, the grid and a dataframe with plate and sample of each curve."""
+    log.info(f'Resampling curves of {len(frames)} plates onto a common grid')
+    times=[df.iloc[:, 0].to_numpy(dtype=np.float64) for plate_id, df in frames]
+    start=max(np.nanmin(t) for t in times)
+    end=min(np.nanmax(t) for t in times)
+    if not end>start:
+        raise ValueError('Time ranges of the plates do not overlap')
+    grid=np.linspace(start, end, points)
+    curves=[interpolate_curves(t, df.iloc[:, 1:].to_numpy(dtype=np.float64).T, grid, fill='nearest') for t, (plate_id, df) in zip(times, frames)]
+    index=pd.DataFrame({'plate':np.repeat([plate_id for plate_id, df in frames], [df.shape[1]-1 for plate_id, df in frames]),
+                        'sample':[str(c) for plate_id, df in frames for c in df.columns[1:]]})
+    return np.concatenate(curves, axis=0), grid, index
+
+def randomized_svd(x, rank, oversample=10, iterations=4, seed=0):
+    """Truncated SVD of a (samples, features) matrix from a random projection onto rank+oversample dimensions,
+    refined by power iterations. Signs are chosen so that the largest loading of each component is positive,
+    so the result does not depend on the random projection. Returns U (samples, rank), singular values and Vt (rank, features)."""
+    rng=np.random.default_rng(seed)
+    k=min(rank+oversample, *x.shape)
+    q=np.linalg.qr(x@rng.standard_normal((x.shape[1], k)))[0]
+    for i in range(iterations):
+        q=np.linalg.qr(x.T@q)[0]
+        q=np.linalg.qr(x@q)[0]
+    u, s, vt=np.linalg.svd(q.T@x, full_matrices=False)
+    u=q@u[:, :rank]
+    s=s[:rank]
+    vt=vt[:rank]
+    signs=np.sign(vt[np.arange(vt.shape[0]), np.abs(vt).argmax(axis=1)])
+    return u*signs, s, vt*signs[:, None]
+
+def squared_distances(x, centers):
+    """Squared euclidean distances between all samples (rows of x) and centers"""
+    d=(x*x).sum(axis=1)[:, None]-2*x@centers.T+(centers*centers).sum(axis=1)[None, :]
+    return np.maximum(d, 0)
+
+def kmeans(x, k, iterations=100, restarts=4, seed=0):
+    """k-means clustering of the rows of x with k-means++ initialization, keeping the best of several restarts.
+    Clusters are numbered by decreasing size. Returns labels (0 to k-1), centers and the within-cluster sum of squares."""
+    rng=np.random.default_rng(seed)
+    n=x.shape[0]
+    k=min(k, n)
+    best=None
+    for r in range(restarts):
+        #k-means++: further centers are drawn with probability proportional to the squared distance to the nearest center
+        centers=[x[rng.integers(n)]]
+        nearest=((x-centers[0])**2).sum(axis=1)
+        for j in range(1, k):
+            total=nearest.sum()
+            centers.append(x[rng.choice(n, p=nearest/total) if total>0 else rng.integers(n)])
+            nearest=np.minimum(nearest, ((x-centers[-1])**2).sum(axis=1))
+        centers=np.array(centers)
+
+        for i in range(iterations):
+            d=squared_distances(x, centers)
+            labels=d.argmin(axis=1)
+            counts=np.bincount(labels, minlength=k)
+            sums=np.zeros_like(centers)
+            np.add.at(sums, labels, x)
+            new=sums/np.maximum(counts, 1)[:, None]
+            #Empty clusters are moved to the sample furthest from its center
+            empty=np.flatnonzero(counts==0)
+            if len(empty)>0:
+                new[empty]=x[np.argsort(d[np.arange(n), labels])[::-1][:len(empty)]]
+            converged=np.allclose(new, centers)
+            centers=new
+            if converged:
+                break
+
+        d=squared_distances(x, centers)
+        labels=d.argmin(axis=1)
+        inertia=float(d[np.arange(n), labels].sum())
+        if best is None or inertia<best[2]:
+            best=(labels, centers, inertia)
+
+    labels, centers, inertia=best
+    order=np.argsort(-np.bincount(labels, minlength=k), kind='stable')
+    rank=np.empty(k, dtype=np.int64)
+    rank[order]=np.arange(k)
+    return rank[labels], centers[order], inertia
+
+def curve_clusters(frames, clusters, dims=3, points=64, seed=0):
+    """Group curves of one or several plates by shape: the curves are resampled onto a common grid (see curve_matrix),
+    embedded into dims principal components (randomized SVD) and clustered with k-means in the embedding.
+    Returns dataframe with plate, sample, cluster (1 to clusters, NaN for curves without reads) and the principal
+    components (PC1, PC2, ...)."""
+    log.info(f'Clustering curves of {len(frames)} plates')
+    x, grid, table=curve_matrix(frames, points)
+    valid=np.isfinite(x).all(axis=1)
+    dims=min(dims, int(valid.sum()), points)
+    table['cluster']=np.nan
+    if dims<1:
+        return table
+    centered=x[valid]-x[valid].mean(axis=0)
+    u, s, vt=randomized_svd(centered, dims, seed=seed)
+    embedding=u*s
+    labels, centers, inertia=kmeans(embedding, clusters, seed=seed)
+    table.loc[valid, 'cluster']=labels+1
+    for i in range(dims):
+        table[f'PC{i+1}']=np.nan
+        table.loc[valid, f'PC{i+1}']=embedding[:, i]
+    return table
+
+#Number of points of the curve vectors of the similarity index
+CURVE_POINTS=64
+
+def curve_vectors(t, y, points=CURVE_POINTS):
+    """Normalized curve vectors for similarity searches: the curves (curves, timepoints) are resampled onto evenly spaced
+    points over the time range of the plate, centered and scaled to unit length, so that the squared euclidean distance
+    between two vectors is 2-2*(correlation of the curves). Flat curves (without shape) and curves without reads are NaN."""
+    t=np.asarray(t, dtype=np.float64)
+    grid=np.linspace(np.nanmin(t), np.nanmax(t), points)
+    x=interpolate_curves(t, y, grid, fill='nearest')
+    x=x-x.mean(axis=-1, keepdims=True)
+    norm=np.sqrt((x*x).sum(axis=-1, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norm>0, x/norm, np.nan)
+
+def nearest_neighbours(x, queries, k=10, norms=None):
+    """Exact k nearest neighbours (euclidean) of the queries among the rows of x, from blocked matrix products, so that
+    the temporary (queries x rows) distance matrix stays below CHUNK_ELEMENTS. norms are the squared lengths of the rows
+    of x, if already known. Returns the indices of the neighbours (queries, k), ordered by distance, and their distances."""
+    queries=np.atleast_2d(queries).astype(x.dtype, copy=False)
+    norms=(x*x).sum(axis=1) if norms is None else norms
+    k=min(k, x.shape[0])
+    qnorms=(queries*queries).sum(axis=1)[:, None]
+    best_idx=np.empty((queries.shape[0], 0), dtype=np.int64)
+    best_d=np.empty((queries.shape[0], 0), dtype=x.dtype)
+    rows_per_block=max(k, CHUNK_ELEMENTS//max(1, queries.shape[0]))
+    for a in range(0, x.shape[0], rows_per_block):
+        d=qnorms-2*queries@x[a:a+rows_per_block].T+norms[None, a:a+rows_per_block]
+        #Keep the k nearest rows of the block together with the k nearest found so far
+        part=np.argpartition(d, min(k, d.shape[1])-1, axis=1)[:, :k]
+        best_idx=np.concatenate([best_idx, part+a], axis=1)
+        best_d=np.concatenate([best_d, np.take_along_axis(d, part, axis=1)], axis=1)
+        keep=np.argpartition(best_d, k-1, axis=1)[:, :k]
+        best_idx=np.take_along_axis(best_idx, keep, axis=1)
+        best_d=np.take_along_axis(best_d, keep, axis=1)
+    order=np.argsort(best_d, axis=1, kind='stable')
+    return np.take_along_axis(best_idx, order, axis=1), np.sqrt(np.maximum(np.take_along_axis(best_d, order, axis=1), 0))
@@ -1,42 +1,47 @@
 import os
-import io
-import sys
+import re
+import time
 import json
+import argparse
+import multiprocessing
 import openpyxl
-import xlsxwriter
 import openpyxl.cell._writer
 import numpy as np
 import pandas as pd
-from scipy import stats
 import matplotlib
 matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt
-from sklearn.metrics import *
-from pygam import LinearGAM, s
 from PyQt5.QtCore import *
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
+from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFontDatabase
 from PyQt5.QtWidgets import *
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 import logging as log
+from analysis import GrowthAnalysis, AnalysisError, ADVANCED_DEFAULTS, SYNERGY_METRICS, load_layouts, resource_path, result_filename, write_results, \
+    analysed_curves, read_plate
+from kernels import DERIVATIVE_METHODS, SMOOTHERS, EDGE_CORRECTIONS, curve_vectors
+from results_db import ResultsStore
+from similarity import CurveIndex
+from compare import StageCache, THRESHOLD_PARAMS, parse_configurations, compare_configurations, metric_differences, call_differences
+from session import save_session, load_session
+from watcher import FolderWatcher
+from pipeline import BatchPipeline, STAGES, combined_metrics, batch_clusters
+from manifest import load_manifest
+from server import serve
 
 log.basicConfig(filename='bgca.log', level=log.DEBUG, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - [%(funcName)s] - %(message)s')
 console_handler = log.StreamHandler()
 console_handler.setFormatter(log.Formatter('%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - [%(funcName)s] - %(message)s'))
 log.getLogger().addHandler(console_handler)
 
-#https://stackoverflow.com/questions/31836104/pyinstaller-and-onefile-how-to-include-an-image-in-the-exe-file
-def resource_path(relative_path):
-    """ Get absolute path to resource (e.g files), works for dev and for PyInstaller """
-    log.info('Getting absolute path to resource')
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception as e:
-        base_path = os.path.abspath(".")
-        log.warning(f'Error: {e}')
-    log.debug(f'Resource Path: {os.path.join(base_path, relative_path)}')
-    return os.path.join(base_path, relative_path)
+#Pause in typing (ms) after which threshold edits are previewed
+PREVIEW_DELAY=250
+
+def sample_wells(sample):
+    """Get the plate wells (row index, column index) covered by a sample name such as 'A01', 'AB01' or 'A01A02A03'"""
+    wells=[]
+    for rows, col in re.findall(r'([A-P]+)(\d{2})', sample):
+        wells.extend((ord(r)-ord('A'), int(col)-1) for r in rows)
+    return wells
 
 
 #Create QMainWindow subclass in order to customize main window
@@ -85,6 +90,11 @@ class MainWindow(QMainWindow):
         self.plot_button=QPushButton('Plot growth curves')
         self.plot_button.setEnabled(False)
 
+        #Button to analyse the plate with several configurations
+        self.compare_button=QPushButton('Compare settings')
+        self.compare_button.setToolTip('Analyse the plate with several parameter configurations and compare the results.')
+        self.compare_button.setEnabled(False)
+
         #Input widgets for lag calculation method
         lag_calc_label=QLabel('Lag-time calculation')
         lag_calc_label.setToolTip('Choose how to calculate the timepoint of lag-phase end, must be float or integer')
@@ -148,11 +158,33 @@ class MainWindow(QMainWindow):
         #Add Qlabel to display input file path
         self.filelabel=QLineEdit() #When a file is selected, change text here
 
+        #Button to open window with advanced analysis settings
+        self.advanced_button=QPushButton('Advanced settings')
+        self.advanced_button.setToolTip('Set advanced analysis parameters, e.g. resampling of curves.')
+        self.advanced=dict(ADVANCED_DEFAULTS)
+
         #Submitbutton, starts calculations when pressed and enables plot button
         submittbutton_label=QLabel('')
         submittbutton_label.setToolTip('Submit parameters and run calculations')
         self.submitbutton=QPushButton('Submit')
 
+        #Buttons to save results to and restore results from session files
+        self.savesession_button=QPushButton('Save session')
+        self.savesession_button.setToolTip('Save results of the current analysis to a session file.')
+        self.savesession_button.setEnabled(False)
+        self.loadsession_button=QPushButton('Load session')
+        self.loadsession_button.setToolTip('Restore a previously saved analysis without recalculation.')
+
+        #Live preview - after a pause in typing, threshold changes only recalculate the results depending on them, on the
+        #submitted plate that is kept in memory (stage cache)
+        self.preview_box=QCheckBox('Live preview')
+        self.preview_box.setToolTip(f'Update results and plate heatmap while lag, LOEC and MIC thresholds are edited.{n}Other settings are applied on Submit.')
+        self.preview_box.setEnabled(False)
+        self.preview_timer=QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.stage_cache=None
+
         #Set output dataframes as attributes to make them accessible for plotting
         self.metrics=None
         self.df=None
@@ -161,9 +193,19 @@ class MainWindow(QMainWindow):
         self.df_raw=None
         self.lowecs=None
         self.noecs=None
-        self.mic=None
+        self.mics=None
         self.conc_dict=None
         self.std_dict=None
+        self.phases=None
+        self.derivative=None
+        self.log_derivative=None
+        self.outliers=None
+        self.edge_correction=None
+        self.synergy=None
+        self.normalization=None
+        #Results database run of the current analysis, and the similarity index over the recorded curves (opened on first use)
+        self.run_id=None
+        self.curve_index=None
         self.std_calculated=False
         self.reps_in_rows=False
         self.reps_in_cols=False
@@ -208,12 +250,15 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.mic_calc, 21, 0)
         layout.addWidget(mic_input_label, 20, 1, alignment=Qt.AlignBottom)
         layout.addWidget(self.mic_input, 21, 1)
-        layout.addWidget(spacer_widget, 22, 0, 1, 2)
+        layout.addWidget(self.advanced_button, 22, 0, 1, 2)
         layout.addWidget(submittbutton_label, 23, 0, 1, 2, alignment=Qt.AlignCenter)
         layout.addWidget(self.submitbutton, 24, 0, 1, 2, alignment=Qt.AlignCenter)
-        layout.addWidget(spacer_widget, 25, 0, 1, 2)
+        layout.addWidget(self.preview_box, 25, 0, 1, 2, alignment=Qt.AlignCenter)
         layout.addWidget(spacer_widget, 26, 0, 1, 2)
         layout.addWidget(self.plot_button, 27, 0, 1, 2)
+        layout.addWidget(self.savesession_button, 28, 0)
+        layout.addWidget(self.loadsession_button, 28, 1)
+        layout.addWidget(self.compare_button, 29, 0, 1, 2)
 
         #set height of rows containing labels and spacing between grid cells
         l_rows=[1, 4, 7, 9, 11, 13, 16, 18, 20]
@@ -246,12 +291,29 @@ class MainWindow(QMainWindow):
         #When removebutto n is clicked, open th erespective window
         self.rmbutton.clicked.connect(self.rmbuttonclicked)
 
+        #When advanced settings button is clicked, open the respective window
+        self.advanced_button.clicked.connect(self.advancedbuttonclicked)
+
         #When submitbutton is clicked, call submitbuttonclicked()
         self.submitbutton.clicked.connect(self.submitbuttonclicked)
 
         #When plotbutton is clicked, open plotting window
         self.plot_button.clicked.connect(self.plotbuttonclicked)
 
+        #When compare button is clicked, open comparison window
+        self.compare_button.clicked.connect(self.comparebuttonclicked)
+
+        #When thresholds are edited, restart the preview timer, the preview is calculated once it runs out
+        for w in [self.lag_calc_input, self.lowec_input, self.mic_input]:
+            w.textChanged.connect(self.schedule_preview)
+        for w in [self.lag_calc, self.lowec_calc, self.mic_calc]:
+            w.currentTextChanged.connect(self.schedule_preview)
+        self.preview_timer.timeout.connect(self.preview)
+
+        #When session buttons are clicked, save or restore the analysis
+        self.savesession_button.clicked.connect(self.savesessionclicked)
+        self.loadsession_button.clicked.connect(self.loadsessionclicked)
+
         widget=QWidget()
         widget.setLayout(layout)
 
@@ -304,6 +366,12 @@ class MainWindow(QMainWindow):
         self.w=AddLayoutWindow(self)
         self.w.show()
 
+    def advancedbuttonclicked(self):
+        """ Open advanced settings window """
+        log.info('Open advanced settings window clicked')
+        self.w=AdvancedSettingsWindow(self)
+        self.w.show()
+
     def plotbuttonclicked(self):
         """Open plotting window"""
         log.info('Opening plotting window')
@@ -311,57 +379,11 @@ class MainWindow(QMainWindow):
         self.w=PlotWindow(self)
         self.w.show()
 
-    def match_concentrations(self):
-        """Match user provided concentrations with plate column numbers"""
-        log.info('Matching user provided concentrations')
-        try:
-            if self.pos_contr.text()!='':
-                #Assumes positive controls to be at end or beginning of row, same layout for all rows
-                pos=self.pos_contr.text().split(',')
-                #Get positive control positions
-                if len(pos)>1 and not '+' in pos[0]:
-                    pos_cols={x.split(':')[0][-2:] for x in pos}
-                elif len(pos)>1 and '+' in pos[0]:
-                    pos_cols={y.strip()[-2:] for x in pos for y in x.strip().split(',')[0].split(':')[0].split('+')}
-                elif len(pos)==1 and '+' in pos[0]:
-                    pos_cols={y.strip()[-2:] for x in pos for y in x.strip().split(':')[0].split('+')}
-                elif len(pos)==1 and not '+' in pos[0]:
-                    pos_cols={x.split(':')[0] for x in pos}
-
-                conc_cols=int(self.num_cols.currentText())-len(pos_cols)
-
-                #match concentration list to plate column number based on where positive controls are located
-                #Again, this assumes that all positive controls are located either at the beginning or the end of a row
-                if any(x in [float(x) for x in list(pos_cols)] for x in [*range(1,5)]):
-                    pos_end=max([int(x) for x in list(pos_cols)])
-                    cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(pos_end, conc_cols+1)]
-                else:
-                    pos_end=min(list([int(x) for x in list(pos_cols)]))
-                    cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, pos_end+1)]
-
-            else:
-                cols=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.num_cols.currentText())+1)]   
-                
-            if ',' in self.concentrations.text():
-                conc_dict={x[0].strip():str(x[1].strip())+self.concentration_unit.text() for x in zip(cols, self.concentrations.text().split(','))}
-
-            elif ':' in self.concentrations.text():
-                high_conc=float(self.concentrations.text().split(':')[0].strip())
-                dilution_factor=float(self.concentrations.text().split(':')[1].strip())
-                    
-                conc_dict={}
-                current_conc=high_conc
-                for i, c in enumerate(cols):
-                    if i>0:
-                        current_conc/=dilution_factor
-                        conc_dict[c]=str(round(current_conc,6))+self.concentration_unit.text()
-                    else:
-                        conc_dict[c]=str(round(current_conc,6))+self.concentration_unit.text()
-
-            return conc_dict
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
+    def comparebuttonclicked(self):
+        """Open window for comparing parameter configurations"""
+        log.info('Opening comparison window')
+        self.cw=CompareWindow(self)
+        self.cw.show()
 
     def set_defaults(self):
         """Change values in the form according to default layouts"""
@@ -375,58 +397,146 @@ class MainWindow(QMainWindow):
 
         else:
             #Set values in form according to declans and Deos Biocide setup
-            self.rep_rows.setText(layouts[default]['reps'])
-            self.bg_rows.setText(layouts[default]['bg'])
+            self.apply_params(layouts[default])
 
-            if layouts[default]['avg']==1:
-                self.avg_rows.setChecked(True)
-            else:
-                self.avg_rows.setChecked(False)
+        #Talk to Joakim about more layouts
+        self.enable_form(self.layout_defaults.currentText()=='Custom')
 
-            if layouts[default]['smoothen']==1:
-                self.smoothen_curves.setChecked(True)
-            else:
-                self.smoothen_curves.setChecked(False)
-
-            self.num_cols.setCurrentText(layouts[default]['col_num'])
-            self.pos_contr.setText(layouts[default]['pos'])
-            self.lowec_calc.setCurrentText(layouts[default]['lowec_calc'])
-            self.lowec_input.setText(layouts[default]['lowec_calc_input'])
-            self.lag_calc.setCurrentText(layouts[default]['lag_calc'])
-            self.lag_calc_input.setText(layouts[default]['lag_calc_input'])
-            self.mic_calc.setCurrentText(layouts[default]['mic_calc'])
-            self.mic_input.setText(layouts[default]['mic_calc_input'])
-            self.concentrations.setText(layouts[default]['conc'])
-            self.concentration_unit.setText(layouts[default]['conc_unit'])
+    def apply_params(self, params):
+        """Fill the form with layout parameters in the format of default_layouts.txt"""
+        log.info('Applying layout parameters')
+        self.rep_rows.setText(params['reps'])
+        self.bg_rows.setText(params['bg'])
 
-        #Talk to Joakim about more layouts
-        if self.layout_defaults.currentText()!='Custom':
-
-            self.rmbutton.setEnabled(True)
-            self.rep_rows.setEnabled(False)
-            self.avg_rows.setEnabled(False)
-            self.bg_rows.setEnabled(False)
-            self.smoothen_curves.setEnabled(False)
-            self.pos_contr.setEnabled(False)
-            self.num_cols.setEnabled(False)
-            self.lag_calc_input.setEnabled(False)
-            self.mic_input.setEnabled(False)
-            self.mic_calc.setEnabled(False)
-            self.lag_calc.setEnabled(False)
-            self.lowec_calc.setEnabled(False)
+        if params['avg']==1:
+            self.avg_rows.setChecked(True)
         else:
-            self.rmbutton.setEnabled(False)
-            self.rep_rows.setEnabled(True)
-            self.avg_rows.setEnabled(True)
-            self.bg_rows.setEnabled(True)
-            self.smoothen_curves.setEnabled(True)
-            self.pos_contr.setEnabled(True)
-            self.num_cols.setEnabled(True)
-            self.lag_calc_input.setEnabled(True)
-            self.mic_input.setEnabled(True)
-            self.mic_calc.setEnabled(True)
-            self.lag_calc.setEnabled(True)
-            self.lowec_calc.setEnabled(True)
+            self.avg_rows.setChecked(False)
+
+        if params['smoothen']==1:
+            self.smoothen_curves.setChecked(True)
+        else:
+            self.smoothen_curves.setChecked(False)
+
+        self.num_cols.setCurrentText(params['col_num'])
+        self.pos_contr.setText(params['pos'])
+        self.lowec_calc.setCurrentText(params['lowec_calc'])
+        self.lowec_input.setText(params['lowec_calc_input'])
+        self.lag_calc.setCurrentText(params['lag_calc'])
+        self.lag_calc_input.setText(params['lag_calc_input'])
+        self.mic_calc.setCurrentText(params['mic_calc'])
+        self.mic_input.setText(params['mic_calc_input'])
+        self.concentrations.setText(params['conc'])
+        self.concentration_unit.setText(params['conc_unit'])
+
+        #Layouts saved before advanced parameters were introduced use their defaults
+        self.advanced={k:params.get(k, v) for k, v in ADVANCED_DEFAULTS.items()}
+
+    def enable_form(self, enabled):
+        """Enable form inputs for custom layouts, disable them for default layouts"""
+        log.info('Enabling form inputs')
+        self.rmbutton.setEnabled(not enabled)
+        self.rep_rows.setEnabled(enabled)
+        self.avg_rows.setEnabled(enabled)
+        self.bg_rows.setEnabled(enabled)
+        self.smoothen_curves.setEnabled(enabled)
+        self.pos_contr.setEnabled(enabled)
+        self.num_cols.setEnabled(enabled)
+        self.lag_calc_input.setEnabled(enabled)
+        self.mic_input.setEnabled(enabled)
+        self.mic_calc.setEnabled(enabled)
+        self.lag_calc.setEnabled(enabled)
+        self.lowec_calc.setEnabled(enabled)
+        self.advanced_button.setEnabled(enabled)
+
+    def savesessionclicked(self):
+        """Ask for a filename and save the current analysis as session file"""
+        log.info('Save session clicked')
+        file_path, _=QFileDialog.getSaveFileName(self, 'Save session', '', 'BGCA session (*.bgca)')
+        if not file_path:
+            return #User canceled the dialog
+        if not file_path.endswith('.bgca'):
+            file_path+='.bgca'
+        try:
+            self.write_session(file_path)
+        except Exception as e:
+            log.error(f'Error: {e}')
+            self.pop_errormsg([f'Session could not be saved: {e}'])
+
+    def loadsessionclicked(self):
+        """Ask for a session file and restore the analysis stored in it"""
+        log.info('Load session clicked')
+        file_path, _=QFileDialog.getOpenFileName(self, 'Load session', '', 'BGCA session (*.bgca)')
+        if not file_path:
+            return #User canceled the dialog
+        try:
+            self.read_session(file_path)
+        except Exception as e:
+            log.error(f'Error: {e}')
+            self.pop_errormsg([f'Session could not be loaded: {e}'])
+
+    def write_session(self, path):
+        """Write input, processed and smoothened curves, metrics, layout and parameters to a session file"""
+        log.info('Writing session')
+        frames={'df_raw':self.df_raw, 'df':self.df, 'gams':self.gams, 'shifted_gams':self.shifted_gams, 'metrics':self.metrics,
+                'phases':self.phases, 'derivative':self.derivative, 'log_derivative':self.log_derivative, 'outliers':self.outliers,
+                'edge_correction':self.edge_correction, 'synergy':self.synergy, 'normalization':self.normalization}
+        state={'filename':self.filelabel.text(), 'layout':self.layout_defaults.currentText(), 'params':self.layout_params(),
+               'lowecs':self.lowecs, 'noecs':self.noecs, 'mics':self.mics, 'conc_dict':self.conc_dict, 'std_dict':self.std_dict,
+               'reps_in_rows':self.reps_in_rows, 'reps_in_cols':self.reps_in_cols, 'plot':None}
+
+        #Also store the selections in the plotting window, if it is open
+        if isinstance(getattr(self, 'w', None), PlotWindow) and self.w.isVisible():
+            state['plot']=self.w.plot_state()
+
+        save_session(path, frames, state)
+
+    def read_session(self, path):
+        """Restore main window and plotting window from a session file, without recalculating anything"""
+        log.info('Reading session')
+        frames, state=load_session(path)
+
+        #Fill the form, without triggering set_defaults for layouts that may have changed since the session was saved
+        layout_name=state['layout'] if self.layout_defaults.findText(state['layout'])>=0 else 'Custom'
+        self.layout_defaults.blockSignals(True)
+        self.layout_defaults.setCurrentText(layout_name)
+        self.layout_defaults.blockSignals(False)
+        self.apply_params(state['params'])
+        self.enable_form(layout_name=='Custom')
+        self.filelabel.setText(state['filename'])
+
+        #Results - smoothened curves are '' if smoothing was not selected
+        self.df_raw=frames['df_raw']
+        self.df=frames['df']
+        self.gams=frames['gams'] if frames['gams'] is not None else ''
+        self.shifted_gams=frames['shifted_gams'] if frames['shifted_gams'] is not None else ''
+        self.metrics=frames['metrics']
+        #Sessions saved before phase segmentation and derivative curves were added contain none
+        self.phases=frames.get('phases')
+        self.derivative=frames.get('derivative')
+        self.log_derivative=frames.get('log_derivative')
+        self.outliers=frames.get('outliers')
+        self.edge_correction=frames.get('edge_correction')
+        self.synergy=frames.get('synergy')
+        self.normalization=frames.get('normalization')
+        self.lowecs=state['lowecs']
+        self.noecs=state['noecs']
+        self.mics=state['mics']
+        self.conc_dict=state['conc_dict']
+        self.std_dict=state['std_dict']
+        self.reps_in_rows=state['reps_in_rows']
+        self.reps_in_cols=state['reps_in_cols']
+        self.run_id=None
+        #Sessions are restored without recalculation, so there is no plate to preview on
+        self.stage_cache=None
+        self.preview_box.setEnabled(False)
+
+        self.savesession_button.setEnabled(True)
+        self.plot_button.setEnabled(True)
+        self.compare_button.setEnabled(True)
+        if state['plot'] is not None:
+            self.plotbuttonclicked()
+            self.w.apply_plot_state(state['plot'])
 
     def submitbuttonclicked(self):
         """Collect info from all widgets after submitbutton has been clicked"""
@@ -466,10 +576,107 @@ class MainWindow(QMainWindow):
                 self.pop_errormsg(errors)
                 return
             
+        #Calculate metrics
+        self.preview_timer.stop()
+        try:
+            results=self.growth_metrics()
+        except AnalysisError as e:
+            self.pop_errormsg([f'Analysis failed: {e}'])
+            return
+
         self.plot_button.setEnabled(True)
+        self.savesession_button.setEnabled(True)
+        self.compare_button.setEnabled(True)
+        self.preview_box.setEnabled(True)
         #self.plot_button.setStyleSheet('background-color: greenyellow')
-        #Calculate metrics
-        self.metrics, self.df, self.gams, self.shifted_gams, self.df_raw, self.lowecs, self.noecs, self.mics, self.conc_dict, self.std_dict = self.growth_metrics()
+        self.set_results(results)
+
+        #Record run in the local results database
+        self.record_run()
+
+    def set_results(self, results):
+        """Set results of an analysis (see RESULT_NAMES) as attributes, for plotting and saving"""
+        self.metrics, self.df, self.gams, self.shifted_gams, self.df_raw, self.lowecs, self.noecs, self.mics, self.conc_dict, self.std_dict, self.phases, \
+            self.derivative, self.log_derivative, self.outliers, self.edge_correction, \
+            self.synergy, self.normalization = results
+
+    def schedule_preview(self):
+        """Restart the preview timer after a threshold edit, so that the preview is only calculated once typing pauses"""
+        if self.preview_box.isChecked() and self.stage_cache is not None:
+            self.preview_timer.start()
+
+    def preview(self):
+        """Recalculate the lag metric and the LOEC/NOEC and MIC calls of the submitted plate with the current thresholds,
+        and update the plotting window. Previews are not recorded in the results database."""
+        log.info('Previewing threshold changes')
+        params=GrowthAnalysis(self.layout_params()).params
+        changed=self.stage_cache.changed(params)
+        if len(changed)==0:
+            return
+        if not changed<=set(THRESHOLD_PARAMS):
+            self.statusBar().showMessage('Submit to apply the changed settings')
+            return
+
+        #Thresholds that are being typed (e.g '0.' or '') are skipped
+        try:
+            float(params['lag_calc_input'])
+            for calc in ['lowec_calc', 'mic_calc']:
+                if params[calc]!='None':
+                    float(params[f'{calc}_input'])
+        except ValueError:
+            return
+
+        start=time.perf_counter()
+        try:
+            self.set_results(self.stage_cache.reanalyse(params))
+        except (AnalysisError, ValueError) as e:
+            self.statusBar().showMessage(f'Preview failed: {e}')
+            return
+        if isinstance(getattr(self, 'w', None), PlotWindow) and self.w.isVisible():
+            self.w.refresh()
+        self.statusBar().showMessage(f'Preview updated in {(time.perf_counter()-start)*1000:.0f} ms - Submit to record the results')
+
+    def layout_params(self):
+        """Collect plate layout and calculation parameters from the form, in the format of default_layouts.txt"""
+        log.info('Collecting layout parameters')
+        params={}
+        params['reps']=self.rep_rows.text()
+        params['bg']=self.bg_rows.text()
+        params['col_num']=self.num_cols.currentText()
+        if self.avg_rows.isChecked()==True:
+            params['avg']=1
+        else:
+            params['avg']=0
+        if self.smoothen_curves.isChecked()==True:
+            params['smoothen']=1
+        else:
+            params['smoothen']=0
+        params['pos']=self.pos_contr.text()
+        params['conc']=self.concentrations.text()
+        params['conc_unit']=self.concentration_unit.text()
+        params['lag_calc']=self.lag_calc.currentText()
+        params['lag_calc_input']=self.lag_calc_input.text()
+        params['lowec_calc']=self.lowec_calc.currentText()
+        params['lowec_calc_input']=self.lowec_input.text()
+        params['mic_calc']=self.mic_calc.currentText()
+        params['mic_calc_input']=self.mic_input.text()
+        params.update(self.advanced)
+        return params
+
+    def record_run(self):
+        """Write layout, parameters and results of the current run to the results database"""
+        log.info('Recording run in results database')
+        self.run_id=None
+        try:
+            filename=self.filelabel.text()
+            self.run_id=ResultsStore().add_run(os.path.splitext(os.path.basename(filename))[0], self.metrics, params=self.layout_params(),
+                                               filename=filename, layout=self.layout_defaults.currentText(), std_dict=self.std_dict,
+                                               lowecs=self.lowecs, noecs=self.noecs, mics=self.mics, conc_dict=self.conc_dict,
+                                               normalization=self.normalization,
+                                               curves=analysed_curves({'shifted_gams':self.shifted_gams, 'df':self.df}))
+        except Exception as e:
+            #Failing to record a run should not affect the analysis itself
+            log.error(f'Error: {e}')
     
     def pop_errormsg(self, errorlist):
         """Make a little error window pop up"""
@@ -492,978 +699,20 @@ class MainWindow(QMainWindow):
     
     def growth_metrics(self):
         """Wrapper function for processing xlsx omnilog input and calculating growth curve metrics"""
-        #Read in dataframe
         log.info('Calculating growth metrics wrapper function')
-        if self.filelabel.text().endswith('.xlsx'):
-            df=pd.read_excel(resource_path(self.filelabel.text()), header=10)
-        elif self.filelabel.text().endswith('.csv'):
-            df=pd.read_csv(resource_path(self.filelabel.text()))
-
-        #Rename column headers to exclude whitespaces
-        df.rename({c:c.strip() for c in df.columns}, axis=1, inplace=True)
-        df_raw=df.copy(deep=True)
-
-        #Calculate variance between replicates if replicates are provided
-        if self.rep_rows.text()!='':
-            std_dict=self.get_replicate_variance(df_raw)
-        else:
-            std_dict=None
-
-        if self.avg_rows.isChecked()==True and self.rep_rows.text()!='':
-            df=self.average_replicates(df, self.rep_rows.text())
-        if self.bg_rows.text()!='':
-            df=self.substract_background(df, self.bg_rows.text(), self.avg_rows.isChecked())
-
-        if self.smoothen_curves.isChecked()==True:
-            df=self.set_to_zero(df)
-            gams=self.fit_gam_to_avg(df)
-            shifted_gams=self.shift_curves(gams)
-            metrics=self.calculate_metrics(shifted_gams)
-        else:
-            metrics=self.calculate_metrics(df)
-            gams=''
-            shifted_gams=''
-
-        if self.lowec_calc.currentText()!='None':
-            lowecs, noecs=self.calculate_lowec(metrics)
-        else:
-            lowecs=None
-            noecs=None
-
-        if self.mic_calc.currentText()!='None':
-            mics=self.calculate_mic(metrics)
-        else:
-            mics=None
+        #The plate and its analysis stages are kept for live previews
+        self.stage_cache=StageCache(read_plate(self.filelabel.text()))
+        results=self.stage_cache.analyse(self.layout_params())
 
-        if self.concentrations.text()!='':
-            conc_dict=self.match_concentrations()
-        else:
-            conc_dict=None
-
-        return metrics, df, gams, shifted_gams, df_raw, lowecs, noecs, mics, conc_dict, std_dict
+        #Replicate setup is needed for plotting
+        _, self.reps_in_rows, self.reps_in_cols=self.stage_cache.setup
+        return results
 
     def check_input_integrity(self):
         """Takes user input from all widgets and checks integrity.
         If input is not correct, and error is returned."""
         log.info('Checking input integrity')
-        filename=self.filelabel.text()
-        reps=self.rep_rows.text()
-        bg=self.bg_rows.text()
-        pos=self.pos_contr.text()
-
-        errors=[]
-        rownames=['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-        nl='\n'
-
-        #Check file
-        if os.path.isfile(os.path.normpath(filename)):
-            pass
-        else:
-            errors.append(f'Invalid filename. Use the browsing option{nl}to select the input file.')
-            log.warning(f'Invalid filename. Use the browsing option{nl}to select the input file.')
-        
-        #Check replicate row format
-        if reps!='':
-            #Check if replicates are supplied by row or by column
-            reps_in_rows, reps_in_cols=self.determine_replicate_setup(reps)
-
-            if reps_in_rows==True and reps_in_cols==False:
-                #Check if row separator is correct
-                if ':' in reps:
-                    #Check if different replicate pairs are separated correctly
-                    if ',' in reps:
-                        #Check that none of the lists after , is empty
-                        lens=[True if len(x.strip())>0 else False for x in reps.split(',')]
-                        if lens==False:
-                            errors.append(f'Invalid replicate entry:{nl}Entry missing after ",".')
-                            
-                        #Check that only one row is defined per ':' separator
-                        x=[len(x.strip()) for y in reps.split(',') for x in y.split(':')]
-                        if np.mean(x)!=1:
-                            errors.append(f'Invalid replicate entry:{nl}Only one rowname before ":" allowed')
-                            
-                    else:
-                        x=[len(x.strip()) for x in reps.split(':')]
-                        if np.mean(x)!=1:
-                            errors.append(f'Invalid replicate entry:{nl}Only one rowname before ":" allowed')
-                            
-
-                else:
-                    errors.append(f'Invalid replicate row separator:{nl}Enter rows that are replicates separated{nl}by ":".')
-                    
-
-            elif reps_in_rows==False and reps_in_cols==True:
-                #TODO: Build in check for this format here
-                pass
-        else:
-            pass
-
-        #Check background row format
-        if bg!='':
-            bgs=[]
-            samps=[]
-            #Check if row separator is correct
-            if ':' in bg:
-                #Check if different replicate pairs are separated correctly
-                if ',' in bg:
-                    #Check that none of the lists after , is empty #TODO: THIS IS NOT WORKING; CORRECT
-                    lens=[True if len(x.strip())>0 else False for x in bg.split(',')]
-                    if lens==False:
-                        errors.append(f'Invalid background entry:{nl}Entry missing after ",".')
-                    
-                    for e in bg.split(','):
-                        #Check that all values are valid row names and backgrounds
-                        #Samples do not overlap
-                        bgs.extend([x for x in e.strip().split(':')[1]])
-                        samps.extend([x for x in e.strip().split(':')[0]])
-
-                    if any(x.strip() in samps for x in bgs):
-                        errors.append(f'Invalid background entry:{nl}Background and sample rows overlap!')
-                        
-                else:
-                    
-                    #Check that all values are valid row names and backgrounds
-                    #Samples do not overlap
-                    bgs.extend([x for x in bg.strip().split(':')[1]])
-                    samps.extend([x for x in bg.strip().split(':')[0]])
-
-                    if any(x.strip() in samps for x in bgs):
-                        errors.append(f'Invalid background entry:{nl}Background and sample rows overlap!')
-            else:
-                errors.append(f'Invalid background row separator:{nl}Enter rows that are replicates separated{nl}by ":".')
-        else:
-            pass
-
-        #Check positive control well format (format should be eg: A11+A12:A)
-        #Meaning that well A11 and A12 provide positive controls for row A
-        if pos!='':
-            #Check if row separator is correct
-            if ':' in pos:
-                #Check if different replicate pairs are separated correctly
-                if ',' in pos:
-                    #Check that none of the lists after , is empty
-                    lens=[True if len(x.strip())>0 else False for x in pos.split(',')]
-                    if lens==False:
-                        errors.append(f'Invalid positive control entry. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-
-                    if not '+' in pos:
-                        #Check that all elements are correctly entered
-                        well_corr=[]
-                        row_corr=[]
-                        for e in pos.split(','):
-                            e=e.strip()
-                            if not e.split(':')[0].strip()[0] in rownames:
-                                errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                            if int(e.split(':')[0].strip()[1:])>12:
-                                errors.append(f'Invalid positive control column number.Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                                
-                    else:
-                        #Check that all elements are correctly entered
-                        well_corr=[]
-                        row_corr=[]
-                        for e in pos.split(','):
-                            e2=e.split(':')[0].strip()
-                            for e3 in e2.split('+'):
-                                if not e3[0] in rownames:
-                                    errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                                if int(e3[1:])>12:
-                                    errors.append(f'Invalid positive control column number. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                        
-                else:
-                    
-                    if not bg.strip().split(':')[0][0] in rownames:
-                        errors.append(f'Invalid positive control row name. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                    if int(bg.strip().split(':')[0][1:])>12:
-                        errors.append(f'Invalid positive control column number. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-                
-            else:
-                errors.append(f'Invalid positive control separator. Provide positive control positions as e.g {nl}A11+A12:A, B11+B12:B, ...')
-        else:
-            pass
-
-        #Check input for lag calculation field
-        if self.lag_calc_input.text()!='':
-            #This field takes only a float as input - so check that input is convertible to float
-            try:
-                float(self.lag_calc_input.text().strip())
-            except:
-                log.error('Lag calculation threshold value must be a number!')
-                errors.append('Lag calculation threshold value must be a number!')
-
-        #Check input for lowec calculation field
-                
-        if self.lowec_calc.currentText()!='None':
-            if pos=='':
-                errors.append('Positive controls are needed in order to determine LOEC/NOEC concentrations!')
-
-        if self.lowec_calc.currentText()=='% PC lag':
-            try:
-                float(self.lowec_input.text())
-            except:
-                errors.append('Loec calculation threshold value for lag must be a number!')
-            if float(self.lowec_input.text())<=100:
-                errors.append('Loec calculation threshold for lag should be greater than 100%')
-        
-        elif self.lowec_calc.currentText()=='% PC AUC' or self.lowec_calc.currentText()=='% PC yield' \
-        or self.lowec_calc.currentText()=='% PC slope':
-            try:
-                float(self.lowec_input.text())
-            except:
-                errors.append('Loec calculation threshold value for AUC must be a number!')
-            if float(self.lowec_input.text())>=100:
-                errors.append('Loec calculation threshold for AUC should be smaller than 100%')   
-
-        
-        elif self.lowec_calc.currentText()=='ANOVA lag' or self.lowec_calc.currentText()=='ANOVA AUC' \
-        or self.lowec_calc.currentText()=='ANOVA yield' or self.lowec_calc.currentText()=='ANOVA yield':
-            
-            #Check that there are at least 2 positive controls per strain
-            if not ':' in pos:
-                errors.append('Positive controls are required for statistical testing!')
-
-            if ',' in pos:
-                if '+' in pos:
-                    replis=pos.split('+')
-                    if len(replis)<2:
-                        errors.append('minimum of 2 replicates required for statistical testing.')
-                else:
-                    replis=pos.split(',')
-                    if '' in replis or ' ' in replis:
-                        errors.append('Incorrect positive control input!')
-
-            #Check that there are at least 2 replicates per strain
-            if not ':' in reps:
-                errors.append('Replicates are required for statistical testing!')
-
-            if ',' in reps:
-                replis=[len(x.split(':')) for x in reps.split(',')]
-                if any(r < 2 for r in replis):
-                    errors.append('minimum of 2 replicates required for statistical testing.')
-            else:
-                replis=reps.split(':')
-                if len(replis)<2:
-                    errors.append('minimum of 2 replicates required for statistical testing.')
-        
-        #Check input for MIC calculation field
-        if self.mic_calc.currentText()!='None':
-            try:
-                float(self.mic_input.text())
-            except:
-                errors.append('MIC calculation threshold value must be a number.')
-
-        #Check input for concentration field
-        if self.concentrations.text()!='':
-            if ',' in self.concentrations.text() and ':' in self.concentrations.text():
-                errors.append('Provide either a list of concentrations, e.g 1, 2, 3, 4 ... , or highest concentration followed by dilution, e.g 12:4')
-
-            elif ',' in self.concentrations.text():
-                try:
-                    [float(x.strip()) for x in self.concentrations.text().split(',')]
-                except:
-                    errors.append('List of concentrations must consist of numbers only!')
-
-                #Check that length of list equals number of columns provided minus number of positive controls
-                #This assumes that the number of positive controls is equal for all rows!
-                if pos!='':
-                    num_pos=len(pos.split(',')[0].split('+'))
-                    if (int(self.num_cols.currentText())-num_pos)!=len(self.concentrations.text().split(',')):
-                        errors.append('List of concentrations must be as long as number of used plate columns - number of positive controls per row')
-
-            else:
-                if ':' in self.concentrations.text():
-                    if len(self.concentrations.text().split(':'))>2:
-                        errors.append('For dilution series, provide highest concentration followed by dilution factor, e.g 12:4')
-                    else:
-                        try:
-                            [float(x) for x in self.concentrations.text().split(':')]
-                        except:
-                            errors.append('Highest concentration and dilution must be provided as numbers.')
-                else:
-                    errors.append('Input to concentration field must be either a list of concentrations or highest concentration followed by dilution.')
-
-        #Check that lowec calculation input is not empty
-        if self.lag_calc_input.text()=='':
-            errors.append('Please provide a threshold for calculating the end of the lag phase!')
-            log.warning('Please provide a threshold for calculating the end of the lag phase!')
-
-        return errors
-    
-    def determine_replicate_setup(self, replicate_rows):
-        """Determine whether replicates are defined column wise or row wise"""
-        log.info('Determining replicate setup')
-        #Check whether replicates are specified by rows (such as when investigating concentration dependent effects, supplied as A:B, C:D ...),
-        #or by columns (e.g when characterizing growth, supplied as A01:A02:A03, A04:A05:A06, ...)
-        
-        if ',' in replicate_rows:
-            all_reps=[len(str(x.strip())) for r in replicate_rows.split(',') for x in r.split(':')]
-            if all(x==1 for x in all_reps):
-                self.reps_in_rows=True
-            elif all(x==3 for x in all_reps):
-                self.reps_in_cols=True
-
-        elif ':' in replicate_rows and not ',' in replicate_rows:
-            all_reps=[len(str(x.strip())) for x in replicate_rows.split(':')]
-            if all(x==1 for x in all_reps):
-                self.reps_in_rows=True
-            elif all(x==3 for x in all_reps):
-                self.reps_in_cols=True
-
-        return self.reps_in_rows, self.reps_in_cols
-    
-    def average_replicates(self, df, replicate_rows):
-        """Average replicate sample rows"""
-        log.info('Averaging replicates')
-        #Check whether replicates are specified by rows (such as when investigating concentration dependent effects, supplied as A:B, C:D ...),
-        #or by columns (e.g when characterizing growth, supplied as A01:A02:A03, A04:A05:A06, ...)
-        self.reps_in_rows, self.reps_in_cols = self.determine_replicate_setup(replicate_rows)
-        
-        #rename columns in to remove whitespaces, such that they match the replicate pairs
-        df.rename(columns={c:c.strip() for c in df.columns}, inplace=True)
-
-        #If replicates on plate are rows:
-        if self.reps_in_rows==True and self.reps_in_cols==False:
-
-            #parse replicate rows and average
-            replicate_rows=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(replicate_rows.split(','))]
-            replicate_pairs=[]
-
-            c_nums=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.num_cols.currentText())+1)]
-            for r in replicate_rows:
-                replicate_pairs.extend([tuple(x+num for x in r) for num in c_nums])
-
-            #Create dataframe
-            avg_df=pd.DataFrame()
-            avg_df['Hour']=df.iloc[:,0]
-
-            #populate dataframe with averages
-            for p in replicate_pairs:
-                avg_df[''.join([x[0] for x in p])+str(p[0][1:3])]=df[[x for x in p]].mean(axis=1)
-            
-            return avg_df
-        
-
-        elif self.reps_in_cols==True and self.reps_in_rows==False:
-
-            replicate_pairs=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(replicate_rows.split(','))]
-            
-            #Create dataframe
-            avg_df=pd.DataFrame()
-            avg_df['Hour']=df.iloc[:,0]
-
-            #populate dataframe with averages
-            for p in replicate_pairs:
-                avg_df[''.join([x for x in p])]=df[[x for x in p]].mean(axis=1)
-            
-            return avg_df
-
-    def substract_background(self, df, bg_rows, average):
-        """Substract the background rows from sample rows. Always average the background before substraction if there are several replicates"""
-        log.info('Subtracting background')
-        #number of columns used in the analysis
-        c_nums=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.num_cols.currentText())+1)]
-        #if replicate rows have been averaged
-
-        #Remove space characters from bg_rows
-        bg_rows=bg_rows.replace(' ', '')
-       
-        if average==True:
-            #If the samples have been averaged, the the column names will be like AB01, AB02
-            #Create pairs between samples and backgrounds
-            bg_pairs=[]
-            if ',' in bg_rows:
-                for r1 in bg_rows.split(','):
-                    bg_pairs.extend((r1.split(':')[0].strip()+num, r1.split(':')[1].strip()+num) for num in c_nums)
-                
-            else:
-                bg_pairs.extend((bg_rows.split(':')[0].strip()+num, bg_rows.split(':')[1].strip()+num) for num in c_nums)
-
-            #now substract background columns from sample columns
-            sub_df=pd.DataFrame()
-            sub_df['Hour']=df.iloc[:,0]
-            for p in bg_pairs:
-                sub_df[p[0]]=df[p[0]]-df[p[1]]
-        
-            return sub_df
-
-        #If replicate rows are not averaged
-        else:
-            #If background has several replicates for different rows
-            if ',' in bg_rows:
-                if len(bg_rows.split(',')[0].split(':')[1])>1:
-
-                    #Create tuples with pairs of columns to be averaged
-                    bg_pairs=[]
-                    for r in bg_rows.split(','):
-                        bg_pairs.extend([tuple(x+num for x in r.split(':')[1]) for num in c_nums])
-                    
-                    #Calculate background averages and append to the dataframe
-                    for p in bg_pairs:
-                        #column name will be like CD01_bg, CD02_bg, osv
-                        df[''.join([x[0] for x in p])+str(p[0][1:3])+'_bg']=df[[x for x in p]].mean(axis=1)
-
-                    #construct pairs of unaverged columns and background columns
-                    fin_pairs=[]
-                    for r in bg_rows.split(','):
-                        for i in range(len(r.split(':')[0])):
-                            fin_pairs.extend((r[i]+num, r.split(':')[1]+num) for num in c_nums)
-
-                    #Return dataframe with bg substracted columns
-                    sub_df=pd.DataFrame()
-                    sub_df['Hour']=df.iloc[:,0]
-                    for p in fin_pairs:
-                        sub_df[p[0]]=df[p[0]]-df[f'{p[1]}_bg']
-
-                return sub_df
-            
-            #If there is one background for all samples, with several background replicates
-            elif not ',' in bg_rows and len(bg_rows.split(':'))>1:
-                bg_pairs=[[x+str(num) for x in bg_rows.split(':')[1].strip()] for num in c_nums]
-
-                for p in bg_pairs:
-                    #column name will be like CD01_bg, CD02_bg, osv
-                    df[''.join([x[0] for x in p])+str(p[0][1:3])+'_bg']=df[[x for x in p]].mean(axis=1)   
-
-                #construct pairs of unaveraged columns and background columns
-                fin_pairs=[]
-                for r in bg_rows.split(':')[0]:
-                    fin_pairs.extend((r.strip()+str(num), bg_rows.split(':')[1].strip()+str(num)) for num in c_nums)
-
-                #Return dataframe with bg substracted columns
-                    sub_df=pd.DataFrame()
-                    sub_df['Hour']=df.iloc[:,0]
-                    for p in fin_pairs:
-                        sub_df[p[0]]=df[p[0]]-df[f'{p[1]}_bg']
-
-                return sub_df
-            
-            #If background is only one row #TODO: Test this!
-            else:
-                #create pairs and substract single bg column
-                bg_pairs=[]
-                for r in bg_rows:
-                    for i in range(len(r.split(':')[0])):
-                        bg_pairs.extend((r[i]+num, r.split(':')[1]+num) for num in c_nums)
-
-                sub_df=pd.DataFrame()
-                sub_df['Hour']=df.iloc[:,0]
-                for p in bg_pairs:
-                    sub_df[p[0]]=df[p[0]]-df[p[1]]
-                
-                return sub_df
-                
-
-    def set_to_zero(self,df): #Todo - SHOULD THIS BE KEPT?
-        """Avoid negative read values - until a sequence of 5 positive values is encountered, set all values to 0"""
-        log.info('Setting negative read values')
-        #Check for each column at which index the next 5 values are > 0 - set everything before to 0
-        for c in df.iloc[:,1:]:
-
-            pos_index=0
-            try:
-                pos_index=[i for i, val in enumerate(pd.Series(df[c])) if all(v>=0 for v in df.loc[i:i+5, c])][0]
-            except:
-                pass
-                #if this has not happened, set all values in the column to 0
-            if pos_index>0:
-                df.loc[0:pos_index, c] = 0
-            else:
-                df.loc[:,c] = 0
-        return df
-
-
-    def shift_curves(self, df):
-        """Shift curves such that the first value of each curve is 0"""
-        log.info('Shifting curves')
-        for c in df.iloc[:,1:]:
-            if df.loc[0, c] < 0:
-                df[c]=df[c]+abs(df.loc[0, c])
-            elif df.loc[0, c] > 0:
-                df[c]=df[c]-df.loc[0, c]
-                
-        return df
-            
-
-    def fit_gam_to_avg(self, df):
-        """Fit linear GAM to curve - the model is used for smoothing, resulting in a theoretical curve 
-        used for further analysis"""
-        log.info('Fitting linear GAM to curve')
-        gam_df=pd.DataFrame()
-        gam=LinearGAM(s(0), constraints='monotonic_inc')
-
-        gam_df['Hour']=df['Hour']
-        for c in df.iloc[:, 1:]:
-            gam.fit(df.iloc[:,0], df[c])
-            gam_df[c]=gam.predict(df.iloc[:,0])
-
-        return gam_df
-
-
-    def calculate_metrics(self, df):
-        """Calculate growth curve metrics - AUC, length of lag phase, maximum yield, slope"""
-        log.info('Calculating metrics')
-        try:
-            metrics={'sample':[], 'AUC':[], 'lag_len':[], 'max_yield':[], 'slope':[]}
-            lag_type=self.lag_calc.currentText()
-            lag_crit=float(self.lag_calc_input.text().strip())
-
-            #Determine positive controls to be used for % max. OD lag calculation
-
-            if ',' in self.pos_contr.text():
-                pos_list=[x.strip() for x in self.pos_contr.text().split(',')]
-            else:
-                pos_list=[x.strip() for x in list(self.pos_contr.text())]
-            
-            #If replicates are to be averaged
-            if self.std_calculated==True:
-                if self.avg_rows.isChecked()==True:
-                    if ',' in self.rep_rows.text():
-                        reps=[''.join([y.strip() for y in x.split(':')]) for x in self.rep_rows.text().split(',')]
-                    else:
-                        reps=list(''.join([x.strip() for x in self.rep_rows.text().split(':')]))
-            
-            #Go through each column (curve) and calculate the timepoint where the threshold value is passed
-            for i, c in enumerate(df.iloc[:,1:]):
-                #Append quickly calculatable metrics
-                metrics['sample'].append(c)
-                metrics['AUC'].append(round(auc(df.iloc[:,0], df.loc[:,c]),2))
-                metrics['max_yield'].append(round(df[c].max(),2))
-
-                #Determine positive control for the current column - if several, average them
-                c_name=df.iloc[:,1:].columns[i]
-
-                if '%' in lag_type:
-                    if self.std_calculated==True:
-                        if self.avg_rows.isChecked()==False:
-                            pos_entry=[x for x in pos_list if c_name[:-2] in x.split(':')[1]]
-
-                        #Find positive control columns, replicate rows and combine them  
-                        else:
-                            rep_fit=[r for r in reps if c_name[:-2] in r]
-                            if '+' in pos_list[0]:
-                                positive_columns={y[-2:] for x in pos_list for y in x.split(':')[0].split('+')}
-                            else:
-                                positive_columns={x[-2:] for x in pos_list}
-
-                            pos_entry_set={r+str(x) for x in positive_columns for r in rep_fit}
-
-                            pos_entry=['+'.join(pos_entry_set)+f':{rep_fit[0]}']
-
-                    else:
-                        pos_entry=[x for x in pos_list if c_name[:-2] in x.split(':')[1]]
-
-                    #In cases where no background rows are specified (either background rows or wrong input), set lag time to 24
-                    if len(pos_entry)>0:
-
-                        #Check if there are several positive controls - If yes, extract and average
-                        if '+' in pos_entry[0]:
-                            pos_cols=pos_entry[0].split(':')[0].split('+')
-                            pos_curve=df[pos_cols].mean(axis=1)
-                        else:
-                            pos_cols=pos_entry[0].split(':')[0]
-                            pos_curve=df[pos_cols]
-
-                        #Calculate end of lag phase based on selected criterion
-                        
-                        #Get end of lag phase based on % of max_OD. #we want the exact x at end of lag time.Therefore we get the value BEFORE threshold is reached
-                        #and AFTER threshold is reached, then calculate x at y=threshold value based on y=mx+b
-                        y_crit=(float(lag_crit)/100)*pos_curve.max()
-                        after_end=len(df[c])-1
-                        for i, x in enumerate(df[c]):
-                            if x > y_crit:
-                                after_end = i
-                                break
-                    else:
-                        metrics['lag_len'].append(float(df['Hour'].iloc[-1]))
-
-                    #Check in case threshold value is never crossed
-                else:
-                    y_crit=lag_crit
-                    after_end=len(df[c])-1
-                    for i, x in enumerate(df[c]):
-                        if x > y_crit:
-                            after_end = i
-                            break
-
-                #Get index of row before the one that crossed the threshold
-                before_end=after_end-1
-                
-                #If threshold was crossed at t0, set after end to 1 and before end to 0
-                if before_end<0:
-                    end_lag=0.01
-                    metrics['lag_len'].append(round(end_lag, 2))
-                else:
-                    try:
-                        #if max_OD<=15, set lag end time automatically to 24
-                        if df[c].max()>lag_crit:                
-                            y2=float(df.loc[after_end, c])
-                            y1=float(df.loc[before_end, c])
-                            x2=float(df.iloc[after_end, 0])
-                            x1=float(df.iloc[before_end, 0])
-                            #calculate necessary parameters
-                            m=((y2-y1)/(x2-x1))
-                            b=y1-m*x1
-                            #Solve for x at y=lag_crit
-                            end_lag=(y_crit-b)/m
-                            metrics['lag_len'].append(round(end_lag, 2))
-
-                        else:
-                            metrics['lag_len'].append(float(df['Hour'].iloc[-1]))
-                    except Exception as e:
-                        log.critical(f'ERROR: {e}')
-                        exit()
-    
-                #Find steepest point on curve over 4 points and calculate steepest slope
-                listy=list(df[c])
-                listx=list(df.iloc[:,0])
-                diffs=[(ind, ind+3, listy[ind+3]-listy[ind]) if ind+3<=len(listy)-1 else 'endpoint' for ind, i in enumerate(listy)]
-                diffs_clean=[i for i in diffs if not i=='endpoint' and not i[2]<0]
-                steepest=[i for i in diffs_clean if i[2]==max([x[2] for x in diffs_clean])]
-                x1, x2, y1, y2 = listx[steepest[0][0]], listx[steepest[0][1]], listy[steepest[0][0]], listy[steepest[0][1]]
-                metrics['slope'].append(round((y2-y1)/(x2-x1),2))
-
-            #set std_calculated to false again to enable calculation cycle for std and averaged metrics without the user having to close
-            #the main window
-            if self.std_calculated==True:
-                self.std_calculated=False
-
-            return pd.DataFrame(metrics)
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
-    
-    def get_replicate_variance(self, df):
-        """Get standard deviation between replicate curve parameters"""
-        log.info('Getting standard deviation')
-        try:
-            #Calculate metrics for raw data (background substracted if applicable)
-            if self.bg_rows.text()!='':
-                df=self.substract_background(df, self.bg_rows.text(), False)
-
-            #Calculate metrics from previously calculated_df
-            std_metrics=self.calculate_metrics(df)
-
-            #Check whether replicates on plate are defined row or column wise
-            reps_in_rows, reps_in_cols = self.determine_replicate_setup(self.rep_rows.text())
-
-            #Get replicate groups
-            if reps_in_rows==True and reps_in_cols==False:
-                replicate_rows=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(self.rep_rows.text().split(','))]
-                replicate_pairs=[]
-
-                c_nums=['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, int(self.num_cols.currentText())+1)]
-                for r in replicate_rows:
-                    replicate_pairs.extend([tuple(x+num for x in r) for num in c_nums])
-
-            elif reps_in_rows==False and reps_in_cols==True:
-                replicate_pairs=[tuple(r.strip() for r in val.split(':')) for i, val in enumerate(self.rep_rows.text().split(','))]
-
-            #Calculate replicate standard deviation for each parameter and group/concentration combination
-            std_dict={'Replicate group':[], 'lag_std':[], 'auc_std':[], 'yield_std':[], 'slope_std':[]}
-
-            for r in replicate_pairs:
-
-                if reps_in_rows==True and reps_in_cols==False:
-                    rep_group=''.join([x[0] for x in r])+str(r[0][-2:])
-                elif reps_in_rows==False and reps_in_cols==True:
-                    rep_group=''.join([x for x in r])
-
-                group_df=std_metrics[std_metrics['sample'].isin(r)==True]
-                if not group_df.empty:
-                    std_dict['Replicate group'].append(rep_group)
-
-                    #Append normalized standard deviation for all parameters
-                    std_dict['lag_std'].append(round(np.std(group_df['lag_len'])/np.mean(group_df['lag_len']),2))
-                    std_dict['auc_std'].append(round(np.std(group_df['AUC'])/np.mean(group_df['AUC']),2))
-                    std_dict['yield_std'].append(round(np.std(group_df['max_yield'])/np.mean(group_df['max_yield']),2))
-                    std_dict['slope_std'].append(round(np.std(group_df['slope'])/np.mean(group_df['lag_len']),2))
-            
-            self.std_calculated=True
-            
-            return std_dict
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
-
-    def calculate_lowec(self, metrics):
-        """Calculate loec based on user input"""
-        log.info('Calculating loec')
-        try:
-            #Parse input from lowec calculation form to get positive controls and respective row.
-            if ',' in self.pos_contr.text():
-                if '+' in self.pos_contr.text():
-                    pos_pairs={x.split(':')[1]:[y for y in x.split(':')[0].split('+')] for x in self.pos_contr.text().strip().split(',')}
-                else:
-                    pos_pairs={x.split(':')[1]:[x.split(':')[0]] for x in self.pos_contr.text().strip().split(',')}
-            else:
-                if '+' in self.pos_contr.text():
-                    pos_pairs={x.split(':')[1]:[y for y in x.split(':')[0].split('+')] for x in list(self.pos_contr.text().strip())}
-                else:
-                    pos_pairs={x.split(':')[1]:[x.split(':')[0]] for x in list(self.pos_contr.text().strip())}
-
-            #get background rows
-            bgs=self.bg_rows.text().replace(' ', '')
-            if ',' in bgs:
-                bg_rows=''.join([x.split(':')[1] for x in bgs.split(',')])
-            else:
-                bg_rows=bgs.split(':')[1]
-            bg_rows=[*bg_rows]
-
-            #Get all concentrations used in plate layout
-            concentrations=['0'+str(c) if len(str(c))==1 else str(c) for c in range(1, int(self.num_cols.currentText())+1)]
-
-            #Now go through dict and metrics dataframe (which contains the calculated metrics)
-            #1. Get rows that contain all letters and number per sample and positive control
-
-            lowec_list=[]
-            noec_list=[]
-
-            #make list of processed samples as to avoid analyzing the same replicate pairs multiple times
-            processed_reps=[]
-
-            for k, v in pos_pairs.items():
-                if not k in processed_reps:
-            
-                    letters=list({x.strip()[0] for x in v})
-                    numbers=list({x.strip()[1:] for x in v})
-                    pos_sample_names=[n for n in metrics['sample'] if any(l in n for l in letters) and any(num in n for num in numbers)]
-                    sample_names=[n for n in metrics['sample'] if k in n and not any(num in n for num in numbers)]
-                    
-
-                    #Get positive sample AUC
-                    pos_metrics=metrics[metrics['sample'].isin(pos_sample_names)]
-
-                    #Get respective sample names
-                    sample_metrics=metrics[metrics['sample'].isin(sample_names)]
-
-                    #calculate cutoff value for all positive controls separately, then get all rows where lag>lag*crit_mean and auc<auc*crit_mean.
-                    #Then sort
-
-                    #IMPORTANT: LOEC calculations assume that concentrations on the plates are ordered from high (left side of plate) to low (right side of plate)
-                    #Either adjust the plate layout accordingly or change the code
-
-                    if self.lowec_calc.currentText()=='% PC lag':
-                        current_loec='None'
-                        crit_perc=float(self.lowec_input.text())/100
-                        cutoff=pos_metrics['lag_len']*crit_perc
-                        crit_mean=np.mean(cutoff)
-                        lowec_df=sample_metrics[sample_metrics['lag_len']>crit_mean].sort_values(by=['sample'])
-                        if len(lowec_df)>0:
-                            lowec_list.append(lowec_df.iloc[-1,0])
-                            current_loec=lowec_df.iloc[-1,0]
-                        else:
-                            lowec_list.append('None')
-
-                        #Also extract the noec (the concentration before the cutoff value is reached)
-                        if current_loec!='None':
-                            noec_df=sample_metrics[sample_metrics['lag_len']<crit_mean].sort_values(by=['sample'])
-                            noec_list.append(noec_df.iloc[0, 0])
-                        else:
-                            noec_list.append('None')
-
-                    elif self.lowec_calc.currentText()=='% PC AUC':
-                        current_loec='None'
-                        crit_perc=float(self.lowec_input.text())/100
-                        cutoff=pos_metrics['AUC']*crit_perc
-                        crit_mean=np.mean(cutoff)
-                        lowec_df=sample_metrics[sample_metrics['AUC']<=crit_mean].sort_values(by=['sample'])
-                        if len(lowec_df)>0:
-                            lowec_list.append(lowec_df.iloc[-1,0])
-                            current_loec=lowec_df.iloc[-1,0]
-                        else:
-                            lowec_list.append('None')
-
-                        #Also extract the noec (the concentration before the cutoff value is reached)
-                        if current_loec!='None':
-                            noec_df=sample_metrics[sample_metrics['AUC']>=crit_mean].sort_values(by=['sample'])
-                            noec_list.append(noec_df.iloc[0, 0])
-                        else:
-                            noec_list.append('None')
-
-                    elif self.lowec_calc.currentText()=='% PC yield':
-                        current_loec='None'
-                        crit_perc=float(self.lowec_input.text())/100
-                        cutoff=pos_metrics['max_yield']*crit_perc
-                        crit_mean=np.mean(cutoff)
-                        lowec_df=sample_metrics[sample_metrics['max_yield']<=crit_mean].sort_values(by=['sample'])
-                        if len(lowec_df)>0:
-                            lowec_list.append(lowec_df.iloc[-1,0])
-                            current_loec=lowec_df.iloc[-1,0]
-                        else:
-                            lowec_list.append('None')
-
-                        #Also extract the noec (the concentration before the cutoff value is reached)
-                        if current_loec!='None':
-                            noec_df=sample_metrics[sample_metrics['max_yield']>crit_mean].sort_values(by=['sample'])
-                            noec_list.append(noec_df.iloc[0, 0])
-                        else:
-                            noec_list.append('None')
-
-                    elif self.lowec_calc.currentText()=='% PC slope':
-                        current_loec='None'
-                        crit_perc=float(self.lowec_input.text())/100
-                        cutoff=pos_metrics['slope']*crit_perc
-                        crit_mean=np.mean(cutoff)
-                        lowec_df=sample_metrics[sample_metrics['slope']<=crit_mean].sort_values(by=['sample'])
-                        if len(lowec_df)>0:
-                            lowec_list.append(lowec_df.iloc[-1,0])
-                            current_loec=lowec_df.iloc[-1,0]
-                        else:
-                            lowec_list.append('None')
-
-                        #Also extract the noec (the concentration before the cutoff value is reached)
-                        if current_loec!='None':
-                            noec_df=sample_metrics[sample_metrics['slope']>crit_mean].sort_values(by=['sample'])
-                            noec_list.append(noec_df.iloc[0, 0])
-                        else:
-                            noec_list.append('None')
-
-                    #Perform ANOVA and post hoc test
-                    elif self.lowec_calc.currentText()=='ANOVA lag' or self.lowec_calc.currentText()=='ANOVA AUC' \
-                    or self.lowec_calc.currentText()=='ANOVA yield' or self.lowec_calc.currentText()=='ANOVA slope':
-                        #Get lag values for all replicates
-                        if ',' in self.rep_rows.text():
-                            rep_list=[x.split(':') for x in self.rep_rows.text().replace(' ', '').split(',') if not \
-                                    any(b in x for b in bg_rows)]
-                        else:
-                            rep_list=[x.split(':') for x in self.rep_rows.text().replace(' ', '') if not \
-                                    any(b in x for b in bg_rows)]
-
-                        #Go through lists of replicates
-                        for x in rep_list:
-
-                            #Create list containing all positive samples between the replicates
-                            rep_pos_names=[]
-                            for y in x:
-                                rep_pos_names.extend(pos_pairs[y.strip()])
-
-                            #Create dictionary containing all lag/AUC values for all replicates with the same concentration
-                            rep_dict={}
-                            for c in concentrations:
-                            #Get all possible combinations between replicates and concentration
-                                combs=[y+str(c) for y in x]
-                                if self.lowec_calc.currentText()=='ANOVA lag':
-                                #Extract lag values from metrics dataframe
-                                    comb_lags=metrics[metrics['sample'].isin(combs)]['lag_len'].values
-                                elif self.lowec_calc.currentText()=='ANOVA AUC':
-                                    comb_lags=metrics[metrics['sample'].isin(combs)]['AUC'].values
-                                elif self.lowec_calc.currentText()=='ANOVA yield':
-                                    comb_lags=metrics[metrics['sample'].isin(combs)]['max_yield'].values
-                                elif self.lowec_calc.currentText()=='ANOVA slope':
-                                    comb_lags=metrics[metrics['sample'].isin(combs)]['slope'].values
-                                rep_dict[c]=comb_lags
-                                
-                            #Save metrics per replicate and concentration to dataframe
-                            conc_df_all=pd.DataFrame(rep_dict, index=None)
-
-                            #Now assign the control group for dunnets test - if there are several, average them
-                            #Get column numbers for positive controls
-                            contr_cols=[str(x[-2:]) for x in v]
-
-                            #Remove positive controls from conc_df_all
-                            conc_df=conc_df_all[[c for c in conc_df_all.columns if not str(c[-2:]) in contr_cols]]
-
-                            if len(contr_cols)>1:
-                                conc_df['pc']=conc_df_all[contr_cols].mean(axis=1)
-                            else:
-                                conc_df['pc']=conc_df_all[contr_cols]
-
-                            #Now perform ANOVA
-                            kwa=stats.f_oneway(*[conc_df[c] for c in [x for x in conc_df.columns]])
-                            p_val=kwa[1]
-
-                            #If p-value is <= 0.05, perform dunnets post-hoc test to identify between which groups vs control the difference is significant
-                            if p_val<0.05:
-
-                                tuk=stats.dunnett(*[conc_df[c] for c in [x for x in conc_df.columns] if not c=='pc'], control=np.array(conc_df['pc']))
-                                tuk_pvals=tuk.pvalue
-
-                                #IMPORTANT: following code assumes that concentrations on the plate are going from highest (left on plate) to lowest (right on plate)
-                                #Either the plates have to be designed accordingly, or the code has to be adjusted
-
-                                #get indexes of columns tested against the control, then extract the column with the highest index where p<0.05
-                                #(as that will correspond to the lowest concentration where and effect is observed)
-                                sig_cols=[(i, col) for i, (col, p) in enumerate(zip(conc_df.columns, tuk_pvals)) if p<0.05]
-                                
-                                if len(sig_cols)>0:
-                                    sig_cols_sorted=sig_cols.sort(key=lambda x: x[0])
-                                    lowec_list.append(''.join(x)+str(sig_cols[-1][1]))
-                                    noec_list.append(''.join(x)+conc_df.columns[sig_cols[-1][0]+1])
-                                else:
-                                    lowec_list.append('None')
-                                    noec_list.append('None')
-                                    
-                            else:
-                                noec_list.append('None')
-                                lowec_list.append('None')
-
-                            processed_reps.extend(x)
-
-            print(lowec_list, noec_list)
-            #Filter noec and lowec lists such that only one value per replicate group is present
-            filt_lowec_list=self.filter_lowecs(lowec_list)
-            filt_noec_list=self.filter_lowecs(noec_list)
-            
-            return [*set(filt_lowec_list)], [*set(filt_noec_list)]
-        
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
-    
-    def filter_lowecs(self, lowec_list):
-        """Filter loec/noec list such that only one value per replicate group is present.
-        NOTE: This assumes that concentrations go from highest (right side of plate) to
-        lowest (left side of plate)"""
-        log.info('Filtering lowecs')
-        try:
-            filtered_list=[]
-            #Filter out all replicate groups in list
-            rep_groups={x[:-2] for x in lowec_list if not x=='None'}
-
-            #get largest value and append to filtered list
-            for r in rep_groups:
-                max_rep_val=[x for x in lowec_list if r in x and int(x[-2:])==max([int(y[-2:]) for y in lowec_list if r in y])][0]
-                filtered_list.append(max_rep_val)
-            
-            if 'None' in lowec_list:
-                filtered_list.append('None')
-            
-            return filtered_list
-        
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
-
-
-    def calculate_mic(self, metrics):
-        """Calculate MIC based on input threshold value"""
-        log.info('Calculating MICs')
-        try:
-            mics={'rows':[], 'MICs':[]}
-
-            if self.mic_calc.currentText()=='max. OD':
-                cutoff=float(self.mic_input.text())
-
-            #Get unique rows for which mics should be calculated
-            uniques={x[:-2] for x in metrics['sample']}
-
-            #Get all samples for which the max_yield <= cutoff
-            for u in uniques:
-                mic_samps=metrics[(metrics['max_yield']<=cutoff) & (metrics['sample'].str.contains(u)==True)]['sample']
-                if sorted(mic_samps)!=[]:
-                    #Get lowest concentration with max OD below cutoff value. #TO DATE, THIS ASSUMES THAT CONCENTRATIONS ARE ORDERED
-                    #FROM HIGHEST TO LOWEST ON PLATE!
-                    mic_conc=max([x[-2:] for x in mic_samps])
-                    mics['MICs'].append(mic_conc)
-                    mics['rows'].append(u)
-                else:
-                    mics['MICs'].append('None')
-                    mics['rows'].append(u)
-
-            return mics
-        
-        except Exception as e:
-            log.critical(f'Error: {e}')
-            exit()
+        return GrowthAnalysis(self.layout_params()).check_input_integrity(self.filelabel.text())
 
 class RemoveLayoutWindow(QWidget):
     """ Class for removing custom layouts"""
@@ -1521,6 +770,272 @@ class RemoveLayoutWindow(QWidget):
 
         self.close()
     
+class AdvancedSettingsWindow(QWidget):
+    """ Class for setting advanced analysis parameters"""
+    log.info('Advanced settings')
+    def __init__(self, mainwin):
+
+        super().__init__()
+
+        self.setWindowTitle('Advanced settings')
+        self.initGUI(mainwin)
+
+    def initGUI(self, mainwin):
+        """Define window look and function"""
+        log.info('Initiating advanced settings GUI')
+        layout=QGridLayout()
+        self.mainwin=mainwin
+        n='\n'
+
+        #Input for resampling curves onto a regular time grid
+        time_step_label=QLabel('Resample interval (h)')
+        time_step_label.setToolTip(f'If provided, curves are interpolated onto a regular time grid with this interval{n}before analysis, e.g. for plates with irregular read intervals. Plates with missing{n}reads are always resampled (onto their median read interval).')
+        self.time_step=QLineEdit(self.mainwin.advanced['time_step'])
+
+        #Inputs for maximum specific growth rate calculation
+        rate_window_label=QLabel('Growth rate window (timepoints)')
+        rate_window_label.setToolTip(f'Number of consecutive timepoints of the local regressions (Savitzky-Golay smoother) used for derivative{n}curves, the maximum specific growth rate (mu_max), tangent lag and growth phases.')
+        self.rate_window=QLineEdit(self.mainwin.advanced['rate_window'])
+        rate_min_signal_label=QLabel('Growth rate minimum signal')
+        rate_min_signal_label.setToolTip(f'Reads below or equal to this value are excluded from the growth rate calculation,{n}as they cannot be log-transformed meaningfully.')
+        self.rate_min_signal=QLineEdit(self.mainwin.advanced['rate_min_signal'])
+
+        #Smoother used when smoothing curves is selected
+        smoother_label=QLabel('Smoother')
+        smoother_label.setToolTip(f'Smoother used if curves are smoothened. GAM fits a monotonic GAM to each curve, Isotonic fits{n}monotonic curves much faster, Savitzky-Golay (smoothing window) and Spline (spline penalty) also preserve declines.')
+        self.smoother=QComboBox()
+        self.smoother.addItems(list(SMOOTHERS))
+        self.smoother.setCurrentText(self.mainwin.advanced['smoother'])
+        smooth_window_label=QLabel('Smoothing window (timepoints)')
+        smooth_window_label.setToolTip('Number of consecutive timepoints of the Savitzky-Golay smoother, must be odd.')
+        self.smooth_window=QLineEdit(self.mainwin.advanced['smooth_window'])
+
+        #Smoother for derivative curves
+        derivative_method_label=QLabel('Derivative smoother')
+        derivative_method_label.setToolTip(f'Smoother used for derivative curves (dOD/dt, d ln OD/dt), from which growth rates, tangent lag{n}and growth phases are calculated. Savitzky-Golay uses the growth rate window, Spline a penalized spline.')
+        self.derivative_method=QComboBox()
+        self.derivative_method.addItems(list(DERIVATIVE_METHODS))
+        self.derivative_method.setCurrentText(self.mainwin.advanced['derivative_method'])
+        spline_penalty_label=QLabel('Spline penalty')
+        spline_penalty_label.setToolTip('Smoothness penalty of the spline smoother - larger values give smoother derivative curves.')
+        self.spline_penalty=QLineEdit(self.mainwin.advanced['spline_penalty'])
+
+        #Input for growth phase segmentation
+        phase_threshold_label=QLabel('Phase threshold (% max. slope)')
+        phase_threshold_label.setToolTip(f'Timepoints at which the local slope of a curve exceeds this percentage of its maximum slope{n}are assigned to a growth phase, timepoints below the negative percentage to a decline phase.')
+        self.phase_threshold=QLineEdit(self.mainwin.advanced['phase_threshold'])
+
+        #Inputs for replicate outlier detection
+        outlier_threshold_label=QLabel('Outlier threshold (robust z-score)')
+        outlier_threshold_label.setToolTip(f'Replicate wells whose distance to the median curve of their replicate group exceeds this robust{n}z-score (relative to all replicate wells of the plate) are flagged as outliers. Requires at least 3 replicates.')
+        self.outlier_threshold=QLineEdit(self.mainwin.advanced['outlier_threshold'])
+        exclude_outliers_label=QLabel('Exclude outliers from averages')
+        exclude_outliers_label.setToolTip('If checked, wells flagged as outliers are left out when averaging replicates.')
+        self.exclude_outliers=QCheckBox()
+        self.exclude_outliers.setChecked(self.mainwin.advanced['exclude_outliers']==1)
+
+        #Selection of the edge effect correction
+        edge_correction_label=QLabel('Edge effect correction')
+        edge_correction_label.setToolTip(f'Substract plate position trends (e.g. evaporation in outer wells) after background substraction. Median polish{n}removes row and column effects, Surface a smooth quadratic trend. Both also remove real differences between{n}rows and columns, e.g. concentration series, so use them on layouts where positions are comparable.')
+        self.edge_correction=QComboBox()
+        self.edge_correction.addItems(list(EDGE_CORRECTIONS))
+        self.edge_correction.setCurrentText(self.mainwin.advanced['edge_correction'])
+
+        #Inputs for two drug checkerboards
+        row_conc_label=QLabel('Row concentrations (checkerboard)')
+        row_conc_label.setToolTip(f'Concentrations of a second drug along the sample rows, as comma separated list or highest{n}concentration:dilution factor. If provided, FIC index, Bliss and Loewe excess are calculated, with the{n}column concentrations as first drug. The lowest concentration of each drug should be drug free (0).')
+        self.row_conc=QLineEdit(self.mainwin.advanced['row_conc'])
+        synergy_metric_label=QLabel('Synergy metric')
+        synergy_metric_label.setToolTip('Growth metric compared to the drug free well in synergy calculations.')
+        self.synergy_metric=QComboBox()
+        self.synergy_metric.addItems(list(SYNERGY_METRICS))
+        self.synergy_metric.setCurrentText(self.mainwin.advanced['synergy_metric'])
+        synergy_cutoff_label=QLabel('Synergy cutoff (% drug free growth)')
+        synergy_cutoff_label.setToolTip('Wells with at most this percentage of the growth without drugs are inhibited (MICs, FIC).')
+        self.synergy_cutoff=QLineEdit(self.mainwin.advanced['synergy_cutoff'])
+
+        #Inputs for normalization with control wells shared between plates
+        control_wells_label=QLabel('Shared control wells')
+        control_wells_label.setToolTip(f'Comma separated control samples present on all plates (e.g. positive controls or a reference strain,{n}named as after averaging, e.g. AB11, EF11). Curves are scaled so that the mean signal of the controls{n}matches the control reference.')
+        self.control_wells=QLineEdit(self.mainwin.advanced['control_wells'])
+        control_reference_label=QLabel('Control reference level')
+        control_reference_label.setToolTip(f'Reference mean signal of the control wells. If empty, the control level is only recorded (factor 1),{n}e.g. to serve as reference for later plates (see results database).')
+        self.control_reference=QLineEdit(self.mainwin.advanced['control_reference'])
+
+        #Inputs for curve shape clustering
+        clusters_label=QLabel('Curve clusters')
+        clusters_label.setToolTip(f'If provided, the curves are resampled onto a common grid, embedded into their principal components and{n}grouped into this number of clusters by shape. Clusters and components are added to the metrics.')
+        self.clusters=QLineEdit(self.mainwin.advanced['clusters'])
+        cluster_dims_label=QLabel('Embedding dimensions')
+        cluster_dims_label.setToolTip('Number of principal components the curves are clustered in.')
+        self.cluster_dims=QLineEdit(self.mainwin.advanced['cluster_dims'])
+
+        #Button to apply settings
+        apply_button=QPushButton('Apply')
+        apply_button.setToolTip('Apply advanced settings.')
+
+        layout.addWidget(time_step_label, 0, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.time_step, 1, 0)
+        layout.addWidget(rate_window_label, 2, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.rate_window, 3, 0)
+        layout.addWidget(rate_min_signal_label, 4, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.rate_min_signal, 5, 0)
+        layout.addWidget(phase_threshold_label, 6, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.phase_threshold, 7, 0)
+        layout.addWidget(derivative_method_label, 8, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.derivative_method, 9, 0)
+        layout.addWidget(spline_penalty_label, 10, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.spline_penalty, 11, 0)
+        layout.addWidget(smoother_label, 12, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.smoother, 13, 0)
+        layout.addWidget(smooth_window_label, 14, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.smooth_window, 15, 0)
+        layout.addWidget(outlier_threshold_label, 16, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.outlier_threshold, 17, 0)
+        layout.addWidget(exclude_outliers_label, 18, 0)
+        layout.addWidget(self.exclude_outliers, 18, 1)
+        layout.addWidget(edge_correction_label, 19, 0, alignment=Qt.AlignBottom)
+        layout.addWidget(self.edge_correction, 20, 0)
+        #Settings that relate samples or plates to each other in a second column
+        layout.addWidget(row_conc_label, 0, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.row_conc, 1, 2)
+        layout.addWidget(synergy_metric_label, 2, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.synergy_metric, 3, 2)
+        layout.addWidget(synergy_cutoff_label, 4, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.synergy_cutoff, 5, 2)
+        layout.addWidget(control_wells_label, 6, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.control_wells, 7, 2)
+        layout.addWidget(control_reference_label, 8, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.control_reference, 9, 2)
+        layout.addWidget(clusters_label, 10, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.clusters, 11, 2)
+        layout.addWidget(cluster_dims_label, 12, 2, alignment=Qt.AlignBottom)
+        layout.addWidget(self.cluster_dims, 13, 2)
+        layout.addWidget(apply_button, 22, 0, 1, 3, alignment=Qt.AlignCenter)
+
+        apply_button.clicked.connect(self.apply_settings)
+
+        self.setLayout(layout)
+
+    def apply_settings(self):
+        """ Store advanced settings in main window """
+        log.info('Applying advanced settings')
+        self.mainwin.advanced['time_step']=self.time_step.text().strip()
+        self.mainwin.advanced['rate_window']=self.rate_window.text().strip()
+        self.mainwin.advanced['rate_min_signal']=self.rate_min_signal.text().strip()
+        self.mainwin.advanced['phase_threshold']=self.phase_threshold.text().strip()
+        self.mainwin.advanced['derivative_method']=self.derivative_method.currentText()
+        self.mainwin.advanced['spline_penalty']=self.spline_penalty.text().strip()
+        self.mainwin.advanced['smoother']=self.smoother.currentText()
+        self.mainwin.advanced['smooth_window']=self.smooth_window.text().strip()
+        self.mainwin.advanced['outlier_threshold']=self.outlier_threshold.text().strip()
+        self.mainwin.advanced['exclude_outliers']=1 if self.exclude_outliers.isChecked() else 0
+        self.mainwin.advanced['edge_correction']=self.edge_correction.currentText()
+        self.mainwin.advanced['row_conc']=self.row_conc.text().strip()
+        self.mainwin.advanced['synergy_metric']=self.synergy_metric.currentText()
+        self.mainwin.advanced['synergy_cutoff']=self.synergy_cutoff.text().strip()
+        self.mainwin.advanced['control_wells']=self.control_wells.text().strip()
+        self.mainwin.advanced['control_reference']=self.control_reference.text().strip()
+        self.mainwin.advanced['clusters']=self.clusters.text().strip()
+        self.mainwin.advanced['cluster_dims']=self.cluster_dims.text().strip()
+        self.close()
+
+class CompareWindow(QWidget):
+    """Window for analysing the current plate with several parameter configurations and comparing their results"""
+    log.info('Comparison window')
+    def __init__(self, mainwin):
+
+        super().__init__()
+
+        self.setWindowTitle('Compare settings')
+        self.initGUI(mainwin)
+
+    def initGUI(self, mainwin):
+        """Build comparison UI"""
+        log.info('Initiating comparison GUI')
+        layout=QGridLayout()
+        self.mainwin=mainwin
+        #Stages shared by the configurations are kept for further comparisons of the same plate
+        self.cache=StageCache(mainwin.df_raw)
+        self.metric_table=None
+        self.call_table=None
+
+        config_label=QLabel('Configurations (one per line, name: parameter=value, parameter=value):')
+        config_label.setToolTip('Parameters that are not given are taken from the main window, e.g.\nsmoothed: smoothen=1\n'
+                                'lag 0.1: lag_calc_input=0.1')
+        self.configs=QPlainTextEdit()
+        smoothen=self.mainwin.smoothen_curves.isChecked()
+        self.configs.setPlainText(f'current:\n{"unsmoothed" if smoothen else "smoothed"}: smoothen={0 if smoothen else 1}')
+        self.configs.setFixedHeight(100)
+
+        self.differences_only=QCheckBox('Only show differences')
+        self.differences_only.setChecked(True)
+        self.differences_only.stateChanged.connect(self.show_tables)
+
+        run_button=QPushButton('Compare')
+        run_button.clicked.connect(self.run_comparison)
+        self.save_button=QPushButton('Save')
+        self.save_button.clicked.connect(self.save_comparison)
+        self.save_button.setEnabled(False)
+
+        #Side by side tables of the metrics and the LOEC/NOEC/MIC calls
+        self.results=QPlainTextEdit()
+        self.results.setReadOnly(True)
+        self.results.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.results.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.results.setMinimumSize(700, 400)
+
+        layout.addWidget(config_label, 0, 0, 1, 2)
+        layout.addWidget(self.configs, 1, 0, 1, 2)
+        layout.addWidget(self.differences_only, 2, 0)
+        layout.addWidget(run_button, 3, 0)
+        layout.addWidget(self.save_button, 3, 1)
+        layout.addWidget(self.results, 4, 0, 1, 2)
+        self.setLayout(layout)
+
+    def run_comparison(self):
+        """Analyse the plate with all configurations and display the differences"""
+        log.info('Running comparison')
+        try:
+            configs=parse_configurations(self.configs.toPlainText(), self.mainwin.layout_params())
+            if len(configs)==0:
+                return
+            results, cache=compare_configurations(self.mainwin.df_raw, configs, self.cache)
+        except Exception as e:
+            self.mainwin.pop_errormsg([f'Comparison failed: {e}'])
+            return
+        self.metric_table=metric_differences(results)
+        self.call_table=call_differences(results)
+        self.save_button.setEnabled(True)
+        self.show_tables()
+
+    def show_tables(self):
+        """Display the comparison tables, optionally only the lines in which the configurations differ"""
+        if self.metric_table is None:
+            return
+        metrics, calls=self.metric_table, self.call_table
+        if self.differences_only.isChecked():
+            metrics=metrics[metrics['differs']]
+            calls=calls[calls['differs']]
+        computed=', '.join(f'{k}: {v}' for k, v in self.cache.computed.items())
+        text=[f'Stages calculated so far - {computed}', '', 'Metrics',
+              metrics.drop(columns='differs').to_string(index=False) if len(metrics)>0 else 'No differences']
+        text+=['', 'LOEC/NOEC/MIC', calls.drop(columns='differs').to_string(index=False) if len(calls)>0 else 'No differences']
+        self.results.setPlainText('\n'.join(text))
+
+    def save_comparison(self):
+        """Write comparison tables to excel file"""
+        log.info('Saving comparison')
+        try:
+            file_path, _=QFileDialog.getSaveFileName(self, 'Save File', '', 'Excel Files (*.xlsx)')
+            if not file_path:
+                return
+            with pd.ExcelWriter(file_path if file_path.endswith('.xlsx') else file_path+'.xlsx', engine='xlsxwriter') as writer:
+                self.metric_table.to_excel(writer, sheet_name='metrics', index=False)
+                self.call_table.to_excel(writer, sheet_name='calls', index=False)
+        except Exception as e:
+            log.error(f'Error: {e}')
+
 class AddLayoutWindow(QWidget):
     """ Class for adding custom layouts to layout selection"""
     log.info('Adding custom layout')
@@ -1569,26 +1084,7 @@ class AddLayoutWindow(QWidget):
         #Add layout values to dictionary
         new_layout={}
         new_layout['name']=self.layout_name_input.text()
-        new_layout['reps']=self.mainwin.rep_rows.text()
-        new_layout['bg']=self.mainwin.bg_rows.text()
-        new_layout['col_num']=self.mainwin.num_cols.currentText()
-        if self.mainwin.avg_rows.isChecked()==True:
-            new_layout['avg']=1
-        else:
-            new_layout['avg']=0
-        if self.mainwin.smoothen_curves.isChecked()==True:
-            new_layout['smoothen']=1
-        else:
-            new_layout['smoothen']=0
-        new_layout['pos']=self.mainwin.pos_contr.text()
-        new_layout['conc']=self.mainwin.concentrations.text()
-        new_layout['conc_unit']=self.mainwin.concentration_unit.text()
-        new_layout['lag_calc']=self.mainwin.lag_calc.currentText()
-        new_layout['lag_calc_input']=self.mainwin.lag_calc_input.text()
-        new_layout['lowec_calc']=self.mainwin.lowec_calc.currentText()
-        new_layout['lowec_calc_input']=self.mainwin.lowec_input.text()
-        new_layout['mic_calc']=self.mainwin.mic_calc.currentText()
-        new_layout['mic_calc_input']=self.mainwin.mic_input.text()
+        new_layout.update(self.mainwin.layout_params())
 
         #Read in layouts file, then add new layout to file
         if os.path.getsize(resource_path('default_layouts.txt'))>0:
@@ -1665,13 +1161,36 @@ class PlotWindow(QWidget):
         savebutton.clicked.connect(self.save_results)
         savebutton.resize(100, 50)
 
+        #Embedding of the curve shape clusters, if clusters were calculated
+        self.cluster_button=QPushButton('Show clusters')
+        self.cluster_button.setToolTip('Plot the samples in the first two principal components of their curves, colored by cluster.')
+        self.cluster_button.clicked.connect(self.plot_clusters)
+        self.cluster_button.setEnabled('cluster' in self.mainwin.metrics.columns)
+
+        #Recorded curves of previous runs that are most similar to the sample last clicked on the heatmap
+        self.similar_button=QPushButton('Similar curves')
+        self.similar_button.setToolTip('Find the most similar curves of previous runs for the well selected on the plate heatmap.')
+        self.similar_button.clicked.connect(self.find_similar)
+        self.selected_well=None
+        #Samples whose metrics are displayed below the plot, updated by live previews
+        self.shown_samples=[]
+
         #Set canvas to display matplotlib plots
         self.canvas=MplCanvas(self, width=5, height=4, dpi=100)
 
         self.row_w=QLineEdit()
         self.col_w=QLineEdit()
         self.type_w=QComboBox()
-        self.type_w.addItems(['Raw', 'Raw processed','Smoothened'])
+        self.type_w.addItems(['Raw', 'Raw processed','Smoothened', 'dOD/dt', 'd ln OD/dt'])
+
+        #Plate heatmap of a selected metric, clicking a well plots its curve
+        heat_label=QLabel('Plate metric:')
+        heat_label.setAlignment(Qt.AlignBottom)
+        self.heat_w=QComboBox()
+        self.heat_w.addItems(self.plate_metrics())
+        self.heat_canvas=MplCanvas(self, width=5, height=4, dpi=100)
+        self.plate_dims=self.plate_shape()
+        self.init_heatmap()
 
         layout.addWidget(row_label, 0, 0)
         layout.addWidget(self.row_w, 1, 0)
@@ -1685,6 +1204,17 @@ class PlotWindow(QWidget):
         layout.addWidget(self.selected_metrics, 7, 0, 1, 2, alignment=Qt.AlignCenter)
         layout.addWidget(spacelabel, 8, 0, 1, 2)
         layout.addWidget(savebutton, 9, 0, 1, 2, alignment=Qt.AlignCenter)
+        layout.addWidget(heat_label, 2, 2)
+        layout.addWidget(self.heat_w, 3, 2)
+        layout.addWidget(self.cluster_button, 5, 2)
+        layout.addWidget(self.heat_canvas, 6, 2)
+        layout.addWidget(self.similar_button, 9, 2)
+
+        #When the heatmap metric is changed, only swap the image data
+        self.heat_w.currentTextChanged.connect(self.update_heatmap)
+
+        #When a well on the heatmap is clicked, plot its curve
+        self.heat_canvas.mpl_connect('button_press_event', self.heatmapclicked)
 
         #When smoothen_curves is not checked, disable type_w, 'smoothened' option
         if self.mainwin.smoothen_curves.isChecked()==True:
@@ -1692,6 +1222,11 @@ class PlotWindow(QWidget):
         else:
             self.type_w.model().item(2).setEnabled(False)
 
+        #Derivative curves are not available in sessions saved before they were introduced
+        if self.mainwin.derivative is None:
+            self.type_w.model().item(3).setEnabled(False)
+            self.type_w.model().item(4).setEnabled(False)
+
         #When no background is provided, disable 'raw processed' option for curve plotting
         if self.mainwin.bg_rows.text()=='' and self.mainwin.avg_rows.isChecked()==False:
             self.type_w.model().item(1).setEnabled(False)
@@ -1702,6 +1237,227 @@ class PlotWindow(QWidget):
 
     from PyQt5.QtWidgets import QFileDialog
 
+    def plot_state(self):
+        """Get current selections of the plotting window, e.g for storing them in a session file"""
+        return {'rows':self.row_w.text(), 'cols':self.col_w.text(), 'type':self.type_w.currentText(), 'heat_metric':self.heat_w.currentText()}
+
+    def apply_plot_state(self, state):
+        """Restore selections of the plotting window and replot"""
+        log.info('Restoring plotting window')
+        self.row_w.setText(state['rows'])
+        self.col_w.setText(state['cols'])
+        self.type_w.setCurrentText(state['type'])
+        self.heat_w.setCurrentText(state['heat_metric'])
+        if state['rows']!='' and state['cols']!='':
+            self.plot_curves()
+
+    def plate_metrics(self):
+        """Get names of all metrics that can be displayed on the plate heatmap"""
+        log.info('Getting plate heatmap metrics')
+        names=[c for c in self.mainwin.metrics.columns if not c=='sample']
+        if self.mainwin.std_dict is not None:
+            names.extend([k for k in self.mainwin.std_dict if not k=='Replicate group'])
+        if self.mainwin.lowecs is not None:
+            names.append('LOEC/NOEC')
+        if self.mainwin.mics is not None:
+            names.append('MIC')
+        return names
+
+    def plate_shape(self):
+        """Determine plate dimensions (96 or 384 wells) from the wells in the raw input"""
+        log.info('Determining plate shape')
+        wells=[w for c in self.mainwin.df_raw.columns if not c=='Hour' for w in sample_wells(c)]
+        if any(r>7 or c>11 for r, c in wells):
+            return 16, 24
+        return 8, 12
+
+    def metric_grid(self, metric):
+        """Place the values of a metric at the plate positions of the respective samples"""
+        log.info('Creating metric grid')
+        metrics=self.mainwin.metrics
+        std_dict=self.mainwin.std_dict
+
+        if metric in metrics.columns:
+            values=dict(zip(metrics['sample'], metrics[metric]))
+        elif std_dict is not None and metric in std_dict:
+            values=dict(zip(std_dict['Replicate group'], std_dict[metric]))
+        else:
+            #LOEC/NOEC and MIC calls are categorical - 0 for all samples, 1 for NOEC/MIC, 2 for LOEC
+            values=dict.fromkeys(metrics['sample'], 0)
+            if metric=='LOEC/NOEC':
+                values.update({x:1 for x in self.mainwin.noecs if not x=='None'})
+                values.update({x:2 for x in self.mainwin.lowecs if not x=='None'})
+            elif metric=='MIC':
+                values.update({r+m:1 for r, m in zip(self.mainwin.mics['rows'], self.mainwin.mics['MICs']) if not m=='None'})
+
+        grid=np.full(self.plate_dims, np.nan)
+        cells=[(r, c, v) for k, v in values.items() for r, c in sample_wells(k)]
+        if len(cells)>0:
+            rows, cols, vals=zip(*cells)
+            grid[list(rows), list(cols)]=vals
+        return grid
+
+    def init_heatmap(self):
+        """Draw plate heatmap once - changing the metric afterwards only replaces the image data"""
+        log.info('Initiating plate heatmap')
+        ax=self.heat_canvas.axes
+        nrows, ncols=self.plate_dims
+        self.heat_image=ax.imshow(np.full(self.plate_dims, np.nan), cmap='viridis', aspect='equal')
+        ax.set_xticks(range(ncols))
+        ax.set_xticklabels(['0'+str(i) if len(str(i))<2 else str(i) for i in range(1, ncols+1)], fontsize=6)
+        ax.set_yticks(range(nrows))
+        ax.set_yticklabels([chr(ord('A')+i) for i in range(nrows)], fontsize=6)
+        self.heat_canvas.figure.colorbar(self.heat_image, ax=ax)
+        self.update_heatmap()
+
+    def update_heatmap(self):
+        """Display the selected metric on the plate heatmap"""
+        log.info('Updating plate heatmap')
+        grid=self.metric_grid(self.heat_w.currentText())
+        #Cluster numbers are categories
+        self.heat_image.set_cmap('tab10' if self.heat_w.currentText()=='cluster' else 'viridis')
+        self.heat_image.set_data(grid)
+        if np.isfinite(grid).any():
+            self.heat_image.set_clim(np.nanmin(grid), np.nanmax(grid))
+        self.heat_canvas.axes.set_title(self.heat_w.currentText())
+        self.heat_canvas.draw_idle()
+
+    def refresh(self):
+        """Update heatmap and displayed metrics after the results of the main window were recalculated (live preview)"""
+        log.info('Refreshing plotting window')
+        #Selecting or deselecting LOEC and MIC calculation adds or removes their heatmaps
+        names=self.plate_metrics()
+        if names!=[self.heat_w.itemText(i) for i in range(self.heat_w.count())]:
+            current=self.heat_w.currentText()
+            self.heat_w.blockSignals(True)
+            self.heat_w.clear()
+            self.heat_w.addItems(names)
+            if current in names:
+                self.heat_w.setCurrentText(current)
+            self.heat_w.blockSignals(False)
+        self.update_heatmap()
+        if len(self.shown_samples)>0:
+            self.show_metrics(self.shown_samples)
+
+    def curve_data(self):
+        """Get dataframe of the curve type selected for plotting"""
+        if self.type_w.currentText()=='Raw':
+            return self.mainwin.df_raw
+        elif self.type_w.currentText()=='Raw processed':
+            return self.mainwin.df
+        elif self.type_w.currentText()=='Smoothened':
+            return self.mainwin.shifted_gams
+        elif self.type_w.currentText()=='dOD/dt':
+            return self.mainwin.derivative
+        elif self.type_w.currentText()=='d ln OD/dt':
+            return self.mainwin.log_derivative
+
+    def heatmapclicked(self, event):
+        """Plot the curve of the well clicked on the plate heatmap"""
+        log.info('Plate heatmap clicked')
+        if event.inaxes!=self.heat_canvas.axes or event.xdata is None:
+            return
+        well=(int(round(event.ydata)), int(round(event.xdata)))
+        self.selected_well=well
+        df=self.curve_data()
+
+        col_names=[c for c in df.columns if not c=='Hour' and well in sample_wells(c)]
+        if len(col_names)==0:
+            return
+        self.show_metrics(col_names)
+        self.draw_curves(df, col_names)
+
+    def show_metrics(self, col_names):
+        """Display metrics of the plotted samples below the plot"""
+        log.info('Showing metrics')
+        #Subset metrics dataframe to contain only the specifiec columns - #Turn to string in order to display as QLabel
+        self.shown_samples=col_names
+        sub_df=self.mainwin.metrics[self.mainwin.metrics['sample'].isin(col_names)]
+        string_df=sub_df.to_string(header=False, index=False, index_names=False).split('\n')
+        string_df=[[i for i in x.split(' ') if not i==''] for x in [' '.join(sub_df.columns)]+string_df]
+
+        fin_string=''
+        for sub_str in string_df:
+            sub_str=[str(i)+(' '*(12-len(str(i)))) for i in sub_str]
+            fin_string+='   '.join(sub_str)+'\n'
+        self.selected_metrics.setText(fin_string)
+
+    def draw_curves(self, df, col_names):
+        """Draw the selected curves on the plotting canvas"""
+        log.info('Drawing curves')
+        #Clear canvas before every plot
+        self.canvas.axes.cla()
+        for c in sorted(col_names):
+            self.canvas.axes.plot(df['Hour'], df[c])
+
+        #Set x and y plot labels and legend. Also adjust subplot size to make sure that the legend fits into the plot
+        self.canvas.axes.legend(sorted(col_names), loc='center right', bbox_to_anchor=(1.3, 0.5))
+        self.canvas.axes.set_xlabel('Hour')
+        if self.type_w.currentText() in ('dOD/dt', 'd ln OD/dt'):
+            self.canvas.axes.set_ylabel(self.type_w.currentText())
+        else:
+            self.canvas.axes.set_ylabel('OD')
+        self.canvas.draw()
+
+    def plot_clusters(self):
+        """Plot the samples in the first two principal components of their curves, colored by curve shape cluster"""
+        log.info('Plotting curve clusters')
+        self.shown_samples=[]
+        metrics=self.mainwin.metrics.dropna(subset=['cluster'])
+        self.canvas.axes.cla()
+        sizes=[]
+        for cluster, group in metrics.groupby('cluster'):
+            y=group['PC2'] if 'PC2' in group.columns else np.zeros(len(group))
+            self.canvas.axes.scatter(group['PC1'], y, s=15, label=f'Cluster {int(cluster)}')
+            sizes.append(f'Cluster {int(cluster)}: {len(group)} samples')
+        self.canvas.axes.legend(loc='center right', bbox_to_anchor=(1.3, 0.5))
+        self.canvas.axes.set_xlabel('PC1')
+        self.canvas.axes.set_ylabel('PC2')
+        self.selected_metrics.setText('\n'.join(sizes))
+        self.canvas.draw()
+
+    def find_similar(self, k=10):
+        """Find the k recorded curves of previous runs most similar in shape to the sample of the well selected on the heatmap,
+        list them below the plot and draw the normalized curves"""
+        log.info('Finding similar curves')
+        self.shown_samples=[]
+        df=analysed_curves({'shifted_gams':self.mainwin.shifted_gams, 'df':self.mainwin.df})
+        samples=[c for c in df.columns if not c=='Hour' and self.selected_well in sample_wells(c)]
+        if len(samples)==0:
+            self.selected_metrics.setText('Click a sample well on the plate heatmap to select it.')
+            return
+        sample=sorted(samples)[0]
+        try:
+            if self.mainwin.curve_index is None:
+                self.mainwin.curve_index=CurveIndex(ResultsStore())
+            index=self.mainwin.curve_index
+            matches=index.query(df[['Hour', sample]], k=k, exclude_runs=[self.mainwin.run_id])
+        except Exception as e:
+            log.error(f'Error: {e}')
+            self.selected_metrics.setText(f'Similarity search failed: {e}')
+            return
+        if len(matches)==0:
+            self.selected_metrics.setText(f'No recorded curves found for {sample}.')
+            return
+
+        #Normalized curves over the time range of their runs
+        self.canvas.axes.cla()
+        x=np.linspace(0, 1, index.vectors.shape[1])
+        query=curve_vectors(df['Hour'].to_numpy(dtype=np.float64), df[[sample]].to_numpy(dtype=np.float64).T)[0]
+        self.canvas.axes.plot(x, query, color='black', linewidth=2, label=sample)
+        positions=index.info['curve_id'].searchsorted(matches['curve_id'])
+        for (i, m), p in zip(matches.iterrows(), positions):
+            self.canvas.axes.plot(x, index.vectors[p], linewidth=0.8, label=f'{m["plate"]} {m["well"]}')
+        self.canvas.axes.legend(loc='center right', bbox_to_anchor=(1.3, 0.5), fontsize=6)
+        self.canvas.axes.set_xlabel('Fraction of run time')
+        self.canvas.axes.set_ylabel('Normalized curve')
+        self.canvas.draw()
+
+        columns=[c for c in ['rank', 'plate', 'well', 'compound', 'strain', 'concentration', 'date', 'correlation'] if c in matches.columns]
+        table=matches[columns].dropna(axis=1, how='all')
+        table['correlation']=table['correlation'].round(3)
+        self.selected_metrics.setText(f'Curves most similar to {sample}:\n'+table.to_string(index=False))
+
     def save_results(self):
         """ write original data and calculated curve parameters to excel file"""
         log.info('Saving Results')
@@ -1712,100 +1468,15 @@ class PlotWindow(QWidget):
             if not file_path:
                 return  # User canceled the dialog
             
-            # Define output filename ending based on selected parameters
-            params = []
-            if '%' in self.mainwin.lag_calc.currentText():
-                lag_val = f'lag%OD{self.mainwin.lag_calc_input.text()}'
-                params.append(lag_val)
-            else:
-                lag_val = f'lagOD{self.mainwin.lag_calc_input.text()}'
-                params.append(lag_val)
-
-            lowin = self.mainwin.lowec_calc.currentText()
-            if lowin != 'None':
-                if 'ANOVA' in lowin:
-                    lowend = f'loec{lowin.replace(" ", "_")}'
-                    params.append(lowend)
-                else:
-                    lowend = f'loec{lowin.replace(" ", "_")+self.mainwin.lowec_input.text()}'
-                    params.append(lowend)
+            outfile = result_filename(file_path, self.mainwin.layout_params())
 
-            if self.mainwin.mic_calc != 'None':
-                micend = f'micOD{self.mainwin.mic_input.text()}'
-                params.append(micend)
-            
-            endname = '_'.join(params) + '_curve_parameters.xlsx'
-            
-            # Concatenate file_path and endname to get the full file path
-            outfile = file_path.replace(".xlsx", "_" + endname)
-            
             # Write calculated data, metric results, and plot containing all rows and columns to Excel
-            raw_data = pd.read_excel(resource_path(self.mainwin.filelabel.text()), header=10)
-            if self.type_w.currentText() == 'Raw':
-                df = self.mainwin.df_raw
-            elif self.type_w.currentText() == 'Raw processed':
-                df = self.mainwin.df
-            elif self.type_w.currentText() == 'Smoothened':
-                df = self.mainwin.shifted_gams
-
-            metric_results = self.mainwin.metrics
-            conc_dict = self.mainwin.conc_dict
-
-            # Write dataframes to outfile, with several sheets - raw data, calculated data, metrics
-            writer = pd.ExcelWriter(outfile, engine='xlsxwriter')
-            raw_data.to_excel(writer, sheet_name='raw_data', index=False)
-            df.to_excel(writer, sheet_name='calc_data', index=False)
-            metric_results.to_excel(writer, sheet_name='metrics', index=False)
-
-            # If replicates are provided, write their standard deviation to the output file
-            if self.mainwin.std_dict is not None:
-                std_df = pd.DataFrame(self.mainwin.std_dict)
-                std_df.to_excel(writer, sheet_name='metrics', index=False, startcol=6, startrow=0)
-
-            if self.mainwin.lowec_calc.currentText() != 'None':
-                # If concentrations are provided, add a column with the respective concentration to dataframe
-                if self.mainwin.concentrations.text() != '':
-                    low_concs = [conc_dict[x[-2:]] if x[-2:] in conc_dict else 'None' for x in sorted(self.mainwin.lowecs)]
-                    no_concs = [conc_dict[x[-2:]] if x[-2:] in conc_dict else 'None' for x in sorted(self.mainwin.noecs)]
-                    low_df = pd.DataFrame({'Loecs': sorted(self.mainwin.lowecs), 'Concentrations': low_concs})
-                    no_df = pd.DataFrame({'Noecs': sorted(self.mainwin.noecs), 'Concentrations': no_concs})
-
-                else:
-                    low_df = pd.DataFrame({'Loecs': sorted(self.mainwin.lowecs)})
-                    no_df = pd.DataFrame({'Noecs': sorted(self.mainwin.noecs)})
-
-                low_df.to_excel(writer, sheet_name='metrics', index=False, startcol=12, startrow=0)
-                no_df.to_excel(writer, sheet_name='metrics', index=False, startcol=15, startrow=0)
-
-            if self.mainwin.mic_calc.currentText() != 'None':
-                if self.mainwin.concentrations.text() != '':
-                    mic_concs = [conc_dict[x[-2:]] if x in conc_dict else 'None' for x in self.mainwin.mics['MICs']]
-                    self.mainwin.mics['Concentrations'] = mic_concs
-                
-                mic_df = pd.DataFrame(self.mainwin.mics).sort_values(by=['rows'])
-                mic_df.to_excel(writer, sheet_name='metrics', index=False, startcol=18, startrow=0)
-
-            # Write plot to file
-            # Create plot of all columns to save
-            fig = plt.figure(figsize=(10, 8))
-            fig.subplots_adjust(right=0.8)
-            ax = plt.subplot(111)
-
-            for c in sorted([c for c in raw_data.columns if not c == 'Hour']):
-                ax.plot(raw_data['Hour'], raw_data[c])
-
-            ax.set_xlabel('Hour')
-            ax.set_ylabel('Omnilog Units')
-            ax.legend(sorted(raw_data.columns), loc='center right', bbox_to_anchor=(1.3, 0.5))
-
-            workbook = writer.book
-            sheet = workbook.add_worksheet('plot')
+            df = self.curve_data()
 
-            imgdata = io.BytesIO()
-            fig.savefig(imgdata, dpi=300, format='png')
-            sheet.insert_image(1, 1, '', {'image_data': imgdata})
-
-            workbook.close()
+            write_results(outfile, self.mainwin.df_raw, df, self.mainwin.metrics, self.mainwin.std_dict, self.mainwin.lowecs,
+                          self.mainwin.noecs, self.mainwin.mics, self.mainwin.conc_dict, self.mainwin.layout_params(), self.mainwin.phases,
+                          self.mainwin.derivative, self.mainwin.log_derivative, self.mainwin.outliers,
+                          self.mainwin.edge_correction, self.mainwin.synergy, self.mainwin.normalization)
 
         except Exception as e:
             log.error(f'Error: {e}')
@@ -1935,13 +1606,9 @@ class PlotWindow(QWidget):
                     self.mainwin.pop_errormsg(col_chk)
                     return
 
-        elif self.type_w.currentText()=='Smoothened' or self.type_w.currentText()=='Raw processed':
-
-            if self.type_w.currentText()=='Smoothened':
-                df=self.mainwin.shifted_gams
-
-            elif self.type_w.currentText()=='Raw processed':
-                df=self.mainwin.df
+        else:
+            #Processed, smoothened and derivative curves share the sample names of the metrics
+            df=self.curve_data()
 
             #Get input from row_w and col_w
             #row_w input: 'A,B,C,D...' or 'all'
@@ -1978,36 +1645,9 @@ class PlotWindow(QWidget):
             elif self.mainwin.reps_in_cols==True:
                 col_names=[c for c in df if any(r in c for r in rows) and any(col in c for col in cols)]
 
-            #Subset metrics dataframe to contain only the specifiec columns - #Turn to string in order to display as QLabel
-            sub_df=self.mainwin.metrics[self.mainwin.metrics['sample'].isin(col_names)]
-            string_df=sub_df.to_string(header=True, index=False, index_names=False).split('\n')
-            string_df=[[i for i in x.split(' ') if not i==''] for x in string_df]
-
-            nl='\n'
-            tb='\t'
-            fin_string=''
-            for i, sub_str in enumerate(string_df):
-                if i==0:
-                    fin_string+=f'Sample{" "*7}AUC{" "*10}lag_length{" "*3}max_yield{" "*4}slope{nl}'
-                else:
-                    sub_str=[str(i)+(' '*(12-len(str(i)))) for i in sub_str]
-                    fin_string+='   '.join(sub_str)+'\n'
-            self.selected_metrics.setText(fin_string)
-            
-
-        #Subset metrics dataframe to contain only the specifiec columns
-        sub_df=self.mainwin.metrics[self.mainwin.metrics['sample'].isin(col_names)]
-    
-        #Clear canvas before every plot
-        self.canvas.axes.cla()
-        for c in sorted(col_names):
-            self.canvas.axes.plot(df['Hour'], df[c])
+            self.show_metrics(col_names)
 
-        #Set x and y plot labels and legend. Also adjust subplot size to make sure that the legend fits into the plot
-        self.canvas.axes.legend(sorted(col_names), loc='center right', bbox_to_anchor=(1.3, 0.5))
-        self.canvas.axes.set_xlabel('Hour')
-        self.canvas.axes.set_ylabel('OD')
-        self.canvas.draw()
+        self.draw_curves(df, col_names)
 
 class BrowseFiles(QWidget):
     """Class to open a separate window for input file selection"""
@@ -2031,8 +1671,68 @@ class BrowseFiles(QWidget):
         dlg=QFileDialog()
         self.filename=dlg.getOpenFileName(dlg, 'Open file ', '', 'Excel files (*.xlsx *.xls)')
 
+def parse_args():
+    """Parse command line arguments - without arguments, the GUI is started"""
+    parser=argparse.ArgumentParser(description='BGCA - Bacterial Growth Curve Analysis')
+    parser.add_argument('--watch', metavar='FOLDER', help='Watch folder for new plate exports (.xlsx/.csv) and analyse them automatically, without starting the GUI.')
+    parser.add_argument('--batch', nargs='+', metavar='PATH', help='Analyse all plates of the given files and folders in a pipeline of load, preprocess, smooth, metrics and export stages, without starting the GUI.')
+    parser.add_argument('--manifest', metavar='FILE', help='Run the batch analysis described in a manifest (JSON file with input files, layouts and parameters, or experiment table with sample metadata). Plates are checkpointed after each stage, running the same manifest again resumes unfinished and failed plates.')
+    parser.add_argument('--layout', help='Plate layout (from default_layouts.txt) used for batch analysis, and for watched files without sidecar file or matching pattern.')
+    parser.add_argument('--clusters', type=int, metavar='N', help='Cluster the curves of all plates of a batch analysis together into N clusters by shape, written to curve_clusters.csv in the output folder.')
+    parser.add_argument('--cluster-dims', type=int, default=3, metavar='N', help='Number of principal components the curves are clustered in (default: 3).')
+    parser.add_argument('--pattern', action='append', default=[], metavar='GLOB=LAYOUT', help="Use LAYOUT for watched files with names matching GLOB, e.g. '*biocide*=Biocides'. Can be given several times.")
+    parser.add_argument('--output', metavar='DIR', help='Folder for result files of watched files (default: FOLDER/bgca_results) or of batch analysis (default: bgca_results, or the output of the manifest).')
+    parser.add_argument('--workers', type=int, default=2, help='Number of worker processes (default: 2).')
+    parser.add_argument('--stage-workers', action='append', default=[], metavar='STAGE=N', help=f"Number of workers of a batch analysis stage ({', '.join(STAGES)}), e.g. 'smooth=4'. Can be given several times.")
+    parser.add_argument('--poll', type=float, default=5, help='Seconds between folder scans (default: 5).')
+    parser.add_argument('--settle', type=float, default=10, help='Seconds a file must remain unchanged before it is analysed (default: 10).')
+    parser.add_argument('--db', default='bgca_results.db', help='Results database (default: bgca_results.db).')
+    parser.add_argument('--once', action='store_true', help='Analyse files currently in FOLDER and exit instead of watching.')
+    parser.add_argument('--serve', action='store_true', help='Run a local analysis server instead of the GUI, see server.py for the API.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the analysis server listens on (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the analysis server (default: 8765).')
+    parser.add_argument('--socket', metavar='PATH', help='Listen on a unix domain socket instead of a TCP port.')
+    parser.add_argument('--queue', type=int, default=16, help='Maximum number of queued requests of the analysis server (default: 16).')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds the analysis server waits for the result of a request (default: 300).')
+    return parser.parse_args()
+
 def main():
-    """Start up GUI application"""
+    """Start up GUI application, or watch a folder or run the analysis server if requested on the command line"""
+    args=parse_args()
+    if args.watch is not None:
+        log.info('Starting folder watcher')
+        patterns=[tuple(p.split('=', 1)) for p in args.pattern]
+        watcher=FolderWatcher(args.watch, outdir=args.output, default_layout=args.layout, patterns=patterns, workers=args.workers,
+                              poll=args.poll, settle=args.settle, db=args.db)
+        watcher.run(once=args.once)
+        return
+
+    if args.batch is not None or args.manifest is not None:
+        log.info('Starting batch analysis')
+        workers={stage:int(n) for stage, n in (w.split('=', 1) for w in args.stage_workers)}
+        if args.manifest is not None:
+            output, jobs=load_manifest(args.manifest)
+            outdir=args.output or output or os.path.join(os.path.dirname(os.path.abspath(args.manifest)), 'bgca_results')
+            pipeline=BatchPipeline(outdir, workers=workers, store=ResultsStore(args.db), checkpoints=os.path.join(outdir, '.checkpoints'))
+            results, failures, utilization=pipeline.run_jobs(jobs)
+            #Metrics and sample metadata of all plates, for aggregation across the experiment
+            combined_metrics(results).to_csv(os.path.join(outdir, 'experiment_metrics.csv'), index=False)
+        else:
+            outdir=args.output or 'bgca_results'
+            pipeline=BatchPipeline(outdir, workers=workers, store=ResultsStore(args.db))
+            results, failures, utilization=pipeline.run(args.batch, load_layouts()[args.layout], layout=args.layout)
+        if args.clusters is not None and len(results)>0:
+            batch_clusters(results, args.clusters, args.cluster_dims).to_csv(os.path.join(outdir, 'curve_clusters.csv'), index=False)
+        print(utilization.to_string(index=False))
+        if len(failures)>0:
+            print(failures.to_string(index=False))
+        return
+
+    if args.serve:
+        log.info('Starting analysis server')
+        serve(host=args.host, port=args.port, socket_path=args.socket, workers=args.workers, queue_size=args.queue, timeout=args.timeout)
+        return
+
     log.info('Starting GUI Application')
     app=QApplication([])
 
@@ -2043,5 +1743,7 @@ def main():
     
 
 if __name__=='__main__':
+    #Needed for worker processes in the frozen (pyinstaller) executable
+    multiprocessing.freeze_support()
     main()
     
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+import logging as log
+from analysis import GrowthAnalysis, load_layouts
+from ingest import plate_files
+from results_db import METADATA_COLUMNS
+
+#A manifest describes a batch run: a JSON file with the output folder, the default layout and parameters, and the input
+#files or folders ('plates'), each either a path or a dictionary with 'path' and optionally 'layout', 'params', 'sheet'
+#and 'samples' (sample metadata, see sample_metadata):
+#{"output": "results", "layout": "Biocides", "params": {"smoothen": 1},
+# "plates": ["run1.xlsx", {"path": "run2", "layout": "Custom", "params": {"bg": "H"}}, {"path": "run3.xlsx", "sheet": "Plate 2"}]}
+#Experiment manifests are tables (.csv or .xlsx) with one line per input file and group of plate rows, see load_experiment.
+#Relative paths are relative to the folder of the manifest.
+
+#Rows of 96 and 384 well plates
+PLATE_ROWS='ABCDEFGHIJKLMNOP'
+PLATE_COLUMNS=24
+
+#Columns of experiment manifests that are not layout parameters
+EXPERIMENT_COLUMNS=['file', 'sheet', 'layout', 'rows', 'columns', 'compound', 'strain', 'concentrations', 'unit']
+
+def manifest_params(layouts, layout=None, params=None):
+    """Layout parameters of a manifest entry: parameters that are not given explicitly are taken from the layout,
+    and parameters the layout does not set from the 'Custom' layout"""
+    if layout is not None and not layout in layouts:
+        raise ValueError(f'Unknown layout {layout}')
+    return {**layouts['Custom'], **(layouts[layout] if layout is not None else {}), **(params or {})}
+
+def parse_rows(rows):
+    """Plate rows of a metadata entry, e.g 'A', 'A:B', 'A, C' or 'A-D' (all rows if empty)"""
+    rows=str(rows).upper() if rows is not None and not pd.isna(rows) else ''
+    rows=re.sub(r'([A-P])\s*-\s*([A-P])', lambda m: PLATE_ROWS[PLATE_ROWS.index(m.group(1)):PLATE_ROWS.index(m.group(2))+1], rows)
+    letters=[r for r in PLATE_ROWS if r in rows]
+    return letters if len(letters)>0 else list(PLATE_ROWS)
+
+def parse_columns(columns, n):
+    """Plate columns of a metadata entry as two digit strings, e.g '1-10' or '1, 3, 5' (columns 1 to n if empty)"""
+    columns=str(columns).strip() if columns is not None and not pd.isna(columns) else ''
+    if columns=='':
+        numbers=range(1, n+1)
+    else:
+        numbers=[]
+        for part in columns.split(','):
+            start, _, end=part.partition('-')
+            numbers.extend(range(int(float(start)), int(float(end or start))+1))
+    return [f'{c:02d}' for c in numbers]
+
+def sample_metadata(entries, params):
+    """Metadata of the samples of a plate from metadata entries, each a dictionary with 'rows', 'columns', 'compound', 'strain',
+    'concentrations' (comma separated list or highest concentration:dilution factor, along the columns) and 'unit', all optional.
+    Returns dataframe with one line per plate row and column, or None if there are no entries."""
+    log.info('Creating sample metadata')
+    frames=[]
+    for entry in entries:
+        text=lambda k: str(entry[k]).strip() if entry.get(k) is not None and not pd.isna(entry[k]) else ''
+        conc=text('concentrations')
+        if conc!='' and text('columns')=='':
+            n=len(conc.split(',')) if ',' in conc else int(params['col_num'])
+        else:
+            n=PLATE_COLUMNS
+        cols=parse_columns(entry.get('columns'), n)
+        values=GrowthAnalysis(params).concentration_values(conc, len(cols)) if conc!='' else [np.nan]*len(cols)
+        if len(values)<len(cols):
+            raise ValueError(f'{len(values)} concentrations given for {len(cols)} columns: {conc}')
+        rows=parse_rows(entry.get('rows'))
+
+        #One line per row and column of the entry
+        frames.append(pd.DataFrame({'row':np.repeat(rows, len(cols)), 'col':np.tile(cols, len(rows)),
+                                    'compound':text('compound') or None, 'strain':text('strain') or None,
+                                    'concentration':np.tile(np.asarray(values, dtype=np.float64), len(rows)), 'unit':text('unit') or None}))
+    if len(frames)==0:
+        return None
+
+    metadata=pd.concat(frames, ignore_index=True)
+    duplicated=metadata.duplicated(['row', 'col'])
+    if duplicated.any():
+        wells=', '.join((metadata['row']+metadata['col'])[duplicated].iloc[:5])
+        raise ValueError(f'Metadata is given more than once for {wells}')
+    return metadata
+
+def annotate_metrics(metrics, metadata):
+    """Join sample metadata into the metrics. Samples are matched by their first row letter and their column number,
+    so averaged samples (e.g AB01) get the metadata of their first well."""
+    log.info('Joining sample metadata into metrics')
+    if metadata is None:
+        return metrics
+    samples=metrics['sample'].astype(str)
+    keys=pd.DataFrame({'row':samples.str[0], 'col':samples.str[-2:]})
+    joined=keys.merge(metadata, on=['row', 'col'], how='left', validate='many_to_one')
+    #Metadata columns follow the sample name
+    metrics=metrics.drop(columns=[c for c in METADATA_COLUMNS if c in metrics.columns])
+    for i, c in enumerate(METADATA_COLUMNS):
+        metrics.insert(1+i, c, joined[c].to_numpy())
+    return metrics
+
+def load_manifest(path, layouts=None):
+    """Read batch manifest (JSON, or an experiment table, see load_experiment), returns the output folder (None if not given)
+    and the jobs of the batch pipeline (see BatchPipeline.run_jobs), with folders expanded into their plate exports"""
+    log.info(f'Loading manifest {path}')
+    layouts=load_layouts() if layouts is None else layouts
+    if path.lower().endswith(('.csv', '.xlsx')):
+        return None, load_experiment(path, layouts)
+
+    with open(path, 'r') as f:
+        manifest=json.load(f)
+    root=os.path.dirname(os.path.abspath(path))
+    resolve=lambda p: os.path.normpath(os.path.join(root, os.path.expanduser(p)))
+
+    default_layout=manifest.get('layout')
+    default_params=manifest.get('params', {})
+    jobs=[]
+    for entry in manifest.get('plates', []):
+        entry={'path':entry} if isinstance(entry, str) else entry
+        if not 'path' in entry:
+            raise ValueError(f'Manifest entry without path: {entry}')
+        layout=entry.get('layout', default_layout)
+        params=manifest_params(layouts, layout, {**default_params, **entry.get('params', {})})
+        metadata=sample_metadata(entry.get('samples', []), params)
+        for filename in plate_files([resolve(entry['path'])]):
+            jobs.append({'path':filename, 'layout':layout, 'params':params, 'sheet':entry.get('sheet'), 'metadata':metadata})
+
+    output=resolve(manifest['output']) if manifest.get('output') is not None else None
+    return output, jobs
+
+def load_experiment(path, layouts=None):
+    """Read experiment manifest: a table (.csv or .xlsx) with the columns 'file' (input file), and optionally 'sheet', 'layout'
+    (from default_layouts.txt), 'rows', 'columns', 'compound', 'strain', 'concentrations' and 'unit' (see sample_metadata).
+    Several lines of the same file describe different rows of the plate, the layout is taken from the first line that gives one.
+    Other columns named like layout parameters (e.g 'lag_calc_input') override these. Returns the jobs of the batch pipeline."""
+    log.info(f'Loading experiment manifest {path}')
+    layouts=load_layouts() if layouts is None else layouts
+    table=pd.read_excel(path, dtype=str) if path.lower().endswith('.xlsx') else pd.read_csv(path, dtype=str, sep=None, engine='python')
+    table.columns=[str(c).strip().lower() for c in table.columns]
+    if not 'file' in table.columns:
+        raise ValueError(f'Experiment manifest {path} has no file column')
+    unknown=[c for c in table.columns if not c in EXPERIMENT_COLUMNS and not c in layouts['Custom']]
+    if len(unknown)>0:
+        raise ValueError(f'Unknown columns in experiment manifest {path}: {", ".join(unknown)}')
+    root=os.path.dirname(os.path.abspath(path))
+    table['file']=table['file'].str.strip()
+    table=table[table['file'].notna() & (table['file']!='')]
+    if not 'sheet' in table.columns:
+        table['sheet']=None
+
+    jobs=[]
+    for (filename, sheet), lines in table.groupby(['file', 'sheet'], sort=False, dropna=False):
+        first=lambda c: lines[c].dropna().iloc[0] if c in lines.columns and lines[c].notna().any() else None
+        layout=first('layout')
+        #Table cells are read as text, flags (e.g 'avg', 'smoothen') are integers in the layouts
+        params={c:int(float(first(c))) if isinstance(layouts['Custom'][c], int) else first(c)
+                for c in lines.columns if c in layouts['Custom'] and first(c) is not None}
+        params=manifest_params(layouts, layout, params)
+        metadata=sample_metadata(lines.to_dict('records'), params)
+        for f in plate_files([os.path.normpath(os.path.join(root, os.path.expanduser(filename)))]):
+            jobs.append({'path':f, 'layout':layout, 'params':params, 'sheet':None if pd.isna(sheet) else sheet, 'metadata':metadata})
+    return jobs
@@ -0,0 +1,425 @@
+import os
+import re
+import json
+import time
+import hashlib
+import queue
+import threading
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import logging as log
+from analysis import GrowthAnalysis, PLATE_DTYPE, RESULT_NAMES, result_filename, export_results, analysed_curves, control_references, control_normalization
+from ingest import plate_files, file_names, plate_ids, read_plates
+from plate import Plate
+from session import save_session, load_session
+from watcher import file_hash
+from manifest import annotate_metrics
+from kernels import curve_clusters
+
+#Batch analysis as a pipeline of stages connected by bounded queues. Each stage has its own pool of workers,
+#so reading, computing and writing of different plates overlap, and a slow stage holds back the stages before it
+#(instead of filling memory with parsed plates) once the queue in front of it is full.
+STAGES=('load', 'preprocess', 'smooth', 'metrics', 'export')
+
+#Default number of workers and pool type per stage: parsing, smoothing (GAM), metrics and excel output are CPU-bound
+#Python code and run in worker processes
+STAGE_WORKERS={'load':2, 'preprocess':1, 'smooth':2, 'metrics':1, 'export':2}
+STAGE_POOLS={'load':'process', 'preprocess':'process', 'smooth':'process', 'metrics':'process', 'export':'process'}
+
+#Marks the end of the input of a stage
+DONE=None
+
+#Intermediate results of the preprocess and smooth stages that are checkpointed as dataframes
+STATE_FRAMES=('df_raw', 'outliers', 'edge_correction', 'normalization', 'phases', 'phase_metrics')
+DERIVATIVES=('smooth', 'derivative', 'log_derivative')
+
+def checkpoint_key(path, params, sheet=None, metadata=None, name=None):
+    """Key of the checkpoints of an input file, from its path, the hash of its content, the parameters, the selected sheet,
+    the sample metadata and the name of its plate IDs (if not the file name), so that modified files or changed parameters
+    are analysed again"""
+    h=hashlib.sha256(os.path.abspath(path).encode())
+    h.update(file_hash(path).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(str(sheet).encode())
+    if metadata is not None:
+        h.update(metadata.to_json().encode())
+    if name is not None:
+        h.update(name.encode())
+    return h.hexdigest()[:24]
+
+def checkpoint_data(item, stage):
+    """Dataframes and JSON serializable state of an item after a stage, in the format of session files"""
+    if stage=='load':
+        return {'df':item['df']}, {'stage':stage}
+    if stage in ('preprocess', 'smooth'):
+        state=item['state']
+        analysis=item['analysis']
+        frames={k:state[k] for k in STATE_FRAMES}
+        frames['plate']=state['plate'].to_frame()
+        frames['smoothed']=state['smoothed'].to_frame() if state['smoothed'] is not None else None
+        frames.update({k:state['derivatives'][k].to_frame() for k in DERIVATIVES})
+        return frames, {'stage':stage, 'std_dict':state['std_dict'], 'std_calculated':analysis.std_calculated,
+                        'reps_in_rows':analysis.reps_in_rows, 'reps_in_cols':analysis.reps_in_cols}
+    results=item['results']
+    frames={k:v for k, v in results.items() if isinstance(v, pd.DataFrame)}
+    return frames, {'stage':stage, 'results':{k:v for k, v in results.items() if not k in frames}, 'output':item.get('output')}
+
+def restore_item(job, plate, key, frames, state):
+    """Rebuild pipeline item of a plate from its checkpoint"""
+    stage=state['stage']
+    item={**job, 'plate':plate, 'key':key, 'completed':STAGES.index(stage)}
+    if stage=='load':
+        item['df']=frames['df']
+    elif stage in ('preprocess', 'smooth'):
+        analysis=GrowthAnalysis(job['params'])
+        analysis.std_calculated=state['std_calculated']
+        analysis.reps_in_rows=state['reps_in_rows']
+        analysis.reps_in_cols=state['reps_in_cols']
+        to_plate=lambda df: Plate.from_frame(df, dtype=PLATE_DTYPE) if df is not None else None
+        item['analysis']=analysis
+        item['state']={**{k:frames[k] for k in STATE_FRAMES}, 'plate':to_plate(frames['plate']), 'smoothed':to_plate(frames['smoothed']),
+                       'derivatives':{k:to_plate(frames[k]) for k in DERIVATIVES}, 'std_dict':state['std_dict']}
+    else:
+        item['results']={k:frames[k] if k in frames else state['results'][k] for k in RESULT_NAMES}
+        item['output']=state['output']
+    return item
+
+def save_checkpoint(item, stage):
+    """Write checkpoint of an item after a stage, replacing the checkpoint of the previous stage"""
+    path=os.path.join(item['checkpoints'], f'{item["key"]}.bgca')
+    frames, state=checkpoint_data(item, stage)
+    #Written to a temporary file first, so an interrupted write does not leave a corrupt checkpoint
+    save_session(path+'.tmp', frames, state)
+    os.replace(path+'.tmp', path)
+
+def load_stage(job):
+    """Read all plates of an input file, returns one item per plate. If the file has been (partly) analysed before
+    with the same parameters, the plates are restored from their checkpoints, and only plates without checkpoint are read."""
+    restored={}
+    if job.get('checkpoints') is not None:
+        job={**job, 'file_key':checkpoint_key(job['path'], job['params'], job.get('sheet'), job.get('metadata'), job.get('name'))}
+        index=os.path.join(job['checkpoints'], f'{job["file_key"]}.json')
+        if os.path.isfile(index):
+            with open(index, 'r') as f:
+                ids=json.load(f)['plates']
+            for i, plate_id in enumerate(ids):
+                path=os.path.join(job['checkpoints'], f'{job["file_key"]}-{i}.bgca')
+                if os.path.isfile(path):
+                    frames, state=load_session(path)
+                    restored[i]=restore_item(job, plate_id, f'{job["file_key"]}-{i}', frames, state)
+            if len(restored)==len(ids):
+                return [restored[i] for i in range(len(ids))]
+
+    plates=read_plates(job['path'])
+    if job.get('sheet') is not None:
+        plates=[(sheet, df) for sheet, df in plates if sheet==str(job['sheet'])]
+    if len(plates)==0:
+        raise ValueError(f'No plate found in {job["path"]}')
+    ids=plate_ids(job['path'], [sheet for sheet, df in plates], job.get('name'))
+    return [restored.get(i, {**job, 'plate':plate_id, 'key':f'{job.get("file_key")}-{i}', 'plates':ids, 'completed':-1, 'df':df})
+            for i, (plate_id, (sheet, df)) in enumerate(zip(ids, plates))]
+
+def preprocess_stage(item):
+    """Preprocess plate (see GrowthAnalysis.preprocess)"""
+    analysis=GrowthAnalysis(item['params'])
+    state=analysis.preprocess(item.pop('df'))
+    return {**item, 'analysis':analysis, 'state':state}
+
+def smooth_stage(item):
+    """Smooth curves (see GrowthAnalysis.smoothen)"""
+    item['state']=item['analysis'].smoothen(item['state'])
+    return item
+
+def metrics_stage(item):
+    """Calculate metrics and statistics (see GrowthAnalysis.evaluate), joining the sample metadata of the manifest into the metrics"""
+    results=dict(zip(RESULT_NAMES, item.pop('analysis').evaluate(item.pop('state'))))
+    results['metrics']=annotate_metrics(results['metrics'], item.get('metadata'))
+    return {**item, 'results':results}
+
+def export_stage(item):
+    """Write results of a plate to excel"""
+    if item['outdir'] is not None:
+        name=re.sub(r'[\\/:*?"<>|]', '_', item['plate'])
+        item['output']=result_filename(os.path.join(item['outdir'], name), item['params'])
+        export_results(item['output'], item['results'], item['params'])
+    item['exported']=True
+    return item
+
+STAGE_FUNCTIONS={'load':load_stage, 'preprocess':preprocess_stage, 'smooth':smooth_stage, 'metrics':metrics_stage, 'export':export_stage}
+
+def timed(name, item):
+    """Run stage function in a worker, returns result and the time spent in the function. If the batch is checkpointed,
+    the plates are checkpointed after the stage, in the worker."""
+    start=time.perf_counter()
+    result=STAGE_FUNCTIONS[name](item)
+    if item.get('checkpoints') is not None:
+        fresh=[r for r in (result if name=='load' else [result]) if r['completed']<STAGES.index(name)]
+        if name=='load' and len(fresh)>0:
+            with open(os.path.join(item['checkpoints'], f'{fresh[0]["file_key"]}.json'), 'w') as f:
+                json.dump({'path':item['path'], 'plates':fresh[0]['plates']}, f)
+        for r in fresh:
+            save_checkpoint(r, name)
+            r['completed']=STAGES.index(name)
+    return result, time.perf_counter()-start
+
+
+def batch_normalized(item):
+    """Check whether a plate is normalized together with the other plates of the batch: plates with shared control wells
+    but without control reference level"""
+    params=item['params']
+    return params.get('control_wells', '')!='' and params.get('control_reference', '')==''
+
+def normalize_batch(items, references=None):
+    """Normalize preprocessed plates with the same shared control wells to the control level of the batch, in one batched
+    operation (see analysis.control_normalization). Without reference levels of the control wells, the references are
+    the control levels of the plates (see analysis.control_references). Returns the plates and the references."""
+    log.info(f'Normalizing {len(items)} plates of batch to shared control wells')
+    dfs=[item['state']['plate'].to_frame() for item in items]
+    controls=items[0]['analysis'].control_samples()
+    if references is None:
+        references=control_references(dfs, controls)
+    normalization=control_normalization(dfs, controls, references)
+    for item, factor, reference in zip(items, normalization['factor'], normalization['reference']):
+        item['state']=item['analysis'].apply_normalization(item['state'], float(factor), float(reference))
+    return items, references
+
+
+def combined_metrics(results):
+    """Metrics of all plates of a batch in one dataframe, with the plate ID as first column"""
+    log.info('Combining metrics of batch')
+    if len(results)==0:
+        return pd.DataFrame(columns=['plate', 'sample'])
+    combined=pd.concat([r['metrics'] for r in results.values()], keys=list(results), names=['plate', None])
+    return combined.reset_index(level=0).reset_index(drop=True)
+
+def batch_clusters(results, clusters, dims=3):
+    """Cluster the curves of all plates of a batch together by shape (see kernels.curve_clusters), using the smoothened
+    curves if available and the processed curves otherwise"""
+    log.info('Clustering curves of batch')
+    frames=[(plate_id, analysed_curves(r)) for plate_id, r in results.items()]
+    return curve_clusters(frames, clusters, dims)
+
+
+class Stage:
+    """Pipeline stage: a pool of workers (processes or threads), fed by one dispatcher thread per worker which takes
+    items from the input queue and puts the results into the (bounded) output queue. Keeps track of the time the
+    workers are busy, and of the time the dispatchers wait for input (starved) or for space in the output queue (blocked)."""
+    def __init__(self, name, workers=1, pool='thread'):
+        self.name=name
+        self.index=STAGES.index(name)
+        self.workers=workers
+        self.pool=pool
+        self.executor=None
+        self.lock=threading.Lock()
+        self.items=0
+        self.busy=0.0
+        self.starved=0.0
+        self.blocked=0.0
+        self.resumed=0
+        self.running=0
+
+    def start(self, inbox, outbox, failures):
+        """Start workers and dispatcher threads, returns the dispatcher threads"""
+        log.info(f'Starting pipeline stage {self.name} ({self.workers} {self.pool} workers)')
+        self.items=0
+        self.busy=0.0
+        self.starved=0.0
+        self.blocked=0.0
+        self.resumed=0
+        if self.pool=='process':
+            self.executor=concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self.running=self.workers
+        threads=[threading.Thread(target=self.dispatch, args=(inbox, outbox, failures), daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, item):
+        """Process one item, in a worker process or in the dispatcher thread"""
+        if self.executor is not None:
+            return self.executor.submit(timed, self.name, item).result()
+        return timed(self.name, item)
+
+    def dispatch(self, inbox, outbox, failures):
+        """Move items from the input queue through the stage to the output queue, until the end of the input"""
+        while True:
+            start=time.perf_counter()
+            item=inbox.get()
+            waited=time.perf_counter()-start
+            if item is DONE:
+                #Let the other dispatchers of this stage see the end of the input as well, the last one passes it on
+                inbox.put(DONE)
+                with self.lock:
+                    self.running-=1
+                    last=self.running==0
+                if last:
+                    if self.executor is not None:
+                        self.executor.shutdown()
+                    outbox.put(DONE)
+                return
+
+            #Plates restored from checkpoints skip the stages they have completed
+            if item.get('completed', -1)>=self.index:
+                outbox.put(item)
+                with self.lock:
+                    self.resumed+=1
+                    self.starved+=waited
+                continue
+
+            try:
+                result, seconds=self.run(item)
+            except Exception as e:
+                #Errors only drop the affected plate, which keeps the checkpoint of its last completed stage
+                plate=item.get('plate', item.get('path'))
+                log.error(f'Stage {self.name} failed for {plate}: {e!r}')
+                failures.append({'plate':plate, 'path':item.get('path'), 'stage':self.name, 'error':repr(e)})
+                with self.lock:
+                    self.starved+=waited
+                continue
+
+            start=time.perf_counter()
+            for r in (result if self.name=='load' else [result]):
+                outbox.put(r)
+            with self.lock:
+                self.items+=1
+                self.busy+=seconds
+                self.starved+=waited
+                self.blocked+=time.perf_counter()-start
+
+    def report(self, elapsed):
+        """Number of processed items and time spent per stage - utilization is the fraction of the workers' time
+        spent processing items"""
+        return {'stage':self.name, 'workers':self.workers, 'pool':self.pool, 'items':self.items, 'resumed':self.resumed, 'busy_seconds':round(self.busy, 2),
+                'utilization':round(self.busy/(self.workers*elapsed), 3) if elapsed>0 else 0.0,
+                'starved_seconds':round(self.starved, 2), 'blocked_seconds':round(self.blocked, 2)}
+
+
+class BatchPipeline:
+    """Analyse a batch of plate exports in a pipeline of load, preprocess, smooth, metrics and export stages
+    with bounded queues of queue_size items between them. workers and pools override the number of workers
+    and the pool type ('process' or 'thread') of single stages, e.g workers={'smooth':4}. If a results store
+    is given, the runs are recorded in it as the plates leave the pipeline.
+    With a checkpoints folder, every plate is checkpointed after each stage, and running the same batch again
+    resumes it: finished plates are not analysed again, interrupted or failed plates continue after their last
+    completed stage.
+    Plates with shared control wells but without control reference level are normalized to the control level of the
+    batch, so they are held back after the preprocess stage until all plates are preprocessed. The reference levels
+    of the batch are checkpointed, so that resumed plates are normalized to the same levels as the finished ones."""
+    def __init__(self, outdir=None, workers=None, pools=None, queue_size=4, store=None, checkpoints=None):
+        log.info('Initializing batch pipeline')
+        self.outdir=outdir
+        self.store=store
+        self.queue_size=queue_size
+        self.checkpoints=checkpoints
+        workers={**STAGE_WORKERS, **(workers or {})}
+        pools={**STAGE_POOLS, **(pools or {})}
+        self.stages=[Stage(name, workers[name], pools[name]) for name in STAGES]
+        for folder in (outdir, checkpoints):
+            if folder is not None:
+                os.makedirs(folder, exist_ok=True)
+
+    def normalize(self, inbox, outbox, failures):
+        """Pass preprocessed plates on to the smooth stage. Plates normalized with the batch (see batch_normalized) are
+        held back until all plates are preprocessed, and then normalized together per set of shared control wells.
+        If other plates of the same control wells were normalized in a previous run (resumed after the preprocess stage),
+        the held plates are normalized to the checkpointed reference levels of that run."""
+        held={}
+        resumed=set()
+        while True:
+            item=inbox.get()
+            if item is DONE:
+                break
+            if batch_normalized(item) and item.get('completed', -1)<STAGES.index('smooth'):
+                held.setdefault(item['params']['control_wells'], []).append(item)
+            else:
+                if batch_normalized(item):
+                    resumed.add(item['params']['control_wells'])
+                outbox.put(item)
+
+        path=os.path.join(self.checkpoints, 'normalization.json') if self.checkpoints is not None else None
+        saved={}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as f:
+                saved=json.load(f)
+        for control_wells, items in held.items():
+            references=np.asarray(saved[control_wells], dtype=np.float64) if control_wells in resumed and control_wells in saved else None
+            if control_wells in resumed and references is None:
+                log.warning(f'No checkpointed reference levels for control wells {control_wells}, normalizing {len(items)} resumed plates on their own')
+            try:
+                items, references=normalize_batch(items, references)
+            except Exception as e:
+                log.error(f'Batch normalization failed for control wells {control_wells}: {e!r}')
+                failures.extend({'plate':item['plate'], 'path':item['path'], 'stage':'preprocess', 'error':repr(e)} for item in items)
+                continue
+            #The references are saved before the plates are checkpointed after the smooth stage
+            if path is not None:
+                saved[control_wells]=[float(r) if np.isfinite(r) else None for r in references]
+                with open(path+'.tmp', 'w') as f:
+                    json.dump(saved, f, indent=1)
+                os.replace(path+'.tmp', path)
+            for item in items:
+                outbox.put(item)
+        outbox.put(DONE)
+
+    def run(self, paths, params, layout=None):
+        """Analyse all plates of the input files and folders with the same layout parameters (layout is the name recorded in the store),
+        see run_jobs"""
+        files=plate_files([paths] if isinstance(paths, str) else paths)
+        return self.run_jobs([{'path':path, 'params':params, 'layout':layout} for path in files])
+
+    def run_jobs(self, jobs):
+        """Analyse input files, each job is a dictionary with 'path', 'params', 'layout' (name recorded in the store)
+        and optionally 'sheet' (analyse only this sheet of a workbook). Files with the same name in different folders,
+        or listed several times, get unique plate IDs (see ingest.file_names).
+        Returns results per plate (plate ID: dictionary with RESULT_NAMES, 'path' and 'output'),
+        failures (dataframe with plate, path, stage and error) and the utilization of the stages (dataframe)."""
+        log.info(f'Running batch pipeline on {len(jobs)} files')
+        failures=[]
+        #The input queue holds all files, the queues between the stages are bounded
+        queues=[queue.Queue()]+[queue.Queue(maxsize=self.queue_size) for stage in self.stages]
+        for job, name in zip(jobs, file_names([job['path'] for job in jobs])):
+            #Only renamed files get a name, so that the checkpoints of the other files stay valid
+            if name!=os.path.splitext(os.path.basename(job['path']))[0]:
+                job={**job, 'name':name}
+            queues[0].put({**job, 'outdir':self.outdir, 'checkpoints':self.checkpoints})
+        queues[0].put(DONE)
+
+        #Preprocessed plates pass the batch normalization on their way to the smooth stage
+        outboxes=queues[1:]
+        i=STAGES.index('preprocess')
+        outboxes[i]=queue.Queue(maxsize=self.queue_size)
+
+        start=time.perf_counter()
+        threads=[]
+        for stage, inbox, outbox in zip(self.stages, queues[:-1], outboxes):
+            threads.extend(stage.start(inbox, outbox, failures))
+        threads.append(threading.Thread(target=self.normalize, args=(outboxes[i], queues[i+1], failures), daemon=True))
+        threads[-1].start()
+
+        results={}
+        while True:
+            item=queues[-1].get()
+            if item is DONE:
+                break
+            if item['plate'] in results:
+                log.error(f'Duplicate plate ID {item["plate"]} of {item["path"]}')
+                failures.append({'plate':item['plate'], 'path':item['path'], 'stage':'export', 'error':'duplicate plate ID'})
+                continue
+            results[item['plate']]={**item['results'], 'path':item['path'], 'output':item.get('output')}
+            #Plates that were finished in a previous run have been recorded before
+            if self.store is not None and item.get('exported', False):
+                r=item['results']
+                self.store.add_run(item['plate'], r['metrics'], params=item['params'], filename=item['path'], layout=item.get('layout'),
+                                   std_dict=r['std_dict'], lowecs=r['lowecs'], noecs=r['noecs'], mics=r['mics'],
+                                   conc_dict=r['conc_dict'], normalization=r['normalization'], curves=analysed_curves(r))
+        for thread in threads:
+            thread.join()
+        elapsed=time.perf_counter()-start
+
+        utilization=pd.DataFrame([stage.report(elapsed) for stage in self.stages])
+        failures=pd.DataFrame(failures, columns=['plate', 'path', 'stage', 'error'])
+        if self.checkpoints is not None:
+            failures.to_json(os.path.join(self.checkpoints, 'failures.json'), orient='records', indent=1)
+        log.info(f'Batch pipeline finished: {len(results)} plates in {elapsed:.1f} s, {len(failures)} failures')
+        return results, failures, utilization
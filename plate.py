@@ -0,0 +1,126 @@
+import re
+import numpy as np
+import pandas as pd
+import logging as log
+
+#Well names are a row letter followed by a two digit column number, e.g A01
+WELL=re.compile(r'([A-Z])(\d{2})')
+
+def well_positions(names):
+    """Get 0-based row and column index of well names, -1 for names that are not wells"""
+    rows=np.full(len(names), -1, dtype=np.int64)
+    cols=np.full(len(names), -1, dtype=np.int64)
+    for i, name in enumerate(names):
+        match=WELL.fullmatch(name.strip())
+        if match is not None:
+            rows[i]=ord(match.group(1))-ord('A')
+            cols[i]=int(match.group(2))-1
+    return rows, cols
+
+def row_mask(letters):
+    """Get bit mask of plate rows given as letters (e.g 'AB' or ['A', 'B']), bit r set for row r"""
+    return sum(1<<(ord(l)-ord('A')) for l in {l.strip() for l in letters if l.strip()!=''})
+
+def row_label(mask):
+    """Get row letters of a bit mask of plate rows, e.g 'AB' - the row part of sample names"""
+    return ''.join(chr(ord('A')+r) for r in range(int(mask).bit_length()) if int(mask)>>r & 1)
+
+def column_label(col):
+    """Get two digit column number of a 0-based column index, e.g '01' - the column part of sample names"""
+    return f'{int(col)+1:02d}'
+
+
+class Plate:
+    """Curves of one plate: a contiguous (samples, timepoints) values array, the time vector, integer row, column and
+    replicate group index of every sample and metadata. Sample names are only kept to convert from and to dataframes,
+    the analysis stages work on the index arrays. For averaged samples, rows and cols are the position of their first
+    well, the mean position of their wells is kept in meta ('row_pos', 'col_pos') and the rows they cover in meta
+    ('row_sets', see row_sets)."""
+    __slots__=('values', 'time', 'names', 'rows', 'cols', 'groups', 'meta')
+
+    def __init__(self, values, time, names, rows=None, cols=None, groups=None, meta=None, dtype=np.float32):
+        self.values=np.ascontiguousarray(values, dtype=dtype)
+        self.time=np.asarray(time, dtype=np.float64)
+        self.names=np.asarray(names, dtype=object)
+        if rows is None or cols is None:
+            rows, cols=well_positions(self.names)
+        self.rows=np.asarray(rows, dtype=np.int64)
+        self.cols=np.asarray(cols, dtype=np.int64)
+        self.groups=np.full(len(self.names), -1, dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        self.meta={} if meta is None else meta
+
+    @classmethod
+    def from_frame(cls, df, dtype=np.float32):
+        """Create plate from dataframe with time column ('Hour') followed by one column per sample"""
+        log.info('Converting dataframe to plate')
+        names=[str(c).strip() for c in df.columns[1:]]
+        return cls(df.iloc[:, 1:].to_numpy(dtype=dtype).T, df.iloc[:, 0].to_numpy(dtype=np.float64), names, dtype=dtype)
+
+    def to_frame(self, values=None):
+        """Convert plate (or other values of the same samples, e.g. derivatives) to dataframe with 'Hour' column"""
+        values=self.values if values is None else values
+        df=pd.DataFrame(np.asarray(values, dtype=np.float64).T, columns=list(self.names))
+        df.insert(0, 'Hour', self.time)
+        return df
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def index(self, names):
+        """Get sample indices of names, KeyError for names that are not on the plate"""
+        lookup=self.meta.get('lookup')
+        if lookup is None or len(lookup)!=len(self.names):
+            lookup={n:i for i, n in enumerate(self.names)}
+            self.meta['lookup']=lookup
+        return np.array([lookup[n] for n in names], dtype=np.int64)
+
+    def positions(self):
+        """Get (mean) row and column position of all samples as float arrays, NaN for samples without position"""
+        row_pos=self.meta.get('row_pos', np.where(self.rows>=0, self.rows, np.nan).astype(np.float64))
+        col_pos=self.meta.get('col_pos', np.where(self.cols>=0, self.cols, np.nan).astype(np.float64))
+        return row_pos, col_pos
+
+    def row_sets(self):
+        """Get the plate rows covered by every sample as bit mask (see row_mask), 0 for samples without position.
+        Samples of the same replicate rows (e.g all 'AB' samples averaged from rows A and B) share their row set."""
+        rows=np.maximum(self.rows, 0)
+        return self.meta.get('row_sets', np.where(self.rows>=0, np.left_shift(1, rows), 0).astype(np.int64))
+
+    def with_values(self, values):
+        """Plate with the same samples and other values (e.g. smoothed curves)"""
+        meta={k:v for k, v in self.meta.items() if k!='lookup'}
+        return Plate(values, self.time, self.names, self.rows, self.cols, self.groups, meta, dtype=self.dtype)
+
+    def take(self, idx):
+        """Plate with a subset of samples, in the given order"""
+        idx=np.asarray(idx, dtype=np.int64)
+        meta={k:(v[idx] if k in ('row_pos', 'col_pos', 'row_sets') else v) for k, v in self.meta.items() if k!='lookup'}
+        return Plate(self.values[idx], self.time, self.names[idx], self.rows[idx], self.cols[idx], self.groups[idx], meta, dtype=self.dtype)
+
+    def average(self, members, names):
+        """Average groups of samples (list of index arrays) into new samples, skipping missing values like the
+        dataframe mean. All groups are reduced at once from one gathered array."""
+        counts=np.array([len(m) for m in members], dtype=np.int64)
+        idx=np.concatenate([np.asarray(m, dtype=np.int64) for m in members]) if len(members)>0 else np.zeros(0, dtype=np.int64)
+        starts=np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        gathered=self.values[idx].astype(np.float64)
+        valid=np.isfinite(gathered)
+        if idx.size>0:
+            sums=np.add.reduceat(np.where(valid, gathered, 0.0), starts, axis=0)
+            n=np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+        else:
+            sums=n=np.zeros((0, self.time.size))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values=np.where(n>0, sums/np.maximum(n, 1), np.nan)
+
+        #Position of the first well, mean position of all wells
+        first=idx[starts] if idx.size>0 else idx
+        row_pos, col_pos=self.positions()
+        meta={'row_pos':np.add.reduceat(row_pos[idx], starts)/counts if idx.size>0 else np.zeros(0),
+              'col_pos':np.add.reduceat(col_pos[idx], starts)/counts if idx.size>0 else np.zeros(0),
+              'row_sets':np.bitwise_or.reduceat(self.row_sets()[idx], starts) if idx.size>0 else np.zeros(0, dtype=np.int64)}
+        return Plate(values, self.time, names, self.rows[first], self.cols[first], np.arange(len(members)), meta, dtype=self.dtype)
@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+import logging as log
+from kernels import curve_vectors
+
+#Metrics are stored in long format (one row per sample and metric), so that metrics added to
+#calculate_metrics later on do not require changes to the database schema
+SCHEMA="""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    plate TEXT NOT NULL,
+    filename TEXT,
+    layout TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    plate TEXT NOT NULL,
+    well TEXT NOT NULL,
+    row TEXT,
+    col TEXT,
+    compound TEXT,
+    strain TEXT,
+    concentration REAL,
+    unit TEXT,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE TABLE IF NOT EXISTS replicate_stats (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    plate TEXT NOT NULL,
+    replicate_group TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE TABLE IF NOT EXISTS ecotox (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    plate TEXT NOT NULL,
+    call TEXT NOT NULL,
+    row TEXT,
+    well TEXT,
+    compound TEXT,
+    concentration REAL,
+    unit TEXT
+);
+CREATE TABLE IF NOT EXISTS normalization (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    plate TEXT NOT NULL,
+    control_wells TEXT,
+    control_level REAL,
+    reference REAL,
+    factor REAL
+);
+CREATE TABLE IF NOT EXISTS curves (
+    curve_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    plate TEXT NOT NULL,
+    well TEXT NOT NULL,
+    start_hour REAL,
+    end_hour REAL,
+    vector BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_files (
+    file_hash TEXT PRIMARY KEY,
+    filename TEXT,
+    status TEXT NOT NULL,
+    date TEXT NOT NULL,
+    run_id INTEGER,
+    output TEXT,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_date ON runs(date);
+CREATE INDEX IF NOT EXISTS idx_runs_plate ON runs(plate);
+CREATE INDEX IF NOT EXISTS idx_metrics_run ON metrics(run_id);
+CREATE INDEX IF NOT EXISTS idx_metrics_plate ON metrics(plate, well);
+CREATE INDEX IF NOT EXISTS idx_metrics_well ON metrics(well);
+CREATE INDEX IF NOT EXISTS idx_metrics_compound ON metrics(compound, concentration);
+CREATE INDEX IF NOT EXISTS idx_metrics_concentration ON metrics(concentration);
+CREATE INDEX IF NOT EXISTS idx_metrics_metric ON metrics(metric);
+CREATE INDEX IF NOT EXISTS idx_replicate_stats_run ON replicate_stats(run_id);
+CREATE INDEX IF NOT EXISTS idx_ecotox_run ON ecotox(run_id);
+CREATE INDEX IF NOT EXISTS idx_normalization_run ON normalization(run_id);
+CREATE INDEX IF NOT EXISTS idx_curves_run ON curves(run_id);
+CREATE INDEX IF NOT EXISTS idx_ecotox_compound ON ecotox(compound, concentration);
+"""
+
+#Sample metadata columns that experiment manifests join into the metrics (see manifest.annotate_metrics)
+METADATA_COLUMNS=['compound', 'strain', 'concentration', 'unit']
+
+def split_concentration(conc):
+    """Split a concentration string as created by match_concentrations (e.g '0.75mg/l') into value and unit"""
+    if conc is None:
+        return None, None
+    match=re.match(r'\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*(.*)', str(conc))
+    if match is None:
+        return None, str(conc)
+    return float(match.group(1)), match.group(2).strip() or None
+
+
+class ResultsStore:
+    """Local SQLite database collecting layouts, parameters, metrics, replicate statistics and
+    LOEC/NOEC/MIC calls of all analysis runs, for queries across experiments"""
+    def __init__(self, path='bgca_results.db'):
+        log.info('Opening results store')
+        self.path=os.path.abspath(path)
+        with self.connect() as con:
+            con.executescript(SCHEMA)
+        con.close()
+
+    def connect(self):
+        """Open a new connection - one per operation, so the store can be shared between threads"""
+        con=sqlite3.connect(self.path, timeout=30)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA foreign_keys=ON')
+        return con
+
+    def add_run(self, plate, metrics, params=None, filename=None, layout=None, std_dict=None,
+                lowecs=None, noecs=None, mics=None, conc_dict=None, compounds=None, strains=None, date=None, normalization=None,
+                curves=None):
+        """Record one analysis run. All rows of a run are bulk inserted in a single transaction.
+        compounds and strains optionally map sample rows (sample name without column number) to names.
+        normalization is the control well normalization table returned by the analysis. curves (dataframe with 'Hour'
+        column followed by one column per sample) are stored as normalized vectors for similarity searches (see similarity.py)."""
+        log.info(f'Recording run for plate {plate} in results store')
+        date=date or datetime.datetime.now().isoformat(timespec='seconds')
+        conc_dict=conc_dict or {}
+        compounds=compounds or {}
+        strains=strains or {}
+
+        #Collect metric rows in long format. Sample metadata in the metrics takes precedence over compounds, strains and conc_dict.
+        meta_cols=[c for c in METADATA_COLUMNS if c in metrics.columns]
+        metric_cols=[c for c in metrics.columns if not c=='sample' and not c in meta_cols]
+        long_df=metrics.melt(id_vars=['sample', *meta_cols], value_vars=metric_cols, var_name='metric', value_name='value')
+        long_df['value']=pd.to_numeric(long_df['value'], errors='coerce')
+        metric_rows=[]
+        for sample, *meta, metric, value in long_df.itertuples(index=False):
+            meta={k:v for k, v in zip(meta_cols, meta) if not pd.isna(v)}
+            conc, unit=split_concentration(conc_dict.get(sample[-2:]))
+            if 'concentration' in meta:
+                conc, unit=float(meta['concentration']), meta.get('unit')
+            metric_rows.append((plate, sample, sample[:-2], sample[-2:], meta.get('compound', compounds.get(sample[:-2])),
+                                meta.get('strain', strains.get(sample[:-2])), conc, unit, metric, None if pd.isna(value) else float(value)))
+
+        #Replicate standard deviations, as returned by get_replicate_variance
+        std_rows=[]
+        if std_dict is not None:
+            for k, values in std_dict.items():
+                if k=='Replicate group':
+                    continue
+                std_rows.extend((plate, g, k, float(v)) for g, v in zip(std_dict['Replicate group'], values))
+
+        #LOEC/NOEC calls are sample names, MICs are column numbers per row
+        ecotox_rows=[]
+        for call, samples in (('LOEC', lowecs), ('NOEC', noecs)):
+            for x in samples or []:
+                if x=='None':
+                    continue
+                conc, unit=split_concentration(conc_dict.get(x[-2:]))
+                ecotox_rows.append((plate, call, x[:-2], x, compounds.get(x[:-2]), conc, unit))
+        if mics is not None:
+            for r, m in zip(mics['rows'], mics['MICs']):
+                if m=='None':
+                    continue
+                conc, unit=split_concentration(conc_dict.get(m))
+                ecotox_rows.append((plate, 'MIC', r, r+m, compounds.get(r), conc, unit))
+
+        #Control levels and normalization factors
+        norm_rows=[]
+        if normalization is not None:
+            for r in normalization.itertuples(index=False):
+                norm_rows.append((plate, r.control_wells, float(r.control_level) if pd.notna(r.control_level) else None,
+                                  float(r.reference) if pd.notna(r.reference) else None, float(r.factor)))
+
+        #Normalized curve vectors, stored as float32
+        curve_rows=[]
+        if curves is not None:
+            t=curves['Hour'].to_numpy(dtype=np.float64)
+            samples=[c for c in curves.columns if not c=='Hour']
+            vectors=curve_vectors(t, curves[samples].to_numpy(dtype=np.float64).T).astype(np.float32)
+            valid=np.isfinite(vectors).all(axis=1)
+            curve_rows=[(plate, str(c), float(np.nanmin(t)), float(np.nanmax(t)), v.tobytes())
+                        for c, v, ok in zip(samples, vectors, valid) if ok]
+
+        with self.connect() as con:
+            cur=con.execute('INSERT INTO runs (date, plate, filename, layout, params) VALUES (?, ?, ?, ?, ?)',
+                            (date, plate, filename, layout, json.dumps(params) if params is not None else None))
+            run_id=cur.lastrowid
+            con.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(run_id, *r) for r in metric_rows])
+            con.executemany('INSERT INTO replicate_stats VALUES (?, ?, ?, ?, ?)', [(run_id, *r) for r in std_rows])
+            con.executemany('INSERT INTO ecotox VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(run_id, *r) for r in ecotox_rows])
+            con.executemany('INSERT INTO normalization VALUES (?, ?, ?, ?, ?, ?)', [(run_id, *r) for r in norm_rows])
+            con.executemany('INSERT INTO curves (run_id, plate, well, start_hour, end_hour, vector) VALUES (?, ?, ?, ?, ?, ?)',
+                            [(run_id, *r) for r in curve_rows])
+        con.close()
+
+        return run_id
+
+    def mark_processed(self, file_hash, filename, status, run_id=None, output=None, message=None):
+        """Remember that an input file (identified by the hash of its content) has been processed"""
+        log.info(f'Marking {filename} as {status}')
+        with self.connect() as con:
+            con.execute('INSERT OR REPLACE INTO processed_files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (file_hash, filename, status, datetime.datetime.now().isoformat(timespec='seconds'), run_id, output, message))
+        con.close()
+
+    def processed_status(self, file_hash):
+        """Get status ('done' or 'failed') of a previously processed input file, None if it has not been processed"""
+        with self.connect() as con:
+            row=con.execute('SELECT status FROM processed_files WHERE file_hash=?', (file_hash,)).fetchone()
+        con.close()
+        return row[0] if row is not None else None
+
+    def delete_run(self, run_id):
+        """Remove a run and all its records"""
+        log.info(f'Deleting run {run_id} from results store')
+        with self.connect() as con:
+            con.execute('DELETE FROM runs WHERE run_id=?', (run_id,))
+        con.close()
+
+    def query(self, sql, params=()):
+        """Run an arbitrary SQL query against the store and return the result as a DataFrame"""
+        with self.connect() as con:
+            df=pd.read_sql_query(sql, con, params=params)
+        con.close()
+        return df
+
+    def filter_clause(self, table, plate=None, well=None, compound=None, strain=None, concentration=None,
+                      date_from=None, date_to=None, metric=None, run_id=None):
+        """Build WHERE clause and parameters for the indexed columns"""
+        clauses=[]
+        params=[]
+        for column, value in ((f'{table}.plate', plate), (f'{table}.well', well), (f'{table}.compound', compound),
+                              (f'{table}.strain', strain), (f'{table}.concentration', concentration),
+                              (f'{table}.metric', metric), (f'{table}.run_id', run_id)):
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f'{column} IN ({", ".join("?"*len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'{column}=?')
+                params.append(value)
+        if date_from is not None:
+            clauses.append('runs.date>=?')
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append('runs.date<=?')
+            params.append(date_to)
+        where=' WHERE '+' AND '.join(clauses) if len(clauses)>0 else ''
+        return where, params
+
+    def runs(self, plate=None, date_from=None, date_to=None):
+        """Get recorded runs"""
+        where, params=self.filter_clause('runs', plate=plate, date_from=date_from, date_to=date_to)
+        return self.query(f'SELECT * FROM runs{where} ORDER BY run_id', params)
+
+    def metrics(self, wide=True, **filters):
+        """Get per-well metrics across runs, filtered by plate, well, compound, strain, concentration,
+        metric, run_id and/or date range. With wide=True, one column per metric is returned."""
+        log.info('Querying metrics from results store')
+        where, params=self.filter_clause('metrics', **filters)
+        df=self.query('SELECT metrics.*, runs.date FROM metrics JOIN runs ON metrics.run_id=runs.run_id'+where, params)
+        if wide and not df.empty:
+            index=['run_id', 'date', 'plate', 'well', 'row', 'col', 'compound', 'strain', 'concentration', 'unit']
+            df=df.pivot_table(index=index, columns='metric', values='value', dropna=False).reset_index()
+            df=df.dropna(axis=0, how='all', subset=[c for c in df.columns if not c in index]).reset_index(drop=True)
+            df.columns.name=None
+        return df
+
+    def replicate_stats(self, **filters):
+        """Get replicate standard deviations across runs"""
+        where, params=self.filter_clause('replicate_stats', **filters)
+        return self.query('SELECT replicate_stats.*, runs.date FROM replicate_stats JOIN runs ON replicate_stats.run_id=runs.run_id'+where, params)
+
+    def ecotox(self, call=None, **filters):
+        """Get LOEC/NOEC/MIC calls across runs"""
+        where, params=self.filter_clause('ecotox', **filters)
+        if call is not None:
+            where+=(' AND ' if where else ' WHERE ')+'ecotox.call=?'
+            params.append(call)
+        return self.query('SELECT ecotox.*, runs.date FROM ecotox JOIN runs ON ecotox.run_id=runs.run_id'+where, params)
+
+    def normalization(self, **filters):
+        """Get control levels and normalization factors across runs"""
+        where, params=self.filter_clause('normalization', **filters)
+        return self.query('SELECT normalization.*, runs.date FROM normalization JOIN runs ON normalization.run_id=runs.run_id'+where, params)
+
+    def curves(self, after=0, **filters):
+        """Get stored curve vectors with curve_id greater than after (i.e. added since), filtered by plate, well, run_id
+        and/or date range.
+        Returns dataframe with curve_id, run_id, date, plate, well, sample metadata and the time range of each curve,
+        and the (curves, points) matrix of vectors."""
+        log.info('Querying curves from results store')
+        where, params=self.filter_clause('curves', **filters)
+        where+=(' AND ' if where else ' WHERE ')+'curves.curve_id>?'
+        params.append(after)
+        #Metadata of the sample, from any of its metrics
+        meta=', '.join(f'(SELECT metrics.{c} FROM metrics WHERE metrics.run_id=curves.run_id AND metrics.well=curves.well LIMIT 1) AS {c}'
+                       for c in METADATA_COLUMNS)
+        df=self.query(f"""SELECT curves.curve_id, curves.run_id, runs.date, curves.plate, curves.well, {meta},
+                          curves.start_hour, curves.end_hour, curves.vector FROM curves JOIN runs ON curves.run_id=runs.run_id{where}
+                          ORDER BY curves.curve_id""", params)
+        vectors=np.frombuffer(b''.join(df.pop('vector')), dtype=np.float32)
+        return df, vectors.reshape(len(df), -1) if len(df)>0 else np.empty((0, 0), dtype=np.float32)
+
+    def control_reference(self, control_wells=None, **filters):
+        """Get a reference level for control well normalization: the median control level of previous runs,
+        optionally restricted to runs with the same control wells. None if there are no such runs."""
+        log.info('Getting control reference from results store')
+        df=self.normalization(**filters)
+        if control_wells is not None:
+            df=df[df['control_wells']==control_wells]
+        levels=df['control_level'].dropna()
+        return float(levels.median()) if len(levels)>0 else None
+
+    def aggregate(self, metric, by=('compound', 'concentration'), **filters):
+        """Aggregate a metric across experiments, e.g. mean AUC per compound and concentration"""
+        log.info(f'Aggregating {metric} in results store')
+        by=list(by)
+        where, params=self.filter_clause('metrics', metric=metric, **filters)
+        columns=', '.join(f'metrics.{b}' if not b=='date' else 'runs.date' for b in by)
+        sql=f"""SELECT {columns}, COUNT(metrics.value) AS n, AVG(metrics.value) AS mean,
+                AVG(metrics.value*metrics.value)-AVG(metrics.value)*AVG(metrics.value) AS var,
+                MIN(metrics.value) AS min, MAX(metrics.value) AS max
+                FROM metrics JOIN runs ON metrics.run_id=runs.run_id{where}
+                GROUP BY {columns} ORDER BY {columns}"""
+        df=self.query(sql, params)
+        df['std']=df.pop('var').clip(lower=0)**0.5
+        return df
@@ -0,0 +1,232 @@
+import io
+import os
+import json
+import math
+import threading
+import socketserver
+import concurrent.futures
+import urllib.parse
+import numpy as np
+import pandas as pd
+import logging as log
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from analysis import GrowthAnalysis, AnalysisError, RESULT_NAMES, load_layouts, read_plate, resource_path
+
+#Request bodies larger than this are rejected
+MAX_BODY=64*1024*1024
+
+def to_json(value):
+    """Convert analysis results (dataframes, numpy values, NaN) into JSON serializable objects"""
+    if isinstance(value, pd.DataFrame):
+        return {c:to_json(list(value[c])) for c in value.columns}
+    if isinstance(value, dict):
+        return {str(k):to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_json(v) for v in value]
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) or math.isinf(value) else float(value)
+    return value
+
+def warm_up():
+    """Executed once in every worker process, so library imports and first-call overhead are paid at startup"""
+    GrowthAnalysis(load_layouts()['Custom'])
+    return os.getpid()
+
+def run_job(params, filename=None, content=None, data=None, curves=False):
+    """Analyse one plate in a worker process. The plate is provided either as path to a file on the server,
+    as file content (bytes) with a filename determining the format, or as dictionary of columns ('Hour' and wells)."""
+    if data is not None:
+        df=pd.DataFrame(data)
+        df.rename({c:c.strip() for c in df.columns}, axis=1, inplace=True)
+    else:
+        df=read_plate(filename, io.BytesIO(content) if content is not None else None)
+
+    try:
+        results=dict(zip(RESULT_NAMES, GrowthAnalysis(params).analyse(df)))
+    except AnalysisError as e:
+        raise RuntimeError(f'Analysis failed: {e}')
+
+    response={k:results[k] for k in ('metrics', 'lowecs', 'noecs', 'mics', 'conc_dict', 'std_dict', 'phases', 'outliers', 'synergy', 'normalization')}
+    if curves:
+        response['processed']=results['df']
+        if params['smoothen']==1:
+            response['smoothened']=results['shifted_gams']
+        response['derivative']=results['derivative']
+        response['log_derivative']=results['log_derivative']
+        response['edge_correction']=results['edge_correction']
+    return to_json(response)
+
+
+class AnalysisEngine:
+    """Resident analysis engine: a pool of warm worker processes behind a bounded request queue,
+    and plate layouts that are only reloaded when default_layouts.txt changes"""
+    def __init__(self, workers=2, queue_size=16, timeout=300):
+        log.info('Starting analysis engine')
+        self.pool=concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self.workers=workers
+        #Requests that are running or waiting for a worker - further requests are rejected
+        self.slots=threading.BoundedSemaphore(workers+queue_size)
+        self.queue_size=queue_size
+        #Seconds a request waits for its result, including the time in the queue
+        self.timeout=timeout
+        self.active=0
+        self.lock=threading.Lock()
+        self.layouts_mtime=None
+        self.layouts={}
+        self.get_layouts()
+        for f in [self.pool.submit(warm_up) for i in range(workers)]:
+            f.result()
+
+    def get_layouts(self):
+        """Get plate layouts, reloading them if the layout file has been modified"""
+        mtime=os.path.getmtime(resource_path('default_layouts.txt'))
+        with self.lock:
+            if mtime!=self.layouts_mtime:
+                self.layouts=load_layouts()
+                self.layouts_mtime=mtime
+            return self.layouts
+
+    def layout_params(self, layout=None, params=None):
+        """Combine named layout and explicitly given parameters - parameters that are not provided are taken from 'Custom'"""
+        layouts=self.get_layouts()
+        if layout is not None and not layout in layouts:
+            raise KeyError(f'Unknown layout {layout}')
+        return {**layouts['Custom'], **layouts.get(layout, {}), **(params or {})}
+
+    def submit(self, params, **job):
+        """Queue an analysis job, returns None if the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            return None
+        with self.lock:
+            self.active+=1
+        future=self.pool.submit(run_job, params, **job)
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future):
+        """Free queue slot of a finished job"""
+        with self.lock:
+            self.active-=1
+        self.slots.release()
+
+    def status(self):
+        """Get number of workers, jobs in progress and queue size"""
+        with self.lock:
+            return {'status':'ok', 'workers':self.workers, 'active':self.active, 'queue_size':self.queue_size}
+
+    def shutdown(self):
+        """Stop worker processes"""
+        log.info('Stopping analysis engine')
+        self.pool.shutdown(cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface to the analysis engine.
+    GET  /health           status of the engine
+    GET  /layouts          available plate layouts
+    POST /analyse          JSON body: {"layout": name, "params": {...}, "file": path or "data": {"Hour": [...], "A01": [...], ...}, "curves": false}
+    POST /analyse?layout=name&filename=plate.xlsx   raw .xlsx/.csv file content as body"""
+    server_version='BGCA'
+
+    def log_message(self, format, *args):
+        log.info(format % args)
+
+    def send_json(self, code, content):
+        body=json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        engine=self.server.engine
+        path=urllib.parse.urlparse(self.path).path
+        if path=='/health':
+            self.send_json(200, engine.status())
+        elif path=='/layouts':
+            self.send_json(200, engine.get_layouts())
+        else:
+            self.send_json(404, {'error':f'Unknown path {path}'})
+
+    def do_POST(self):
+        engine=self.server.engine
+        url=urllib.parse.urlparse(self.path)
+        if url.path!='/analyse':
+            self.send_json(404, {'error':f'Unknown path {url.path}'})
+            return
+
+        length=int(self.headers.get('Content-Length', 0))
+        if length>MAX_BODY:
+            self.send_json(413, {'error':'Request too large'})
+            return
+        body=self.rfile.read(length)
+
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                request=json.loads(body)
+                if not isinstance(request, dict):
+                    raise ValueError('Request body must be a JSON object')
+                if not isinstance(request.get('params') or {}, dict):
+                    raise ValueError('"params" must be a JSON object')
+                job={'filename':request.get('file'), 'data':request.get('data'), 'curves':request.get('curves', False)}
+                if job['filename'] is None and job['data'] is None:
+                    raise ValueError('Either "file" or "data" must be provided')
+                params=engine.layout_params(request.get('layout'), request.get('params'))
+            else:
+                query=dict(urllib.parse.parse_qsl(url.query))
+                job={'filename':query.get('filename', 'upload.xlsx'), 'content':body, 'curves':query.get('curves', '')=='1'}
+                params=engine.layout_params(query.get('layout'))
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'error':str(e)})
+            return
+
+        future=engine.submit(params, **job)
+        if future is None:
+            self.send_json(503, {'error':'Server busy, too many queued requests'})
+            return
+        try:
+            self.send_json(200, future.result(timeout=engine.timeout))
+        except concurrent.futures.TimeoutError:
+            #Queued jobs are cancelled, a running job keeps its worker until it finishes
+            future.cancel()
+            log.error(f'Analysis did not finish within {engine.timeout} s')
+            self.send_json(504, {'error':f'Analysis did not finish within {engine.timeout} s'})
+        except Exception as e:
+            log.error(f'Error: {e}')
+            self.send_json(422, {'error':str(e)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a unix domain socket"""
+    daemon_threads=True
+
+    def get_request(self):
+        request, client_address=super().get_request()
+        #BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('unix', 0)
+
+def serve(host='127.0.0.1', port=8765, socket_path=None, workers=2, queue_size=16, timeout=300):
+    """Start analysis server on a TCP port or unix socket, until interrupted"""
+    engine=AnalysisEngine(workers=workers, queue_size=queue_size, timeout=timeout)
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd=UnixHTTPServer(socket_path, RequestHandler)
+        log.info(f'Serving on {socket_path}')
+    else:
+        httpd=ThreadingHTTPServer((host, port), RequestHandler)
+        log.info(f'Serving on http://{host}:{port}')
+    httpd.engine=engine
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        engine.shutdown()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,76 @@
+import json
+import numpy as np
+import pandas as pd
+import logging as log
+
+#Session files are numpy .npz archives (zip, compressed). Numeric columns of each dataframe are stored as one
+#float64 matrix, string columns as unicode arrays, everything else as a JSON document. No pickles are
+#used, so session files can be loaded safely with allow_pickle=False.
+SESSION_VERSION=1
+
+def frame_to_arrays(name, df):
+    """Split dataframe into arrays that can be written to a .npz archive, returns arrays and column description"""
+    arrays={}
+    columns=[]
+    numeric=[c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    if len(numeric)>0:
+        arrays[f'{name}__values']=df[numeric].to_numpy(dtype=np.float64)
+    for i, c in enumerate(df.columns):
+        if c in numeric:
+            #The dtype restores integer and boolean columns, which are stored as float64
+            columns.append({'name':str(c), 'kind':'numeric', 'index':numeric.index(c), 'dtype':str(df[c].dtype)})
+        else:
+            #Converted on a copy: Series.astype(str) can modify object columns of unpickled dataframes in place
+            arrays[f'{name}__col{i}']=df[c].to_numpy(dtype=object, copy=True).astype(str)
+            columns.append({'name':str(c), 'kind':'str', 'key':f'{name}__col{i}'})
+            #Missing values would otherwise be restored as 'nan' or 'None'
+            if df[c].isna().any():
+                arrays[f'{name}__missing{i}']=df[c].isna().to_numpy()
+                columns[-1]['missing']=f'{name}__missing{i}'
+    return arrays, columns
+
+def arrays_to_frame(name, archive, columns):
+    """Rebuild dataframe from arrays written by frame_to_arrays"""
+    data={}
+    for c in columns:
+        if c['kind']=='numeric':
+            data[c['name']]=archive[f'{name}__values'][:, c['index']]
+            #Sessions written before dtypes were stored only contain float64 columns
+            if c.get('dtype', 'float64')!='float64':
+                data[c['name']]=pd.Series(data[c['name']]).astype(c['dtype']).to_numpy()
+        else:
+            data[c['name']]=archive[c['key']].astype(object)
+            if 'missing' in c:
+                data[c['name']][archive[c['missing']]]=np.nan
+    return pd.DataFrame(data, columns=[c['name'] for c in columns])
+
+def save_session(path, frames, state):
+    """Write dataframes (e.g raw, processed and smoothened curves, metrics) and JSON serializable
+    state (layout, parameters, LOEC/NOEC/MIC, ...) to a compressed session file"""
+    log.info(f'Saving session to {path}')
+    arrays={}
+    frame_columns={}
+    for name, df in frames.items():
+        if isinstance(df, pd.DataFrame):
+            a, cols=frame_to_arrays(name, df)
+            arrays.update(a)
+            frame_columns[name]=cols
+        else:
+            frame_columns[name]=None
+
+    meta={'version':SESSION_VERSION, 'frames':frame_columns, 'state':state}
+    arrays['meta']=np.array(json.dumps(meta))
+
+    #Write through file object, numpy would otherwise append .npz to the filename
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+def load_session(path):
+    """Read session file, returns dictionary of dataframes (None where no dataframe was stored) and the stored state"""
+    log.info(f'Loading session from {path}')
+    with np.load(path, allow_pickle=False) as archive:
+        meta=json.loads(str(archive['meta']))
+        if meta['version']>SESSION_VERSION:
+            raise ValueError(f'Session file version {meta["version"]} is not supported by this version of BGCA')
+        frames={name:arrays_to_frame(name, archive, cols) if cols is not None else None for name, cols in meta['frames'].items()}
+    return frames, meta['state']
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import logging as log
+from results_db import ResultsStore
+from kernels import curve_vectors, nearest_neighbours, squared_distances, kmeans
+
+#Similarity search over the curves of all runs recorded in the results store. Every curve is stored as normalized vector
+#(see kernels.curve_vectors), so that the distance between two curves depends on their shape only, not on their signal level.
+#Searches are exact (blocked matrix products over all curves), or for large archives approximate: the curves are grouped
+#into cells around k-means centers and only the curves of the cells nearest to the query are compared.
+
+#Number of curves above which searches are approximate by default
+APPROXIMATE_ABOVE=200000
+
+#Number of curves that the cell centers are fitted on
+TRAINING_CURVES=20000
+
+
+class CurveIndex:
+    """k nearest neighbour index over the curves of a results store. update() adds the curves of runs recorded since the
+    last update, so the index can be kept open while new plates are analysed."""
+    def __init__(self, store=None, approximate_above=APPROXIMATE_ABOVE, cells=None, probe=8):
+        log.info('Initializing curve index')
+        self.store=store if store is not None else ResultsStore()
+        self.approximate_above=approximate_above
+        self.cells=cells
+        self.probe=probe
+        self.info=pd.DataFrame()
+        self.vectors=np.empty((0, 0), dtype=np.float32)
+        self.norms=np.empty(0, dtype=np.float32)
+        self.last_id=0
+
+        #Cell centers, cell of every curve and the curves of each cell (curve order sorted by cell and the start of each cell
+        #in it) for approximate searches, fitted on first use
+        self.centers=None
+        self.labels=None
+        self.order=None
+        self.bounds=None
+        self.trained_size=0
+        self.update()
+
+    def __len__(self):
+        return len(self.info)
+
+    def update(self):
+        """Add curves recorded in the store since the last update. Returns the number of added curves."""
+        info, vectors=self.store.curves(after=self.last_id)
+        if len(info)==0:
+            return 0
+        log.info(f'Adding {len(info)} curves to curve index')
+        self.info=pd.concat([self.info, info], ignore_index=True) if len(self.info)>0 else info
+        self.vectors=np.concatenate([self.vectors, vectors]) if len(self.vectors)>0 else vectors
+        self.norms=np.concatenate([self.norms, (vectors*vectors).sum(axis=1)])
+        self.last_id=int(info['curve_id'].max())
+
+        #New curves join the nearest cell, the cells are fitted again once the index has doubled in size
+        if self.centers is not None:
+            if len(self.info)>2*self.trained_size:
+                self.train()
+            else:
+                self.labels=np.concatenate([self.labels, squared_distances(vectors, self.centers).argmin(axis=1)])
+                self.sort_cells()
+        return len(info)
+
+    def sort_cells(self):
+        """Group the curves by cell, so that the curves of a cell are a slice of order"""
+        self.order=np.argsort(self.labels, kind='stable')
+        self.bounds=np.searchsorted(self.labels[self.order], np.arange(len(self.centers)+1))
+
+    def train(self):
+        """Fit cell centers for approximate searches with k-means on (a sample of) the curves"""
+        n=len(self.info)
+        cells=self.cells or max(1, int(np.sqrt(n)))
+        log.info(f'Fitting {cells} cells of curve index')
+        rng=np.random.default_rng(0)
+        sample=self.vectors[rng.choice(n, TRAINING_CURVES, replace=False)] if n>TRAINING_CURVES else self.vectors
+        labels, self.centers, inertia=kmeans(sample.astype(np.float64), cells, iterations=20, restarts=1)
+        self.centers=self.centers.astype(np.float32)
+        self.labels=np.concatenate([squared_distances(self.vectors[a:a+TRAINING_CURVES], self.centers).argmin(axis=1)
+                                    for a in range(0, n, TRAINING_CURVES)])
+        self.sort_cells()
+        self.trained_size=n
+
+    def search(self, queries, k=10, approximate=None):
+        """Find the k nearest curves of normalized query vectors (see kernels.curve_vectors). With approximate=None, searches
+        are approximate if the index holds more than approximate_above curves. Returns indices (queries, k) into the index
+        and distances."""
+        queries=np.atleast_2d(queries).astype(np.float32)
+        approximate=len(self)>self.approximate_above if approximate is None else approximate
+        if not approximate or len(self)<=k:
+            return nearest_neighbours(self.vectors, queries, k, self.norms)
+
+        if self.centers is None:
+            self.train()
+        indices=np.zeros((queries.shape[0], k), dtype=np.int64)
+        distances=np.full((queries.shape[0], k), np.inf, dtype=np.float32)
+        cells=np.argsort(squared_distances(queries, self.centers), axis=1)[:, :self.probe]
+        for i, q in enumerate(queries):
+            candidates=np.concatenate([self.order[self.bounds[c]:self.bounds[c+1]] for c in cells[i]])
+            idx, d=nearest_neighbours(self.vectors[candidates], q, k, self.norms[candidates])
+            indices[i, :idx.shape[1]]=candidates[idx[0]]
+            distances[i, :idx.shape[1]]=d[0]
+        return indices, distances
+
+    def query(self, df, k=10, approximate=None, exclude_runs=()):
+        """Find the k most similar recorded curves for each curve of a plate (dataframe with 'Hour' column followed by one
+        column per sample), skipping curves of the runs in exclude_runs (e.g the run of the plate itself). Returns dataframe
+        with the sample, the rank, the matched curve (run, date, plate, well, metadata), the distance and the correlation."""
+        log.info('Querying curve index')
+        self.update()
+        samples=[c for c in df.columns if not c=='Hour']
+        queries=curve_vectors(df['Hour'].to_numpy(dtype=np.float64), df[samples].to_numpy(dtype=np.float64).T)
+        valid=np.isfinite(queries).all(axis=1)
+        columns=['sample', 'rank', *self.info.columns, 'distance', 'correlation']
+        if len(self)==0 or not valid.any():
+            return pd.DataFrame(columns=columns)
+
+        excluded=self.info['run_id'].isin(list(exclude_runs)).to_numpy()
+        indices, distances=self.search(queries[valid], k+int(excluded.sum()) if excluded.any() else k, approximate)
+        frames=[]
+        for sample, idx, d in zip(np.asarray(samples)[valid], indices, distances):
+            keep=np.isfinite(d) & ~excluded[idx]
+            matches=self.info.iloc[idx[keep][:k]].reset_index(drop=True)
+            matches.insert(0, 'sample', sample)
+            matches.insert(1, 'rank', np.arange(1, len(matches)+1))
+            matches['distance']=d[keep][:k]
+            #For unit length vectors, the squared distance is 2-2*correlation
+            matches['correlation']=1-matches['distance']**2/2
+            frames.append(matches)
+        return pd.concat(frames, ignore_index=True)[columns]
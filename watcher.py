@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import zipfile
+import concurrent.futures
+import logging as log
+from analysis import GrowthAnalysis, AnalysisError, RESULT_NAMES, load_layouts, result_filename, export_results, analysed_curves
+from results_db import ResultsStore
+from ingest import INPUT_EXTENSIONS
+
+def file_hash(path, chunk_size=1<<20):
+    """Get SHA-256 hash of file content"""
+    h=hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def sidecar_files(path):
+    """Possible layout sidecar files of an input file"""
+    return (path+'.layout', os.path.splitext(path)[0]+'.layout')
+
+def sidecar_mtimes(path):
+    """Modification times of the existing layout sidecar files of an input file (None for missing ones)"""
+    return tuple(os.path.getmtime(s) if os.path.isfile(s) else None for s in sidecar_files(path))
+
+def select_layout(path, layouts, patterns=(), default_layout=None):
+    """Select plate layout for an input file. A sidecar file (<input file>.layout or <input name>.layout) containing
+    either a layout name or a JSON dictionary with layout parameters takes precedence, followed by the first matching
+    filename pattern, e.g ('*biocide*', 'Biocides'), and finally the default layout. Returns layout name and parameters."""
+    log.info(f'Selecting layout for {path}')
+    for sidecar in sidecar_files(path):
+        if os.path.isfile(sidecar):
+            with open(sidecar, 'r') as f:
+                content=f.read().strip()
+            if content.startswith('{'):
+                params=json.loads(content)
+                #Parameters that are not provided are taken from the 'Custom' layout
+                return params.get('name', os.path.basename(sidecar)), {**layouts['Custom'], **params}
+            return content, layouts[content]
+
+    for pattern, name in patterns:
+        if fnmatch.fnmatch(os.path.basename(path).lower(), pattern.lower()):
+            return name, layouts[name]
+
+    if default_layout is not None:
+        return default_layout, layouts[default_layout]
+    return None, None
+
+def analyse_file(path, params, outdir):
+    """Analyse a single plate export and write the results to excel. Runs in a worker process."""
+    log.info(f'Analysing {path}')
+    analysis=GrowthAnalysis(params)
+    try:
+        results=dict(zip(RESULT_NAMES, analysis.growth_metrics(path)))
+    except AnalysisError as e:
+        raise RuntimeError(f'Analysis of {path} failed: {e}')
+
+    outfile=result_filename(os.path.join(outdir, os.path.splitext(os.path.basename(path))[0]), params)
+    export_results(outfile, results, params)
+    results['output']=outfile
+    return results
+
+
+class FolderWatcher:
+    """Watch a folder for new plate exports and analyse them automatically in a bounded pool of worker processes.
+    Files are only picked up once they are completely written, and are identified by a hash of their content,
+    so restarting the watcher does not reprocess files that were analysed before."""
+    def __init__(self, folder, outdir=None, default_layout=None, patterns=(), workers=2, poll=5, settle=10,
+                 db='bgca_results.db', recursive=False):
+        log.info(f'Initializing folder watcher for {folder}')
+        self.folder=os.path.abspath(folder)
+        self.outdir=os.path.abspath(outdir) if outdir is not None else os.path.join(self.folder, 'bgca_results')
+        self.default_layout=default_layout
+        self.patterns=list(patterns)
+        self.workers=workers
+        self.max_pending=2*workers
+        self.poll=poll
+        self.settle=settle
+        self.recursive=recursive
+        self.store=ResultsStore(db)
+        self.layouts=load_layouts()
+        os.makedirs(self.outdir, exist_ok=True)
+
+        #path: (size, mtime, sidecar mtimes, time at which they were first seen)
+        self.candidates={}
+        #path: (size, mtime, sidecar mtimes) of files that were already handled in this session - files are handled again
+        #when their layout sidecar changes, e.g after an invalid layout was corrected
+        self.handled={}
+
+    def scan(self):
+        """List input files in the watched folder, excluding results and temporary (lock) files"""
+        if self.recursive:
+            walk=((root, files) for root, dirs, files in os.walk(self.folder) if not os.path.abspath(root).startswith(self.outdir))
+        else:
+            walk=[(self.folder, [f for f in os.listdir(self.folder) if os.path.isfile(os.path.join(self.folder, f))])]
+        for root, files in walk:
+            for f in files:
+                if f.lower().endswith(INPUT_EXTENSIONS) and not f.startswith(('~$', '.')):
+                    yield os.path.join(root, f)
+
+    def is_ready(self, path, now):
+        """Check whether a file has been completely written: size and modification time have not changed
+        for the settle time, and the file can be opened (excel files must be complete zip archives)"""
+        try:
+            st=os.stat(path)
+        except OSError:
+            return False
+        key=(st.st_size, st.st_mtime, sidecar_mtimes(path))
+        if self.handled.get(path)==key:
+            return False
+
+        previous=self.candidates.get(path)
+        if previous is None or previous[:3]!=key:
+            self.candidates[path]=(*key, now)
+            return False
+        if now-previous[3]<self.settle or st.st_size==0:
+            return False
+
+        try:
+            if path.lower().endswith('.xlsx'):
+                return zipfile.is_zipfile(path)
+            with open(path, 'rb'):
+                return True
+        except OSError:
+            return False
+
+    def submit_ready(self, pool, pending):
+        """Submit completely written, not yet processed files to the worker pool, until the pool is full"""
+        now=time.time()
+        for path in sorted(self.scan()):
+            if len(pending)>=self.max_pending:
+                break
+            if path in pending.values() or not self.is_ready(path, now):
+                continue
+
+            self.handled[path]=self.candidates.pop(path)[:3]
+
+            content_hash=file_hash(path)
+            if self.store.processed_status(content_hash) is not None or content_hash in [f.job[1] for f in pending]:
+                log.info(f'{path} has been processed before, skipping')
+                continue
+
+            try:
+                layout_name, params=select_layout(path, self.layouts, self.patterns, self.default_layout)
+            except (KeyError, ValueError) as e:
+                #The layout is not part of the file content, so the file is not recorded as processed and is analysed
+                #once the layout is corrected
+                log.error(f'Invalid layout for {path}: {e}')
+                continue
+            if params is None:
+                log.warning(f'No layout found for {path}, skipping')
+                continue
+
+            #Files arrive one at a time, so plates with shared control wells are scaled onto the control level of the runs
+            #recorded before (the first plate only records its level)
+            if params.get('control_wells', '')!='' and params.get('control_reference', '')=='':
+                controls=', '.join(x.strip() for x in params['control_wells'].split(',') if x.strip()!='')
+                reference=self.store.control_reference(control_wells=controls)
+                if reference is not None:
+                    params={**params, 'control_reference':str(reference)}
+
+            log.info(f'Submitting {path} with layout {layout_name}')
+            future=pool.submit(analyse_file, path, params, self.outdir)
+            future.job=(path, content_hash, layout_name, params)
+            pending[future]=path
+
+    def finish(self, future):
+        """Record results of a finished analysis in the results store, or the failure if it did not succeed"""
+        path, content_hash, layout_name, params=future.job
+        try:
+            results=future.result()
+        except BaseException as e:
+            log.error(f'Analysis of {path} failed: {e}')
+            self.mark_failed(content_hash, path, str(e))
+            return
+
+        #Recording errors (e.g. a locked or full database) fail the file, but do not stop the watcher
+        try:
+            run_id=self.store.add_run(os.path.splitext(os.path.basename(path))[0], results['metrics'], params=params,
+                                      filename=path, layout=layout_name, std_dict=results['std_dict'], lowecs=results['lowecs'],
+                                      noecs=results['noecs'], mics=results['mics'], conc_dict=results['conc_dict'],
+                                      normalization=results['normalization'], curves=analysed_curves(results))
+            self.store.mark_processed(content_hash, path, 'done', run_id=run_id, output=results['output'])
+        except Exception as e:
+            log.error(f'Recording results of {path} failed: {e}')
+            self.mark_failed(content_hash, path, f'Recording results failed: {e}')
+            return
+        log.info(f'Finished {path}, results written to {results["output"]}')
+
+    def mark_failed(self, content_hash, path, message):
+        """Record a file as failed in the results store. If the store cannot be written either, the error is only logged
+        and the file is analysed again after a restart."""
+        try:
+            self.store.mark_processed(content_hash, path, 'failed', message=message)
+        except Exception as e:
+            log.error(f'Recording failure of {path} failed: {e}')
+
+    def run(self, once=False):
+        """Watch folder until interrupted. With once=True, process the files that are currently present
+        (without waiting for the settle time) and return."""
+        log.info(f'Watching {self.folder}')
+        if once:
+            self.settle=0
+        pending={}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while True:
+                    self.submit_ready(pool, pending)
+                    if once and len(pending)==0:
+                        #Files are registered as candidates on the first scan and submitted on the second one
+                        self.submit_ready(pool, pending)
+                        if len(pending)==0:
+                            break
+
+                    done, _=concurrent.futures.wait(list(pending), timeout=self.poll, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        pending.pop(future)
+                        self.finish(future)
+
+                    #wait() returns immediately if nothing is pending
+                    if len(pending)==0 and not once:
+                        time.sleep(self.poll)
+            except KeyboardInterrupt:
+                log.info('Stopping folder watcher')
+                for future in pending:
+                    future.cancel()